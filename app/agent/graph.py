@@ -1,21 +1,22 @@
 from langgraph.graph import StateGraph, END
 from app.agent.state import AgentState
 from app.agent.nodes import rule_filter_node, slm_tagger_node, alpha_detective_node, deep_dive_node
-from app.services.persistence import persist_result
+from app.services.persistence import persist_node
+from app.core.config import config
 
-def create_graph():
+def create_graph(entry_point: str = "rule_filter"):
     workflow = StateGraph(AgentState)
 
     workflow.add_node("rule_filter", rule_filter_node)
     workflow.add_node("slm_tagger", slm_tagger_node)
-    workflow.add_node("alpha_detective", alpha_detective_node) # 保留定义，暂时不连入流程
+    workflow.add_node("alpha_detective", alpha_detective_node) # ALPHA_ENABLED 时接入 L2 与 L3 之间
     workflow.add_node("deep_dive", deep_dive_node)
     
     # 每一阶段处理完后都执行持久化
-    workflow.add_node("persist", persist_result)
+    workflow.add_node("persist", persist_node)
 
     # 简化的流转逻辑
-    workflow.set_entry_point("rule_filter") # 实际入口控制在 main.py
+    workflow.set_entry_point(entry_point) # 实际入口控制在 main.py
 
     # 逻辑流转: L1 -> L2 -> L3 -> Persist
     workflow.add_conditional_edges(
@@ -23,16 +24,19 @@ def create_graph():
         lambda x: "slm_tagger" if x["status"] == "passed" else "persist"
     )
     
-    # 临时禁用 alpha_detective，直接流向 deep_dive
+    # alpha_detective 有总时限 (ALPHA_DEADLINE), 未开启时直接流向 deep_dive
+    next_node = "alpha_detective" if config.ALPHA_ENABLED else "deep_dive"
     workflow.add_conditional_edges(
         "slm_tagger",
-        lambda x: "deep_dive" if x["status"] == "passed" and (x.get("vibe_score") or 0) >= 60 else "persist"
+        lambda x: next_node if x["status"] == "passed" and (x.get("vibe_score") or 0) >= 60 else "persist"
     )
     
-    # workflow.add_edge("alpha_detective", "deep_dive") # 暂时移除
+    workflow.add_edge("alpha_detective", "deep_dive")
     workflow.add_edge("deep_dive", "persist")
     workflow.add_edge("persist", END)
 
     return workflow.compile()
 
 graph = create_graph()
+# L1 已在批量预过滤中完成时, 从 L2 开始执行
+filtered_graph = create_graph(entry_point="slm_tagger")
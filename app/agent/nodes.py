@@ -1,32 +1,27 @@
 ﻿import os
 import json
+import time
 import requests
-from langchain_openai import ChatOpenAI
+from typing import List
 from langchain_core.messages import SystemMessage, HumanMessage
 from app.agent.state import AgentState
 from app.core.config import config
+from app.core.metrics import observe_node, LLM_PARSE
+from app.core.structured import StructuredOutputError, parse_json_output, coerce_slm_item
+from app.core.llm_router import slm_router, llm_router
+from app.core.hedging import slm_hedger
 from app.services.alpha_detective import alpha_detective
+from app.services.tag_cache import tag_cache
+from app.services.checkpoints import checkpointed, checkpoint_output, resume_checkpoint, save_checkpoints, with_checkpoint
+from app.services.persistence import PartialReportWriter
+from app.services.report_freshness import check_report_freshness
 
 
-# 初始化 LLM 客户端
-def get_slm_llm():
-    return ChatOpenAI(
-        model=config.SLM_MODEL,
-        openai_api_key=config.LLM_API_KEY,
-        base_url=config.LLM_BASE_URL,
-        # model_kwargs={"response_format": {"type": "json_object"}}, # Disable JSON mode for compatibility
-        timeout=10,
-    )
-
-def get_deep_dive_llm():
-    return ChatOpenAI(
-        model=config.LLM_MODEL,
-        openai_api_key=config.LLM_API_KEY,
-        base_url=config.LLM_BASE_URL,
-        timeout=30,
-    )
+# LLM 调用统一经 slm_router / llm_router (按 endpoint 复用客户端, 共享 keep-alive 连接池)
+# JSON mode 因兼容性问题未开启: model_kwargs={"response_format": {"type": "json_object"}}
 
 
+@observe_node("rule_filter")
 def rule_filter_node(state: AgentState):
     """Layer 1: 规则清洗节点"""
     print(f"[*] [L1][Job:{state.get('job_id')}] 正在处理: {state['symbol']} ({state['contract']})")
@@ -57,53 +52,154 @@ def rule_filter_node(state: AgentState):
     return {**state, "status": "passed"}
 
 
+def _float_column(values, default=None):
+    """列式解析: 解析失败的位置填入 ValueError 实例, 由调用方决定如何处理"""
+    out = []
+    for value in values:
+        if value is None:
+            out.append(default)
+            continue
+        try:
+            out.append(float(value))
+        except (TypeError, ValueError) as e:
+            out.append(ValueError(str(e)))
+    return out
+
+
+@observe_node("rule_filter_batch")
+def rule_filter_batch(states: List[AgentState]) -> List[AgentState]:
+    """Layer 1 批量版: 整批 token 一次性按列计算阈值掩码, 判定顺序与 rule_filter_node 一致"""
+    datas = [state["data"] for state in states]
+    liquidity = _float_column([d.get("liquidity") or 0 for d in datas], default=0.0)
+    honeypot = [d.get("honeypot") is True for d in datas] if config.REQUIRE_NOT_HONEYPOT else [False] * len(datas)
+    buy_tax = _float_column([d.get("buy_tax") for d in datas])
+    sell_tax = _float_column([d.get("sell_tax") for d in datas])
+
+    def over_tax(column):
+        return [isinstance(v, float) and v > config.MAX_TAX for v in column]
+
+    def bad(column):
+        return [isinstance(v, ValueError) for v in column]
+
+    low_liq = [isinstance(v, float) and v < config.MIN_LIQUIDITY for v in liquidity]
+    masks = (
+        (bad(liquidity), "error", "liquidity parse error", liquidity),
+        (low_liq, "filtered", "Liquidity too low", None),
+        (honeypot, "filtered", "Honeypot detected", None),
+        (bad(buy_tax), "error", "tax parse error", buy_tax),
+        (over_tax(buy_tax), "filtered", "Buy tax too high", None),
+        (bad(sell_tax), "error", "tax parse error", sell_tax),
+        (over_tax(sell_tax), "filtered", "Sell tax too high", None),
+    )
+
+    results = []
+    for i, state in enumerate(states):
+        for mask, status, reason, column in masks:
+            if mask[i]:
+                if status == "error":
+                    results.append({**state, "status": "error", "error_msg": f"{reason}: {column[i]}"})
+                else:
+                    results.append({**state, "status": "filtered", "report": reason})
+                break
+        else:
+            results.append({**state, "status": "passed"})
+
+    passed = sum(1 for r in results if r["status"] == "passed")
+    print(f"[*] [L1][Batch] {len(states)} tokens: passed={passed} dropped={len(states) - passed}")
+    return results
+
+
 # 辅助函数：清洗 LLM 返回的 JSON 字符串
-def clean_json_output(content: str) -> dict:
-    """剥离 markdown 标签并解析 JSON"""
-    content = content.strip()
-    if content.startswith("```"):
-        # 移除 ```json 或 ``` 头部
-        lines = content.splitlines()
-        if lines[0].startswith("```"):
-            lines = lines[1:]
-        if lines[-1].startswith("```"):
-            lines = lines[:-1]
-        content = "\n".join(lines).strip()
-    return json.loads(content)
+def clean_json_output(content: str, model: str = "unknown"):
+    """容错解析 JSON: 忽略 markdown / 说明文字, 修复末尾逗号、截断等常见问题 (见 app.core.structured)"""
+    return parse_json_output(content, model)
 
 
-def slm_tagger_node(state: AgentState):
-    """Layer 2: SLM 快筛节点 (LangChain 版)"""
-    print(f"[*] [L2][Job:{state.get('job_id')}] 正在分析标签: {state['symbol']}")
+def response_model(response, default: str) -> str:
+    return (getattr(response, "response_metadata", None) or {}).get("model_name") or default
 
-    if not config.LLM_API_KEY:
-        print("[!] [L2] Missing LLM_API_KEY")
-        return {**state, "tags": ["Meme"], "vibe_score": 50, "status": "passed"}
 
-    try:
-        token_info = state.get("data", {})
-        input_data = {
-            "symbol": state['symbol'],
-            "name": state['name'],
-            "pair_created_at": str(token_info.get('pair_created_at', 'Unknown')),
-            "liquidity_usd": token_info.get('liquidity', '0'),
-            "description": token_info.get('description', 'N/A'),
-            "chain": token_info.get('chain', 'Unknown')
-        }
-
-        system_prompt = """Role: You are a Web3 Meme Coin Classifier. Your job is to extract narrative tags from basic token info.
+SLM_REASK_PROMPT = """Your previous reply could not be parsed ({error}).
+Rewrite it as a single JSON object with exactly these keys and nothing else:
+{{"tags": ["String"], "vibe_score": 0-100, "risk_level": "Low" | "Medium" | "High", "short_comment": "String"}}
+
+Previous reply:
+{content}"""
+
+
+def _reask_slm(content: str, model: str, error: Exception) -> dict:
+    """本地修复失败后的最后手段: 只把原输出发回去要求改写成 JSON, 不重发 token 数据"""
+    if not config.SLM_REASK:
+        raise error
+    print(f"[-] [L2] 输出无法解析 ({error}), 请求模型改写为 JSON")
+    messages = [
+        SystemMessage(content="You convert malformed model output into valid JSON. Output JSON only."),
+        HumanMessage(content=SLM_REASK_PROMPT.format(error=error, content=content[:2000])),
+    ]
+    response = slm_router.invoke(messages)
+    data = coerce_slm_item(clean_json_output(response.content, model))
+    LLM_PARSE.inc(model=model, outcome="reasked")
+    return data
+
+
+SLM_SYSTEM_PROMPT = """Role: You are a Web3 Meme Coin Classifier. Your job is to extract narrative tags from basic token info.
 Constraints:
 1. Output MUST be valid JSON only. No markdown, no conversation.
 2. Speed is key. Keep analysis shallow but accurate based on the name/bio.
 3. If the bio mentions "Fan token" or "Not affiliated", tag it as "Community/Imitation"."""
 
+SLM_TASK_PROMPT = """Task:
+1. Identify the "Narrative" (e.g., AI, Elon Musk, Dog, Cat, Frog, Politics, Trump).
+2. Judge the "Vibe" (e.g., Official-looking, Degen, Low-effort).
+3. Give a "Scam_Probability" (Low/Medium/High) based on the name (e.g. if it copies a famous coin name like 'PEPE2', it's 'Derivative')."""
+
+
+def slm_input_data(state: AgentState) -> dict:
+    token_info = state.get("data", {})
+    return {
+        "symbol": state['symbol'],
+        "name": state['name'],
+        "pair_created_at": str(token_info.get('pair_created_at', 'Unknown')),
+        "liquidity_usd": token_info.get('liquidity', '0'),
+        "description": token_info.get('description', 'N/A'),
+        "chain": token_info.get('chain', 'Unknown')
+    }
+
+
+def apply_slm_result(state: AgentState, data: dict) -> AgentState:
+    return {
+        **state,
+        "tags": data.get("tags", []),
+        "vibe_score": data.get("vibe_score", 50),
+        "risk_level": data.get("risk_level", "Medium"),
+        "short_comment": data.get("short_comment", ""),
+        "status": "passed",
+    }
+
+
+SLM_RESULT_FIELDS = ("tags", "vibe_score", "risk_level", "short_comment")
+
+
+def _cached_tags(state: AgentState, input_data: dict):
+    if state.get("bypass_cache"):
+        return None
+    cached = tag_cache.get(input_data)
+    if cached is not None:
+        print(f"[*] [L2][Job:{state.get('job_id')}] 标签缓存命中: {state['symbol']}")
+    return cached
+
+
+def _remember_tags(input_data: dict, result: AgentState):
+    if result.get("status") == "passed":
+        tag_cache.set(input_data, {field: result.get(field) for field in SLM_RESULT_FIELDS})
+
+
+def _slm_tag_one(state: AgentState, input_data: dict) -> AgentState:
+    try:
         user_prompt = f"""Analyze the following Token Data:
 {json.dumps(input_data, indent=2)}
 
-Task:
-1. Identify the "Narrative" (e.g., AI, Elon Musk, Dog, Cat, Frog, Politics, Trump).
-2. Judge the "Vibe" (e.g., Official-looking, Degen, Low-effort).
-3. Give a "Scam_Probability" (Low/Medium/High) based on the name (e.g. if it copies a famous coin name like 'PEPE2', it's 'Derivative').
+{SLM_TASK_PROMPT}
 
 Return JSON format:
 {{
@@ -113,28 +209,141 @@ Return JSON format:
   "short_comment": "Max 10 words summary"
 }}"""
 
-        llm = get_slm_llm()
         messages = [
-            SystemMessage(content=system_prompt),
+            SystemMessage(content=SLM_SYSTEM_PROMPT),
             HumanMessage(content=user_prompt)
         ]
         
-        response = llm.invoke(messages)
-        data = clean_json_output(response.content)
-        
-        return {
-            **state,
-            "tags": data.get("tags", []),
-            "vibe_score": data.get("vibe_score", 50),
-            "risk_level": data.get("risk_level", "Medium"),
-            "short_comment": data.get("short_comment", ""),
-            "status": "passed",
-        }
+        if config.SLM_HEDGE:
+            response = slm_hedger.invoke(messages)
+        else:
+            response = slm_router.invoke(messages)
+        model = response_model(response, config.SLM_MODEL)
+        try:
+            data = coerce_slm_item(clean_json_output(response.content, model))
+        except StructuredOutputError as e:
+            data = _reask_slm(response.content, model, e)
+
+        result = apply_slm_result(state, data)
+        _remember_tags(input_data, result)
+        return result
     except Exception as e:
         print(f"[!] [L2] 报错: {e}")
         return {**state, "tags": ["Error"], "vibe_score": 0, "status": "error", "error_msg": str(e)}
 
 
+@checkpointed("slm_tagger", SLM_RESULT_FIELDS + ("status",))
+def _slm_tag_uncached(state: AgentState, input_data: dict) -> AgentState:
+    # 只有真正调用 SLM 的结果才写检查点, 缓存命中重跑没有成本
+    return _slm_tag_one(state, input_data)
+
+
+@observe_node("slm_tagger")
+def slm_tagger_node(state: AgentState):
+    """Layer 2: SLM 快筛节点 (LangChain 版)"""
+    print(f"[*] [L2][Job:{state.get('job_id')}] 正在分析标签: {state['symbol']}")
+
+    if not config.LLM_API_KEY:
+        print("[!] [L2] Missing LLM_API_KEY")
+        return {**state, "tags": ["Meme"], "vibe_score": 50, "status": "passed"}
+
+    input_data = slm_input_data(state)
+    cached = _cached_tags(state, input_data)
+    if cached is not None:
+        return apply_slm_result(state, cached)
+    return _slm_tag_uncached(state, input_data)
+
+
+def _coerced_slm_item(item):
+    """批量结果中的单个条目, 缺失或不符合 schema 时返回 None"""
+    try:
+        return coerce_slm_item(item) if item is not None else None
+    except StructuredOutputError:
+        return None
+
+
+@observe_node("slm_tagger_batch")
+def slm_tagger_batch(states: List[AgentState]) -> List[AgentState]:
+    """Layer 2 批量版: 多个 token 合并成一次请求, 按 job_id 拆回各自的 state
+
+    先查标签缓存; 模型漏掉或返回格式不对的条目回退到单 token 调用.
+    """
+    if not config.LLM_API_KEY:
+        return [slm_tagger_node(state) for state in states]
+
+    done, pending = {}, []
+    for state in states:
+        resumed = resume_checkpoint(state, "slm_tagger")
+        if resumed is not None:
+            done[state["job_id"]] = resumed
+            continue
+        input_data = slm_input_data(state)
+        cached = _cached_tags(state, input_data)
+        if cached is not None:
+            done[state["job_id"]] = apply_slm_result(state, cached)
+        else:
+            pending.append((state, input_data))
+
+    if len(pending) == 1:
+        state, input_data = pending[0]
+        done[state["job_id"]] = _slm_tag_one(state, input_data)
+    elif pending:
+        print(f"[*] [L2][Batch] 批量分析标签: {[state.get('job_id') for state, _ in pending]}")
+        tokens = [{"job_id": str(state["job_id"]), **input_data} for state, input_data in pending]
+
+        user_prompt = f"""Analyze each of the following {len(tokens)} tokens independently:
+{json.dumps(tokens, ensure_ascii=False)}
+
+{SLM_TASK_PROMPT}
+
+Return a JSON array with exactly one object per token, in any order:
+[
+  {{
+    "job_id": "String (copied from input)",
+    "tags": ["String", "String"],
+    "vibe_score": 0-100,
+    "risk_level": "Low" | "Medium" | "High",
+    "short_comment": "Max 10 words summary"
+  }}
+]"""
+
+        results = {}
+        try:
+            messages = [SystemMessage(content=SLM_SYSTEM_PROMPT), HumanMessage(content=user_prompt)]
+            response = slm_router.invoke(messages, timeout=config.SLM_BATCH_TIMEOUT)
+            data = clean_json_output(response.content, response_model(response, config.SLM_MODEL))
+            if isinstance(data, dict):
+                # 兼容 {"results": [...]} 或 {job_id: {...}} 两种包装
+                data = data.get("results") or [{"job_id": k, **v} for k, v in data.items() if isinstance(v, dict)]
+            for item in data if isinstance(data, list) else []:
+                if isinstance(item, dict) and item.get("job_id") is not None:
+                    results[str(item["job_id"])] = item
+        except Exception as e:
+            print(f"[!] [L2][Batch] 批量请求失败, 全部回退单条: {e}")
+
+        for state, input_data in pending:
+            item = _coerced_slm_item(results.get(str(state["job_id"])))
+            if item is not None:
+                result = apply_slm_result(state, item)
+                _remember_tags(input_data, result)
+            else:
+                print(f"[-] [L2][Batch][Job:{state.get('job_id')}] 缺失或格式错误, 回退单条调用")
+                result = _slm_tag_one(state, input_data)
+            done[state["job_id"]] = result
+
+    outputs = {
+        state["job_id"]: checkpoint_output(done[state["job_id"]], SLM_RESULT_FIELDS + ("status",))
+        for state, _ in pending
+        if done[state["job_id"]].get("status") == "passed"
+    }
+    if save_checkpoints("slm_tagger", outputs.items()):
+        for job_id, output in outputs.items():
+            done[job_id] = with_checkpoint(done[job_id], "slm_tagger", output)
+    return [done[state["job_id"]] for state in states]
+
+
+@observe_node("alpha_detective")
+@checkpointed("alpha_detective", ("alpha_data",), ok=lambda result: "error" not in (result.get("alpha_data") or {}))
 def alpha_detective_node(state: AgentState):
     """Layer 2.5: 链上 Alpha 探测节点"""
     print(f"[*] [L2.5][Job:{state.get('job_id')}] 正在扫描链上 Alpha: {state['symbol']} ({state['contract']})")
@@ -151,6 +360,8 @@ def alpha_detective_node(state: AgentState):
         return {**state, "alpha_data": {"error": str(e)}}
 
 
+@observe_node("deep_dive")
+@checkpointed("deep_dive", ("report", "report_id", "report_fingerprint", "status"))
 def deep_dive_node(state: AgentState):
     """Layer 3: LLM 深度研报节点 (Zivv Agent 侦探版)"""
     print(f"[*] [L3][Job:{state.get('job_id')}] 正在生成深度研报 (侦探视角): {state['symbol']}")
@@ -185,6 +396,11 @@ def deep_dive_node(state: AgentState):
 [DESCRIPTION]: {token_info.get('description', 'N/A')}
 """
 
+        # 输入无实质变化时沿用上一份研报 (persist 按 report_id 原地更新, 不新增行)
+        reuse, fingerprint = check_report_freshness(state, assembled_context)
+        if reuse is not None:
+            return {**state, **reuse, "report_fingerprint": None, "status": "passed"}
+
         system_prompt = """Role: You are 'Zivv Agent', a senior DeFi analyst and on-chain detective. 
 Tone: Professional, sharp, slightly skeptical (Degen style), but objective.
 Goal: Synthesize multiple data sources to determine if a token is a "Gem" (Buy) or a "Trap" (Avoid)."""
@@ -207,14 +423,51 @@ Output format (Markdown):
 
 Please write the report in Chinese, but keep the headers and token symbols in English for professional look."""
 
-        llm = get_deep_dive_llm()
         messages = [
             SystemMessage(content=system_prompt),
             HumanMessage(content=user_prompt)
         ]
         
-        response = llm.invoke(messages)
-        return {**state, "report": response.content, "status": "passed"}
+        if config.DEEP_DIVE_STREAMING:
+            return _stream_deep_dive(state, messages, fingerprint)
+
+        response = llm_router.invoke(messages)
+        return {**state, "report": response.content, "report_fingerprint": fingerprint, "status": "passed"}
     except Exception as e:
         print(f"[!] [L3] 报错: {e}")
         return {**state, "report": f"Failed: {e}", "status": "error", "error_msg": str(e)}
+
+
+def _stream_deep_dive(state: AgentState, messages, fingerprint=None) -> AgentState:
+    """流式生成研报: 定期把已生成内容写入 analysis_reports / Project.aiReport
+
+    超时或中途断流时, 已有内容足够长则保留截断版本而不是整单失败.
+    """
+    writer = PartialReportWriter(state)
+    parts = []
+    start = last_flush = time.time()
+    truncated = None
+    try:
+        for chunk in llm_router.stream(messages):
+            parts.append(chunk)
+            now = time.time()
+            if now - start > config.DEEP_DIVE_TIMEOUT:
+                truncated = f"timeout after {config.DEEP_DIVE_TIMEOUT}s"
+                break
+            if now - last_flush >= config.DEEP_DIVE_FLUSH_INTERVAL:
+                writer.flush("".join(parts))
+                last_flush = now
+    except Exception as e:
+        if len("".join(parts)) < config.DEEP_DIVE_MIN_PARTIAL_CHARS:
+            # 内容太短不保留: 撤销已写入的部分研报, 重试时重新生成
+            writer.discard()
+            raise
+        truncated = str(e)
+
+    report = "".join(parts)
+    if truncated:
+        print(f"[!] [L3][Job:{state.get('job_id')}] 研报生成中断 ({truncated}), 保留 {len(report)} 字符")
+        report += "\n\n> ⚠️ Report truncated (generation interrupted)."
+        # 截断的研报不记录指纹, 下次照常重新生成
+        fingerprint = None
+    return {**state, "report": report, "report_id": writer.report_id, "report_fingerprint": fingerprint, "status": "passed"}
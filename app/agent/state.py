@@ -13,6 +13,11 @@ class AgentState(TypedDict):
     risk_level: Optional[str]
     short_comment: Optional[str]
     report: Optional[str]
+    report_id: Optional[int]  # 流式生成时已插入的 analysis_reports.id
+    report_fingerprint: Optional[dict]  # 研报输入指纹 {fingerprint, inputs, reason}, 随研报一起落库
     alpha_data: Optional[dict]
     status: str  # 'passed', 'filtered', 'error'
     error_msg: Optional[str]
+    bypass_cache: Optional[bool]  # 跳过 L2 标签缓存, 强制重新打标
+    checkpoints: Optional[dict]  # 重试时加载的节点检查点 {node: output}
+    next_job: Optional[dict]  # CHAIN_STAGES: persist 时已认领的下一阶段任务 {id, token_id, stage}
@@ -0,0 +1,133 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+import psycopg2
+from app.core.db import get_db_connection
+
+
+class TTLCache:
+    """线程安全的进程内 LRU + TTL 缓存, 支持按条目覆盖 TTL"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, stored_at, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_entry(self, key):
+        """返回 (value, age_seconds), 未命中或已过期返回 None"""
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[2] <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0], now - entry[1]
+
+    def get(self, key, default=None):
+        entry = self.get_entry(key)
+        return default if entry is None else entry[0]
+
+    def set(self, key, value, ttl: float = None, age: float = 0.0):
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._data[key] = (value, now - age, now - age + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self._data)}
+
+
+class PgCacheTier:
+    """Postgres 共享缓存层, 多副本间共享命中结果 (表不存在时自动创建)"""
+
+    def __init__(self, table: str):
+        self.table = table
+        self._ready = False
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _ensure(self, cur):
+        if not self._ready:
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    cache_key TEXT PRIMARY KEY,
+                    value JSONB NOT NULL,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    expires_at TIMESTAMPTZ NOT NULL
+                )
+            """)
+            self._ready = True
+
+    def get_entry(self, key: str):
+        """返回 (value, age_seconds), 未命中返回 None; 数据库异常视为未命中"""
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                self._ensure(cur)
+                cur.execute(
+                    f"""
+                    SELECT value, EXTRACT(EPOCH FROM NOW() - updated_at) AS age
+                    FROM {self.table}
+                    WHERE cache_key = %s AND expires_at > NOW()
+                    """,
+                    (key,),
+                )
+                row = cur.fetchone()
+                conn.commit()
+        except psycopg2.Error as e:
+            self.errors += 1
+            print(f"[!] [Cache:{self.table}] 读取失败: {e}")
+            return None
+        finally:
+            conn.close()
+
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row["value"], float(row["age"])
+
+    def set(self, key: str, value, ttl: float):
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                self._ensure(cur)
+                cur.execute(
+                    f"""
+                    INSERT INTO {self.table} (cache_key, value, updated_at, expires_at)
+                    VALUES (%s, %s, NOW(), NOW() + %s * INTERVAL '1 second')
+                    ON CONFLICT (cache_key) DO UPDATE SET
+                        value = EXCLUDED.value,
+                        updated_at = EXCLUDED.updated_at,
+                        expires_at = EXCLUDED.expires_at
+                    """,
+                    (key, json.dumps(value), ttl),
+                )
+                conn.commit()
+        except psycopg2.Error as e:
+            self.errors += 1
+            print(f"[!] [Cache:{self.table}] 写入失败: {e}")
+        finally:
+            conn.close()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "errors": self.errors}
@@ -3,8 +3,44 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+
+def rate_limit_conf(name: str, rps: float = 10.0, concurrency: int = 16) -> dict:
+    """读取单个上游的限流配置: RATE_LIMIT_<NAME>_RPS / _BURST / _CONCURRENCY / _LATENCY_TARGET / _SHARED_RPS"""
+    prefix = f"RATE_LIMIT_{name.upper()}_"
+    rps = float(os.getenv(prefix + "RPS", rps))
+    return {
+        "rps": rps,
+        "burst": float(os.getenv(prefix + "BURST", rps)),
+        "concurrency": int(os.getenv(prefix + "CONCURRENCY", concurrency)),
+        "latency_target": float(os.getenv(prefix + "LATENCY_TARGET", "0")),  # 秒, 0 表示不按延迟降速
+        "shared_rps": float(os.getenv(prefix + "SHARED_RPS", "0")),  # 全部 worker 合计的 rps 上限, 0 表示不做跨进程协调
+    }
+
+
+def parse_endpoints(value: str, default_model: str, default_base_url: str, default_api_key: str) -> list:
+    """解析 "model@base_url#KEY_ENV,model2@base_url2" 形式的 endpoint 列表; 未配置时退化为单 endpoint"""
+    endpoints = []
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        item, _, key_env = item.partition("#")
+        model, _, base_url = item.partition("@")
+        endpoints.append({
+            "model": model or default_model,
+            "base_url": base_url or default_base_url,
+            "api_key": os.getenv(key_env) if key_env else default_api_key,
+        })
+    return endpoints or [{"model": default_model, "base_url": default_base_url, "api_key": default_api_key}]
+
+
 class Config:
     DATABASE_URL = os.getenv("DATABASE_URL")
+    DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+    DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+    DB_POOL_CHECK_IDLE = float(os.getenv("DB_POOL_CHECK_IDLE", "30"))  # 空闲超过 N 秒的连接取出前先 SELECT 1
     # Unified LLM Config
     LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://api.openai.com/v1")
     LLM_API_KEY = os.getenv("LLM_API_KEY") or os.getenv("OPENAI_API_KEY")
@@ -13,14 +49,152 @@ class Config:
     SLM_MODEL = os.getenv("SLM_MODEL", "deepseek/deepseek-v3.2")
     LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
 
+    # L2 批量打标: >1 时 stage 2 任务按 N 个一组合并请求
+    SLM_BATCH_SIZE = int(os.getenv("SLM_BATCH_SIZE", "1"))
+    SLM_BATCH_TIMEOUT = float(os.getenv("SLM_BATCH_TIMEOUT", "30"))
+
+    # L2 标签缓存 (按 name/symbol/description/chain 归一化哈希), TAG_CACHE_PG 开启跨副本共享
+    TAG_CACHE_ENABLED = os.getenv("TAG_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+    TAG_CACHE_SIZE = int(os.getenv("TAG_CACHE_SIZE", "10000"))
+    TAG_CACHE_TTL = float(os.getenv("TAG_CACHE_TTL", "21600"))
+    TAG_CACHE_PG = os.getenv("TAG_CACHE_PG", "false").lower() in ("1", "true", "yes")
+    TAG_CACHE_TABLE = os.getenv("TAG_CACHE_TABLE", "slm_tag_cache")
+    # cleaning_jobs.bypass_cache 默认由 migrations/002_bypass_cache.sql 添加; 开启后由 slot 0 / 单进程 worker 启动时补上
+    BYPASS_CACHE_ENSURE_SCHEMA = os.getenv("BYPASS_CACHE_ENSURE_SCHEMA", "false").lower() in ("1", "true", "yes")
+
+    # L2 对冲请求: 超过滚动 p9x 延迟仍未返回时向 (可选的) 备用模型/地址发副本, 先返回者胜出
+    SLM_HEDGE = os.getenv("SLM_HEDGE", "false").lower() in ("1", "true", "yes")
+    SLM_HEDGE_MODEL = os.getenv("SLM_HEDGE_MODEL")
+    SLM_HEDGE_BASE_URL = os.getenv("SLM_HEDGE_BASE_URL")
+    SLM_HEDGE_QUANTILE = float(os.getenv("SLM_HEDGE_QUANTILE", "0.95"))
+    SLM_HEDGE_MIN_DELAY = float(os.getenv("SLM_HEDGE_MIN_DELAY", "0.5"))
+    SLM_HEDGE_MAX_FRACTION = float(os.getenv("SLM_HEDGE_MAX_FRACTION", "0.1"))
+    SLM_HEDGE_MIN_SAMPLES = int(os.getenv("SLM_HEDGE_MIN_SAMPLES", "20"))
+
+    # L2 输出本地修复后仍无法解析时, 把原输出发回模型要求只返回 JSON (一次短请求), 关闭则直接按失败重试
+    SLM_REASK = os.getenv("SLM_REASK", "true").lower() in ("1", "true", "yes")
+
+    # L3 流式研报: 每 FLUSH_INTERVAL 秒写一次中间结果, 超时保留至少 MIN_PARTIAL_CHARS 的截断版本
+    DEEP_DIVE_STREAMING = os.getenv("DEEP_DIVE_STREAMING", "false").lower() in ("1", "true", "yes")
+    DEEP_DIVE_TIMEOUT = float(os.getenv("DEEP_DIVE_TIMEOUT", "30"))
+    DEEP_DIVE_FLUSH_INTERVAL = float(os.getenv("DEEP_DIVE_FLUSH_INTERVAL", "1"))
+    DEEP_DIVE_MIN_PARTIAL_CHARS = int(os.getenv("DEEP_DIVE_MIN_PARTIAL_CHARS", "200"))
+    # 研报复用: 输入指纹相同, 或数值字段的相对变化都低于阈值时沿用上一份研报; 超过 REPORT_MAX_AGE 秒强制重新生成
+    REPORT_GATING = os.getenv("REPORT_GATING", "true").lower() in ("1", "true", "yes")
+    REPORT_MAX_AGE = float(os.getenv("REPORT_MAX_AGE", "86400"))
+    REPORT_ENSURE_SCHEMA = os.getenv("REPORT_ENSURE_SCHEMA", "true").lower() in ("1", "true", "yes")  # 启动时自动建 report_fingerprints 表
+    REPORT_CHANGE_THRESHOLDS = {
+        "liquidity": float(os.getenv("REPORT_THRESHOLD_LIQUIDITY", "0.25")),
+        "market_cap": float(os.getenv("REPORT_THRESHOLD_MARKET_CAP", "0.25")),
+        "buy_tax": float(os.getenv("REPORT_THRESHOLD_BUY_TAX", "0.2")),
+        "sell_tax": float(os.getenv("REPORT_THRESHOLD_SELL_TAX", "0.2")),
+        "smart_money_count": float(os.getenv("REPORT_THRESHOLD_SMART_MONEY", "0.3")),
+        "avg_top_pnl": float(os.getenv("REPORT_THRESHOLD_TOP_PNL", "0.5")),
+    }
+
+    # 多 endpoint 路由 (按 EWMA 延迟/错误率选择, 连续失败熔断, 冷却后半开探测)
+    SLM_ENDPOINTS = parse_endpoints(os.getenv("SLM_ENDPOINTS"), SLM_MODEL, LLM_BASE_URL, LLM_API_KEY)
+    LLM_ENDPOINTS = parse_endpoints(os.getenv("LLM_ENDPOINTS"), LLM_MODEL, LLM_BASE_URL, LLM_API_KEY)
+    ROUTER_EWMA_ALPHA = float(os.getenv("ROUTER_EWMA_ALPHA", "0.2"))
+    ROUTER_FAILURE_THRESHOLD = int(os.getenv("ROUTER_FAILURE_THRESHOLD", "3"))
+    ROUTER_OPEN_SECONDS = float(os.getenv("ROUTER_OPEN_SECONDS", "30"))
+    ROUTER_MAX_ATTEMPTS = int(os.getenv("ROUTER_MAX_ATTEMPTS", "2"))
+
+    # LLM HTTP 连接池 (所有 ChatOpenAI 客户端共享)
+    LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+    LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "32"))
+    LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+
     # Proxy Config
     HTTP_PROXY = os.getenv("HTTP_PROXY")
     HTTPS_PROXY = os.getenv("HTTPS_PROXY")
 
     BATCH_SIZE = int(os.getenv("BATCH_SIZE", "20"))
     POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", "2"))
+    # 空闲时轮询间隔从 POLL_INTERVAL_MIN 指数退避; 开启 JOB_NOTIFY 后上限放宽到 POLL_INTERVAL_MAX (仅作兜底),
+    # 超过 POLL_INTERVAL 的等待不会越过最近一个延迟重试任务的 next_run_at
+    POLL_INTERVAL_MIN = float(os.getenv("POLL_INTERVAL_MIN", "0.05"))
+    POLL_INTERVAL_MAX = float(os.getenv("POLL_INTERVAL_MAX", "30"))
+    JOB_NOTIFY = os.getenv("JOB_NOTIFY", "false").lower() in ("1", "true", "yes")
+    JOB_NOTIFY_CHANNEL = os.getenv("JOB_NOTIFY_CHANNEL", "cleaning_jobs_ready")
+    JOB_NOTIFY_INSTALL_TRIGGER = os.getenv("JOB_NOTIFY_INSTALL_TRIGGER", "false").lower() in ("1", "true", "yes")
     MIN_LIQUIDITY = float(os.getenv("MIN_LIQUIDITY", "2000"))
     MAX_TAX = float(os.getenv("MAX_TAX", "0.20"))
     REQUIRE_NOT_HONEYPOT = os.getenv("REQUIRE_NOT_HONEYPOT", "true").lower() in ("1", "true", "yes")
+    # L1 批量预过滤: 拉取后整批判定, 被过滤的任务不进入 graph
+    PREFILTER_BATCH = os.getenv("PREFILTER_BATCH", "true").lower() in ("1", "true", "yes")
+
+    # On-chain Alpha 扫描
+    ALPHA_ENABLED = os.getenv("ALPHA_ENABLED", "false").lower() in ("1", "true", "yes")  # 将 alpha_detective 接入 graph
+    ALPHA_MAX_WORKERS = int(os.getenv("ALPHA_MAX_WORKERS", "10"))
+    ALPHA_DEADLINE = float(os.getenv("ALPHA_DEADLINE", "5"))
+    # 持仓者分页扫描: 关闭时只看第一页 (100 个账户)
+    HOLDERS_STREAMING = os.getenv("HOLDERS_STREAMING", "false").lower() in ("1", "true", "yes")
+    HOLDERS_MAX_PAGES = int(os.getenv("HOLDERS_MAX_PAGES", "50"))
+    # 钱包 PnL 缓存: 超过 REFRESH_AGE 的条目在扫描时刷新, 失败结果只缓存 NEGATIVE_TTL 秒
+    WALLET_PNL_CACHE_SIZE = int(os.getenv("WALLET_PNL_CACHE_SIZE", "50000"))
+    WALLET_PNL_TTL = float(os.getenv("WALLET_PNL_TTL", "3600"))
+    WALLET_PNL_NEGATIVE_TTL = float(os.getenv("WALLET_PNL_NEGATIVE_TTL", "120"))
+    WALLET_PNL_REFRESH_AGE = float(os.getenv("WALLET_PNL_REFRESH_AGE", "900"))
+    WALLET_PNL_CACHE_PG = os.getenv("WALLET_PNL_CACHE_PG", "false").lower() in ("1", "true", "yes")
+    WALLET_PNL_CACHE_TABLE = os.getenv("WALLET_PNL_CACHE_TABLE", "wallet_pnl_cache")
+
+    # 上游限流 (LLM / Helius / Birdeye 各一个 AIMD 限流器)
+    RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "30"))
+    RATE_LIMIT_SHARED = os.getenv("RATE_LIMIT_SHARED", "false").lower() in ("1", "true", "yes")
+    RATE_LIMIT_TABLE = os.getenv("RATE_LIMIT_TABLE", "upstream_rate_windows")
+    RATE_LIMITS = {
+        "llm": rate_limit_conf("llm", rps=20, concurrency=32),
+        "helius": rate_limit_conf("helius", rps=10, concurrency=10),
+        "birdeye": rate_limit_conf("birdeye", rps=15, concurrency=10),
+    }
+
+    # Worker Execution Config
+    WORKER_MODE = os.getenv("WORKER_MODE", "sync").lower()  # 'sync' | 'async'
+    MAX_INFLIGHT = int(os.getenv("MAX_INFLIGHT", "32"))
+    # Group commit: >1 时 persist 先进缓冲区, 满 N 条或等待超过 PERSIST_MAX_WAIT 秒一次提交
+    PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "1"))
+    PERSIST_MAX_WAIT = float(os.getenv("PERSIST_MAX_WAIT", "0.5"))
+    # 任务租约: 认领后每 JOB_LEASE_SECONDS/3 秒续约, 过期 (worker 崩溃 / 卡死超过 MAX_SECONDS) 的任务被回收重试
+    JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+    JOB_LEASE_MAX_SECONDS = float(os.getenv("JOB_LEASE_MAX_SECONDS", "900"))
+    JOB_LEASE_LEGACY_SECONDS = float(os.getenv("JOB_LEASE_LEGACY_SECONDS", "900"))  # 没有租约列的旧任务按 updated_at 计算
+    JOB_REAP_INTERVAL = float(os.getenv("JOB_REAP_INTERVAL", "30"))
+    # 默认不在启动时做 DDL (见 migrations/001_job_leases.sql); 开启后只由 slot 0 / 单进程 worker 执行
+    JOB_LEASE_ENSURE_SCHEMA = os.getenv("JOB_LEASE_ENSURE_SCHEMA", "false").lower() in ("1", "true", "yes")
+    # 节点检查点: 昂贵节点的结果写入 job_checkpoints, 重试时从上次成功的节点之后继续; 超过 MAX_AGE 秒的结果不再复用
+    CHECKPOINTS = os.getenv("CHECKPOINTS", "true").lower() in ("1", "true", "yes")
+    CHECKPOINT_MAX_AGE = float(os.getenv("CHECKPOINT_MAX_AGE", "3600"))
+    CHECKPOINT_ENSURE_SCHEMA = os.getenv("CHECKPOINT_ENSURE_SCHEMA", "true").lower() in ("1", "true", "yes")  # 启动时自动建 job_checkpoints 表
+    CHECKPOINT_NODES = {
+        node.strip() for node in os.getenv("CHECKPOINT_NODES", "slm_tagger,alpha_detective,deep_dive").split(",") if node.strip()
+    }
+    # Prefork: WORKER_PROCESSES > 1 时由 supervisor fork 多个 worker; MAX_INFLIGHT_TOTAL 为所有进程共享的在途上限 (0 不限制)
+    WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))
+    MAX_INFLIGHT_TOTAL = int(os.getenv("MAX_INFLIGHT_TOTAL", "0"))
+    SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "60"))  # SIGTERM 后等待在途任务完成的最长时间
+    STAGE_CONCURRENCY = {
+        1: int(os.getenv("STAGE1_CONCURRENCY", "16")),
+        2: int(os.getenv("STAGE2_CONCURRENCY", "16")),
+        3: int(os.getenv("STAGE3_CONCURRENCY", "8")),
+    }
+    # 阶段链式执行: 通过后的任务由当前 worker 直接认领下一阶段并沿用内存中的 state, 不再等队列轮询
+    # (只链到 stage 2; stage 3 仍走队列, 受 STAGE3_CONCURRENCY 限制)
+    CHAIN_STAGES = os.getenv("CHAIN_STAGES", "false").lower() in ("1", "true", "yes")
+    # 分阶段认领: weighted 按权重给每个 stage 分配每批名额 (某 stage 不足时让给其他 stage), fifo 为旧的 stage 升序
+    SCHEDULER_MODE = os.getenv("SCHEDULER_MODE", "weighted").lower()  # 'weighted' | 'fifo'
+    STAGE_WEIGHTS = {
+        1: float(os.getenv("STAGE1_WEIGHT", "1")),
+        2: float(os.getenv("STAGE2_WEIGHT", "1")),
+        3: float(os.getenv("STAGE3_WEIGHT", "1")),
+    }
+    # 同一 stage 内的优先级: none | liquidity | vibe_score; 等待时间按 SCHEDULER_AGING_SECONDS 折算加分, 避免低优先级饿死
+    SCHEDULER_PRIORITY = os.getenv("SCHEDULER_PRIORITY", "none").lower()
+    SCHEDULER_AGING_SECONDS = float(os.getenv("SCHEDULER_AGING_SECONDS", "300"))
+
+    # Prometheus 文本格式指标 (GET /metrics), 0 表示不开启
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_BACKLOG_TTL = float(os.getenv("METRICS_BACKLOG_TTL", "15"))  # 队列积压统计的缓存秒数, 只由 slot 0 导出
 
 config = Config()
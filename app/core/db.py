@@ -1,6 +1,272 @@
+import os
+import time
+import threading
+from collections import deque
 import psycopg2
+from psycopg2 import extensions
 from psycopg2.extras import RealDictCursor
 from app.core.config import config
 
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection:
+    """psycopg2 连接代理: close() 归还连接池而不是断开 TCP"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.putconn(conn)
+
+    @property
+    def closed(self):
+        return 1 if self._conn is None else self._conn.closed
+
+
+class ConnectionPool:
+    """线程安全的长连接池
+
+    - min/max 连接数
+    - 取出时健康检查 (空闲超过 check_idle 秒才发 SELECT 1)
+    - 断开 / 超龄连接自动回收重建
+    - 等待连接池的次数与耗时统计
+    """
+
+    def __init__(self, dsn, min_size=1, max_size=10, timeout=30.0, max_lifetime=1800.0, check_idle=30.0):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_idle = check_idle
+        self.pid = os.getpid()
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, last_used)
+        self._created_at = {}
+        self._size = 0
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "timeouts": 0,
+            "created": 0,
+            "recycled": 0,
+            "health_check_failures": 0,
+        }
+
+        for _ in range(min(self.min_size, self.max_size)):
+            try:
+                conn = self._connect()
+            except psycopg2.Error as e:
+                print(f"[!] [DBPool] 预热连接失败: {e}")
+                break
+            with self._cond:
+                self._size += 1
+                self._idle.append((conn, time.time()))
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, cursor_factory=RealDictCursor)
+        with self._cond:
+            self._created_at[id(conn)] = time.time()
+            self._stats["created"] += 1
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._created_at.pop(id(conn), None)
+            self._stats["recycled"] += 1
+
+    def _expired(self, conn) -> bool:
+        if not self.max_lifetime:
+            return False
+        return time.time() - self._created_at.get(id(conn), 0) > self.max_lifetime
+
+    def _healthy(self, conn, last_used) -> bool:
+        if conn.closed or self._expired(conn):
+            return False
+        if self.check_idle is not None and time.time() - last_used >= self.check_idle:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                with self._cond:
+                    self._stats["health_check_failures"] += 1
+                return False
+        return True
+
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        start = time.time()
+        waited = False
+
+        while True:
+            conn = None
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = timeout - (time.time() - start)
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"no connection available within {timeout}s (size={self._size})")
+                    waited = True
+                    self._cond.wait(remaining)
+
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                else:
+                    self._size += 1
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._healthy(conn, last_used):
+                self._discard(conn)
+                with self._cond:
+                    self._size -= 1
+                continue
+
+            wait_time = time.time() - start
+            with self._cond:
+                self._stats["checkouts"] += 1
+                if waited:
+                    self._stats["waits"] += 1
+                    self._stats["wait_time_total"] += wait_time
+                    self._stats["wait_time_max"] = max(self._stats["wait_time_max"], wait_time)
+            return conn
+
+    def putconn(self, conn):
+        broken = bool(conn.closed)
+        if not broken:
+            status = conn.get_transaction_status()
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                broken = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                # 调用方未提交的事务一律回滚, 防止脏状态泄漏给下一个使用者
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+
+        if broken or self._expired(conn):
+            self._discard(conn)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.time()))
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                **self._stats,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "max_size": self.max_size,
+            }
+
+    def closeall(self):
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._size -= 1
+                self._created_at.pop(id(conn), None)
+                conn.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    # fork 之后子进程不能复用父进程的 socket, 按 pid 重建
+    if _pool is None or _pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                _pool = ConnectionPool(
+                    config.DATABASE_URL,
+                    min_size=config.DB_POOL_MIN,
+                    max_size=config.DB_POOL_MAX,
+                    timeout=config.DB_POOL_TIMEOUT,
+                    max_lifetime=config.DB_POOL_MAX_LIFETIME,
+                    check_idle=config.DB_POOL_CHECK_IDLE,
+                )
+    return _pool
+
+
 def get_db_connection():
-    return psycopg2.connect(config.DATABASE_URL, cursor_factory=RealDictCursor)
+    """从连接池借出连接, 调用方 conn.close() 即归还"""
+    pool = get_pool()
+    return PooledConnection(pool, pool.getconn())
+
+
+def pool_stats() -> dict:
+    return get_pool().stats() if _pool is not None else {}
+
+
+def table_exists(name: str) -> bool:
+    """可选功能的表是否存在 (未建表时调用方自行停用该功能)"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass(%s) IS NOT NULL AS present", (name,))
+            return cur.fetchone()["present"]
+    finally:
+        conn.close()
+
+
+def missing_columns(table: str, columns) -> list:
+    """columns 中 table 还没有的列 (只读 information_schema, 不加锁)"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT column_name FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = %s AND column_name = ANY(%s)
+                """,
+                (table, list(columns)),
+            )
+            present = {row["column_name"] for row in cur.fetchall()}
+            conn.rollback()
+    finally:
+        conn.close()
+    return [column for column in columns if column not in present]
+
+
+def execute_autocommit(sql: str):
+    """在事务外执行 (CREATE INDEX CONCURRENTLY 等不能放在事务块里的语句)"""
+    conn = get_db_connection()
+    try:
+        conn.set_session(autocommit=True)
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql)
+        finally:
+            conn.set_session(autocommit=False)
+    finally:
+        conn.close()
@@ -0,0 +1,207 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from app.core.config import config
+from app.core.llm import get_chat_client
+from app.core.ratelimit import RateLimitTimeout, Slot, get_limiter
+from app.core.metrics import record_llm_usage
+from app.core.llm_router import HALF_OPEN, Endpoint, slm_router
+
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    """进程级后台事件循环: 对冲请求需要可取消的 ainvoke, 同步节点通过它提交协程"""
+    global _loop, _loop_pid
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            threading.Thread(target=_loop.run_forever, name="llm-hedge-loop", daemon=True).start()
+        return _loop
+
+
+class LatencyWindow:
+    """最近 N 次主请求的延迟, 用于估计 p9x
+
+    被对冲取消的主请求记为取消时已耗的时间 (删失样本, 真实延迟只会更长), 否则窗口只剩快请求, p9x 持续偏低.
+    """
+
+    def __init__(self, size: int):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, latency: float):
+        with self._lock:
+            self._samples.append(latency)
+
+    def quantile(self, q: float, min_samples: int):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Hedger:
+    """对冲请求: 主请求超过滚动 p9x 仍未返回时发出副本, 先成功者胜出, 另一个被取消
+
+    对冲次数占总请求的比例不超过 max_fraction.
+    """
+
+    def __init__(self, name, router, timeout, hedge_override=None, quantile=0.95, min_delay=0.5,
+                 max_fraction=0.1, window=200, min_samples=20):
+        self.name = name
+        self.router = router
+        self.timeout = timeout
+        self.hedge_override = hedge_override  # 指定备用 Endpoint, 否则用路由器的次优 endpoint
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.max_fraction = max_fraction
+        self.min_samples = min_samples
+        self.latency = LatencyWindow(window)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "hedged": 0, "hedge_wins": 0, "budget_skips": 0, "failures": 0}
+
+    def hedge_delay(self):
+        estimate = self.latency.quantile(self.quantile, self.min_samples)
+        return None if estimate is None else max(self.min_delay, estimate)
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self.stats["hedged"] + 1 > self.max_fraction * self.stats["requests"]:
+                self.stats["budget_skips"] += 1
+                return False
+            self.stats["hedged"] += 1
+            return True
+
+    async def _acquire(self, limiter):
+        """在线程里等待限流名额; 等待期间被取消时, 名额拿到后立即归还"""
+        acquiring = asyncio.get_running_loop().run_in_executor(None, limiter.acquire)
+        try:
+            await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            acquiring.add_done_callback(lambda f: f.cancelled() or f.exception() or limiter.release())
+            raise
+
+    async def _call(self, ep, messages):
+        # 每个请求占用它实际访问的 endpoint 的限流名额
+        limiter = get_limiter(self.router.upstream(ep), base="llm")
+        try:
+            await self._acquire(limiter)
+        except (asyncio.CancelledError, RateLimitTimeout):
+            with self.router._lock:
+                ep.probing = False
+            raise
+        slot = Slot()
+        start = time.monotonic()
+        try:
+            response = await get_chat_client(ep.model, self.timeout, base_url=ep.base_url, api_key=ep.api_key).ainvoke(messages)
+            slot.record(200)
+        except asyncio.CancelledError:
+            # 被取消的一方不计入健康统计, 但要释放半开探测名额
+            with self.router._lock:
+                ep.probing = False
+            raise
+        except Exception as e:
+            slot.record_error(e)
+            self.router.record(ep, time.monotonic() - start, ok=False)
+            raise
+        finally:
+            limiter.release(slot.status, time.monotonic() - start, slot.retry_after)
+        latency = time.monotonic() - start
+        self.router.record(ep, latency, ok=True)
+        # 被取消的一方拿不到响应, 只统计实际返回的请求
+        record_llm_usage(ep.model, response)
+        return response, latency
+
+    async def _race(self, messages):
+        """与 LLMRouter.invoke 相同的故障切换: 主请求 (及其对冲) 失败时换下一个 endpoint 作为主"""
+        ordered, fallback = self.router.route()
+        ordered = ordered[: config.ROUTER_MAX_ATTEMPTS]
+        last_error = None
+        for i, primary_ep in enumerate(ordered):
+            if not self.router.claim(primary_ep, fallback):
+                continue
+            # 备用: 指定的 hedge endpoint, 否则为后面第一个非半开的 endpoint, 只有一个时就是自己
+            hedge_ep = self.hedge_override or next((ep for ep in ordered[i + 1:] if ep.state != HALF_OPEN), primary_ep)
+            try:
+                return await self._race_one(primary_ep, hedge_ep, messages)
+            except RateLimitTimeout:
+                raise
+            except Exception as e:
+                print(f"[!] [Hedge:{self.name}] {primary_ep.name} failed, trying next: {e}")
+                last_error = e
+        raise last_error or RuntimeError(f"{self.name}: no endpoint available")
+
+    async def _race_one(self, primary_ep, hedge_ep, messages):
+        sent = time.monotonic()
+        primary = asyncio.ensure_future(self._call(primary_ep, messages))
+        delay = self.hedge_delay()
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not self._take_budget():
+            response, latency = await primary
+            self.latency.add(latency)
+            return response
+
+        print(f"[*] [Hedge:{self.name}] primary > {delay:.2f}s, sending hedge request")
+        hedge = asyncio.ensure_future(self._call(hedge_ep, messages))
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = error or task.exception()
+                    continue
+                for loser in pending:
+                    loser.cancel()
+                response, latency = task.result()
+                if task is hedge:
+                    with self._lock:
+                        self.stats["hedge_wins"] += 1
+                    if primary in pending:
+                        self.latency.add(max(time.monotonic() - sent, delay))
+                else:
+                    self.latency.add(latency)
+                return response
+        raise error
+
+    def invoke(self, messages):
+        with self._lock:
+            self.stats["requests"] += 1
+        future = asyncio.run_coroutine_threadsafe(self._race(messages), _background_loop())
+        try:
+            return future.result()
+        except Exception:
+            with self._lock:
+                self.stats["failures"] += 1
+            raise
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["hedge_rate"] = round(stats["hedged"] / stats["requests"], 4) if stats["requests"] else 0.0
+        stats["win_rate"] = round(stats["hedge_wins"] / stats["hedged"], 4) if stats["hedged"] else 0.0
+        stats["hedge_delay"] = self.hedge_delay()
+        return stats
+
+
+slm_hedger = Hedger(
+    "slm",
+    slm_router,
+    timeout=10,
+    hedge_override=Endpoint(
+        config.SLM_HEDGE_MODEL or config.SLM_MODEL,
+        config.SLM_HEDGE_BASE_URL or config.LLM_BASE_URL,
+        config.LLM_API_KEY,
+    ) if (config.SLM_HEDGE_MODEL or config.SLM_HEDGE_BASE_URL) else None,
+    quantile=config.SLM_HEDGE_QUANTILE,
+    min_delay=config.SLM_HEDGE_MIN_DELAY,
+    max_fraction=config.SLM_HEDGE_MAX_FRACTION,
+    min_samples=config.SLM_HEDGE_MIN_SAMPLES,
+)
@@ -0,0 +1,113 @@
+import os
+import asyncio
+import threading
+import weakref
+import httpx
+from langchain_openai import ChatOpenAI
+from app.core.config import config
+from app.core.ratelimit import get_limiter
+from app.core.metrics import record_llm_usage
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=config.LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=config.LLM_MAX_KEEPALIVE,
+        keepalive_expiry=config.LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+class LLMClientRegistry:
+    """按 (model, base_url, timeout) 缓存 ChatOpenAI 实例, 共享 keep-alive 连接池
+
+    - 同步调用: 全进程共享一个 httpx.Client (本身线程安全)
+    - asyncio 调用: httpx.AsyncClient 绑定事件循环, 因此按 loop 各自缓存一份
+    - fork 后子进程自动重建, 不复用父进程的 socket
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._http_client = None
+        self._clients = {}
+        self._loop_clients = weakref.WeakKeyDictionary()  # loop -> (AsyncClient, {key: ChatOpenAI})
+
+    def _new_client(self, model, base_url, api_key, timeout, http_async_client=None):
+        return ChatOpenAI(
+            model=model,
+            openai_api_key=api_key,
+            base_url=base_url,
+            timeout=timeout,
+            http_client=self._http_client,
+            http_async_client=http_async_client,
+            stream_usage=True,  # 流式最后一个 chunk 带 token 用量, 供 metrics 统计
+        )
+
+    def get(self, model: str, timeout: float, base_url: str = None, api_key: str = None) -> ChatOpenAI:
+        base_url = base_url or config.LLM_BASE_URL
+        api_key = api_key or config.LLM_API_KEY
+        key = (model, base_url, timeout, api_key)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            if self._http_client is None:
+                self._http_client = httpx.Client(limits=_http_limits())
+
+            if loop is None:
+                client = self._clients.get(key)
+                if client is None:
+                    client = self._clients[key] = self._new_client(model, base_url, api_key, timeout)
+                return client
+
+            if loop not in self._loop_clients:
+                self._loop_clients[loop] = (httpx.AsyncClient(limits=_http_limits()), {})
+            async_http, clients = self._loop_clients[loop]
+            client = clients.get(key)
+            if client is None:
+                client = clients[key] = self._new_client(model, base_url, api_key, timeout, async_http)
+            return client
+
+    def clear(self):
+        with self._lock:
+            if self._http_client is not None:
+                self._http_client.close()
+            self._reset()
+
+
+llm_clients = LLMClientRegistry()
+
+
+def get_chat_client(model: str, timeout: float, base_url: str = None, api_key: str = None) -> ChatOpenAI:
+    return llm_clients.get(model, timeout, base_url=base_url, api_key=api_key)
+
+
+def invoke_chat(llm: ChatOpenAI, messages, upstream: str = "llm"):
+    """经过上游限流器调用 LLM, 429 / Retry-After 会反馈给 AIMD 窗口
+
+    upstream 为 endpoint 级别的名字时各自一个窗口 (配置沿用 "llm"), 一个供应商限流不会拖慢其他供应商.
+    """
+    with get_limiter(upstream, base="llm").slot() as slot:
+        response = llm.invoke(messages)
+        slot.record(200)
+    record_llm_usage(llm.model_name, response)
+    return response
+
+
+def stream_chat(llm: ChatOpenAI, messages, upstream: str = "llm"):
+    """流式调用 LLM, 逐块产出文本; 整个流期间占用一个限流槽位"""
+    with get_limiter(upstream, base="llm").slot() as slot:
+        for chunk in llm.stream(messages):
+            if slot.status is None:
+                slot.record(200)
+            if chunk.usage_metadata:
+                record_llm_usage(llm.model_name, chunk)
+            if chunk.content:
+                yield chunk.content
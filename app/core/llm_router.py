@@ -0,0 +1,187 @@
+import time
+import threading
+from typing import List, Tuple
+from app.core.config import config
+from app.core.llm import get_chat_client, invoke_chat, stream_chat
+from app.core.ratelimit import RateLimitTimeout
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class Endpoint:
+    """单个 endpoint/model 的健康状态: EWMA 延迟 + EWMA 错误率 + 熔断状态"""
+
+    def __init__(self, model: str, base_url: str, api_key: str = None):
+        self.model = model
+        self.base_url = base_url
+        self.api_key = api_key
+        self.ewma_latency = None
+        self.ewma_error = 0.0
+        self.failures = 0  # 连续失败次数
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.requests = 0
+
+    @property
+    def name(self) -> str:
+        return f"{self.model}@{self.base_url}"
+
+    def score(self) -> float:
+        # 未测量过的 endpoint 分数为 0, 保证新节点能拿到流量
+        return (self.ewma_latency or 0.0) * (1 + 4 * self.ewma_error)
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "ewma_latency": round(self.ewma_latency, 3) if self.ewma_latency is not None else None,
+            "ewma_error": round(self.ewma_error, 3),
+            "requests": self.requests,
+        }
+
+
+class LLMRouter:
+    """按 tier 路由到当前最快的健康 endpoint, 失败自动切换
+
+    - 连续失败 ROUTER_FAILURE_THRESHOLD 次熔断, ROUTER_OPEN_SECONDS 后半开放行一个探测请求
+    - 探测成功恢复, 失败重新熔断
+    """
+
+    def __init__(self, tier: str, endpoints: List[Endpoint], timeout: float):
+        self.tier = tier
+        self.endpoints = endpoints
+        self.timeout = timeout
+        self.alpha = config.ROUTER_EWMA_ALPHA
+        self._lock = threading.Lock()
+
+    def route(self) -> Tuple[List[Endpoint], bool]:
+        """(按优先级排序的可用 endpoint, 是否为兜底列表); 全部熔断 (或唯一的半开 endpoint 探测在途) 时返回全部, 不让请求直接失败
+
+        只读排序, 不占用半开探测名额; 真正发请求前用 claim() 占用.
+        """
+        now = time.time()
+        probes, healthy = [], []
+        with self._lock:
+            for ep in self.endpoints:
+                if ep.state == OPEN and now - ep.opened_at >= config.ROUTER_OPEN_SECONDS:
+                    ep.state = HALF_OPEN
+                if ep.state == HALF_OPEN and not ep.probing and not probes:
+                    probes.append(ep)
+                elif ep.state == CLOSED:
+                    healthy.append(ep)
+            healthy.sort(key=Endpoint.score)
+            ordered = probes + healthy
+            if ordered:
+                return ordered, False
+            return sorted(self.endpoints, key=lambda ep: ep.opened_at), True
+
+    def candidates(self) -> List[Endpoint]:
+        return self.route()[0]
+
+    def claim(self, ep: Endpoint, fallback: bool = False) -> bool:
+        """发请求前调用: 半开 endpoint 同时只放行一个探测, 已有探测在途时返回 False (跳过该 endpoint)
+
+        兜底列表里的 endpoint 不占探测名额直接放行, 与 OPEN 时一致.
+        """
+        if fallback:
+            return True
+        with self._lock:
+            if ep.state != HALF_OPEN:
+                return True
+            if ep.probing:
+                return False
+            ep.probing = True
+            return True
+
+    def record(self, ep: Endpoint, latency: float, ok: bool):
+        with self._lock:
+            ep.requests += 1
+            ep.probing = False
+            ep.ewma_error = (1 - self.alpha) * ep.ewma_error + self.alpha * (0.0 if ok else 1.0)
+            if ok:
+                ep.ewma_latency = latency if ep.ewma_latency is None else (1 - self.alpha) * ep.ewma_latency + self.alpha * latency
+                ep.failures = 0
+                if ep.state != CLOSED:
+                    print(f"[*] [Router:{self.tier}] {ep.name} recovered")
+                ep.state = CLOSED
+                return
+            ep.failures += 1
+            if ep.state == HALF_OPEN or ep.failures >= config.ROUTER_FAILURE_THRESHOLD:
+                if ep.state != OPEN:
+                    print(f"[!] [Router:{self.tier}] {ep.name} circuit OPEN (failures={ep.failures})")
+                ep.state = OPEN
+                ep.opened_at = time.time()
+
+    def upstream(self, ep: Endpoint) -> str:
+        """endpoint 对应的限流器名字"""
+        return f"{self.tier}:{ep.name}"
+
+    def client(self, ep: Endpoint, timeout: float = None):
+        return get_chat_client(ep.model, timeout or self.timeout, base_url=ep.base_url, api_key=ep.api_key)
+
+    def invoke(self, messages, timeout: float = None):
+        last_error = None
+        ordered, fallback = self.route()
+        for ep in ordered[: config.ROUTER_MAX_ATTEMPTS]:
+            if not self.claim(ep, fallback):
+                continue
+            start = time.time()
+            try:
+                response = invoke_chat(self.client(ep, timeout), messages, upstream=self.upstream(ep))
+            except RateLimitTimeout:
+                # 本地限流排队超时与 endpoint 健康无关
+                with self._lock:
+                    ep.probing = False
+                raise
+            except Exception as e:
+                self.record(ep, time.time() - start, ok=False)
+                print(f"[!] [Router:{self.tier}] {ep.name} failed, trying next: {e}")
+                last_error = e
+                continue
+            self.record(ep, time.time() - start, ok=True)
+            return response
+        raise last_error or RuntimeError(f"{self.tier}: no endpoint available")
+
+    def stream(self, messages, timeout: float = None):
+        """流式版本: 只在首个 chunk 之前失败时切换 endpoint"""
+        last_error = None
+        ordered, fallback = self.route()
+        for ep in ordered[: config.ROUTER_MAX_ATTEMPTS]:
+            if not self.claim(ep, fallback):
+                continue
+            start = time.time()
+            started = False
+            try:
+                for chunk in stream_chat(self.client(ep, timeout), messages, upstream=self.upstream(ep)):
+                    if not started:
+                        started = True
+                        # 流式请求以首包时间衡量延迟
+                        self.record(ep, time.time() - start, ok=True)
+                    yield chunk
+                if not started:
+                    self.record(ep, time.time() - start, ok=True)
+                return
+            except RateLimitTimeout:
+                with self._lock:
+                    ep.probing = False
+                raise
+            except Exception as e:
+                if started:
+                    raise
+                self.record(ep, time.time() - start, ok=False)
+                print(f"[!] [Router:{self.tier}] {ep.name} failed, trying next: {e}")
+                last_error = e
+        raise last_error or RuntimeError(f"{self.tier}: no endpoint available")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {ep.name: ep.snapshot() for ep in self.endpoints}
+
+
+def _build(tier: str, specs, timeout: float) -> LLMRouter:
+    endpoints = [Endpoint(spec["model"], spec["base_url"], spec["api_key"]) for spec in specs]
+    return LLMRouter(tier, endpoints, timeout)
+
+
+slm_router = _build("slm", config.SLM_ENDPOINTS, 10)
+llm_router = _build("llm", config.LLM_ENDPOINTS, config.DEEP_DIVE_TIMEOUT)
@@ -0,0 +1,248 @@
+import time
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_str(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _fmt(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_label_str(self.label_names, key)} {_fmt(value)}" for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def quantile(self, q: float, **labels):
+        """按桶线性插值估算分位数 (同 PromQL histogram_quantile), 无样本返回 None"""
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            if entry is None or not entry[2]:
+                return None
+            counts, count = list(entry[0]), entry[2]
+        rank = q * count
+        lower, below = 0.0, 0
+        for bound, cumulative in zip(self.buckets, counts):
+            if cumulative >= rank:
+                in_bucket = cumulative - below
+                return lower + (bound - lower) * ((rank - below) / in_bucket if in_bucket else 1.0)
+            lower, below = bound, cumulative
+        return self.buckets[-1]
+
+    def label_sets(self):
+        with self._lock:
+            return [dict(zip(self.label_names, key)) for key in self._values]
+
+    def render(self):
+        with self._lock:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        lines = []
+        names = self.label_names + ("le",)
+        for key, (counts, total, count) in items:
+            for bound, bucket in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_label_str(names, key + (_fmt(bound),))} {bucket}")
+            lines.append(f"{self.name}_bucket{_label_str(names, key + ('+Inf',))} {count}")
+            lines.append(f"{self.name}_sum{_label_str(self.label_names, key)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{_label_str(self.label_names, key)} {count}")
+        return lines
+
+
+class Registry:
+    """进程内指标注册表, 渲染为 Prometheus 文本格式
+
+    collector 在每次抓取时调用, 返回 [(name, labels_dict, value), ...], 统一作为 gauge 输出,
+    用于把已有的 stats()/snapshot() 字典直接暴露出来.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self.register(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def add_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines += metric.header() + metric.render()
+
+        grouped = {}
+        for collector in collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                print(f"[!] [Metrics] collector {getattr(collector, '__name__', collector)} 失败: {e}")
+                continue
+            for name, labels, value in samples:
+                if isinstance(value, bool):
+                    value = int(value)
+                if isinstance(value, (int, float)):
+                    grouped.setdefault(name, []).append((labels, value))
+        for name, samples in grouped.items():
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{_label_str(tuple(labels), tuple(labels.values()))} {_fmt(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+NODE_LATENCY = registry.histogram("zivv_node_duration_seconds", "Agent node latency", ("node",))
+DB_QUERY_LATENCY = registry.histogram("zivv_db_query_duration_seconds", "Claim / persist query latency", ("query",))
+JOBS_TOTAL = registry.counter("zivv_jobs_total", "Jobs finished per stage and outcome", ("stage", "outcome"))
+LLM_TOKENS = registry.counter("zivv_llm_tokens_total", "LLM token usage", ("model", "kind"))
+LLM_PARSE = registry.counter("zivv_llm_parse_total", "Structured output parse results per model", ("model", "outcome"))
+DEEP_DIVE_REPORTS = registry.counter("zivv_deep_dive_reports_total", "Deep-dive reports reused / regenerated by reason", ("decision", "reason"))
+CHECKPOINTS_TOTAL = registry.counter("zivv_checkpoints_total", "Node checkpoints saved / reused on retry", ("node", "outcome"))
+
+
+def observe_node(node: str):
+    """装饰 graph 节点, 记录每次调用耗时"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with NODE_LATENCY.time(node=node):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_llm_usage(model: str, message):
+    """从 AIMessage / AIMessageChunk 的 usage_metadata (或 OpenAI token_usage) 中累计 token 数"""
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        prompt, completion = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    else:
+        usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+        prompt, completion = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    if prompt:
+        LLM_TOKENS.inc(prompt, model=model, kind="prompt")
+    if completion:
+        LLM_TOKENS.inc(completion, model=model, kind="completion")
+
+
+def flatten_stats(name: str, stats: dict, **labels):
+    """把 stats()/snapshot() 字典展开成 collector 样本, 嵌套字典拼接前缀, 非数值字段忽略"""
+    for key, value in (stats or {}).items():
+        if isinstance(value, dict):
+            yield from flatten_stats(f"{name}_{key}", value, **labels)
+        elif isinstance(value, (int, float)):
+            yield f"{name}_{key}", labels, value
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"[*] [Metrics] listening on http://{host}:{port}/metrics")
+    return server
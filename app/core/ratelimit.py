@@ -0,0 +1,252 @@
+import time
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+import psycopg2
+from app.core.db import get_db_connection
+from app.core.config import config, rate_limit_conf
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+def parse_retry_after(value):
+    """Retry-After 可能是秒数或 HTTP 日期"""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class SharedRateWindow:
+    """跨进程限速: 所有 worker 在 Postgres 中按秒累加调用次数, 超过全局 rps 时等到下一秒"""
+
+    def __init__(self, table: str):
+        self.table = table
+        self._ready = False
+        self._last_cleanup = 0.0
+
+    def _ensure(self, cur):
+        if not self._ready:
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    upstream TEXT NOT NULL,
+                    window_start BIGINT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (upstream, window_start)
+                )
+            """)
+            self._ready = True
+
+    def take(self, upstream: str, limit: float) -> float:
+        """登记一次调用, 返回需要等待的秒数 (0 表示当前窗口仍有额度)"""
+        now = time.time()
+        window = int(now)
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                self._ensure(cur)
+                cur.execute(
+                    f"""
+                    INSERT INTO {self.table} (upstream, window_start, count) VALUES (%s, %s, 1)
+                    ON CONFLICT (upstream, window_start) DO UPDATE SET count = {self.table}.count + 1
+                    RETURNING count
+                    """,
+                    (upstream, window),
+                )
+                count = cur.fetchone()["count"]
+                if now - self._last_cleanup > 60:
+                    cur.execute(f"DELETE FROM {self.table} WHERE window_start < %s", (window - 60,))
+                    self._last_cleanup = now
+                conn.commit()
+        except psycopg2.Error as e:
+            # 共享计数不可用时退化为进程内限速
+            print(f"[!] [RateLimit:{upstream}] 共享计数失败: {e}")
+            return 0.0
+        finally:
+            conn.close()
+        return 0.0 if count <= limit else (window + 1) - now
+
+
+class Slot:
+    def __init__(self):
+        self.status = None
+        self.retry_after = None
+
+    def record(self, status: int, retry_after=None):
+        self.status = status
+        self.retry_after = parse_retry_after(retry_after)
+
+    def record_error(self, e: Exception):
+        """从 openai / requests 异常中提取状态码与 Retry-After"""
+        status = getattr(e, "status_code", None)
+        response = getattr(e, "response", None)
+        if status is None and response is not None:
+            status = getattr(response, "status_code", None)
+        headers = getattr(response, "headers", None) or {}
+        self.record(status or 0, headers.get("retry-after") or headers.get("Retry-After"))
+
+
+class AdaptiveLimiter:
+    """单个上游的限流器: 令牌桶 (rps) + 并发窗口, 两者都按 AIMD 自适应
+
+    - 成功: 并发窗口每轮 +1, 速率 +1% max_rps
+    - 429 或延迟超过 latency_target: 乘性下降 (每秒最多一次), 并遵守 Retry-After
+    """
+
+    def __init__(self, name, rps, burst, max_concurrency, min_concurrency=1, latency_target=0.0,
+                 decrease=0.5, shared: SharedRateWindow = None, shared_rps: float = 0.0):
+        self.name = name
+        self.max_rps = rps
+        self.rps = rps
+        self.burst = max(1.0, burst)
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min_concurrency)
+        self.concurrency = float(self.max_concurrency)
+        self.latency_target = latency_target
+        self.decrease = decrease
+        self.shared = shared
+        self.shared_rps = shared_rps
+
+        self._cond = threading.Condition()
+        self._tokens = self.burst
+        self._refilled_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._last_decrease = 0.0
+        self.inflight = 0
+        self.stats = {"acquired": 0, "throttled": 0, "timeouts": 0, "decreases": 0, "wait_time_total": 0.0}
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rps)
+        self._refilled_at = now
+
+    def acquire(self, timeout: float = None):
+        timeout = config.RATE_LIMIT_MAX_WAIT if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = 0.0
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                elif self.inflight >= int(self.concurrency):
+                    wait = 0.05
+                elif self._tokens < 1:
+                    wait = (1 - self._tokens) / max(self.rps, 1e-6)
+                else:
+                    self._tokens -= 1
+                    self.inflight += 1
+                    break
+                if now + wait > deadline:
+                    self.stats["timeouts"] += 1
+                    raise RateLimitTimeout(f"{self.name}: no capacity within {timeout}s")
+                self._cond.wait(wait)
+
+        if self.shared is not None and self.shared_rps > 0:
+            while True:
+                delay = self.shared.take(self.name, self.shared_rps)
+                if delay <= 0:
+                    break
+                if time.monotonic() + delay > deadline:
+                    self._release_slot()
+                    self.stats["timeouts"] += 1
+                    raise RateLimitTimeout(f"{self.name}: shared rps {self.shared_rps} exhausted")
+                time.sleep(delay)
+
+        with self._cond:
+            self.stats["acquired"] += 1
+            self.stats["wait_time_total"] += time.monotonic() - start
+
+    def _release_slot(self):
+        with self._cond:
+            self.inflight -= 1
+            self._cond.notify_all()
+
+    def release(self, status=None, latency=None, retry_after=None):
+        with self._cond:
+            self.inflight -= 1
+            now = time.monotonic()
+            throttled = status == 429
+            slow = bool(self.latency_target) and latency is not None and latency > self.latency_target
+            if throttled:
+                self.stats["throttled"] += 1
+                if retry_after:
+                    self._blocked_until = max(self._blocked_until, now + retry_after)
+            if throttled or slow:
+                if now - self._last_decrease >= 1.0:
+                    self._last_decrease = now
+                    self.stats["decreases"] += 1
+                    self.concurrency = max(self.min_concurrency, self.concurrency * self.decrease)
+                    self.rps = max(self.max_rps * 0.05, self.rps * self.decrease)
+                    print(f"[!] [RateLimit:{self.name}] backoff -> concurrency={self.concurrency:.1f} rps={self.rps:.2f}")
+            elif status is not None and 200 <= status < 400:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+                self.rps = min(self.max_rps, self.rps + self.max_rps * 0.01)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, timeout: float = None):
+        """with limiter.slot() as s: ... s.record(status, retry_after)"""
+        self.acquire(timeout)
+        slot = Slot()
+        start = time.monotonic()
+        try:
+            yield slot
+        except Exception as e:
+            if slot.status is None:
+                slot.record_error(e)
+            raise
+        finally:
+            self.release(slot.status, time.monotonic() - start, slot.retry_after)
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                **self.stats,
+                "inflight": self.inflight,
+                "concurrency": round(self.concurrency, 2),
+                "rps": round(self.rps, 2),
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_shared_window = None
+
+
+def get_limiter(name: str, base: str = None) -> AdaptiveLimiter:
+    """按名字取限流器; 没有单独配置的 name 沿用 base 的配置 (如每个 LLM endpoint 各一个 "llm" 规格的限流器)"""
+    global _shared_window
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            conf = config.RATE_LIMITS.get(name) or config.RATE_LIMITS.get(base) or rate_limit_conf(name)
+            shared = None
+            if config.RATE_LIMIT_SHARED and conf["shared_rps"] > 0:
+                if _shared_window is None:
+                    _shared_window = SharedRateWindow(config.RATE_LIMIT_TABLE)
+                shared = _shared_window
+            limiter = _limiters[name] = AdaptiveLimiter(
+                name,
+                rps=conf["rps"],
+                burst=conf["burst"],
+                max_concurrency=conf["concurrency"],
+                latency_target=conf["latency_target"],
+                shared=shared,
+                shared_rps=conf["shared_rps"],
+            )
+        return limiter
+
+
+def limiter_snapshots() -> dict:
+    with _limiters_lock:
+        return {name: limiter.snapshot() for name, limiter in _limiters.items()}
@@ -0,0 +1,177 @@
+import re
+import ast
+import json
+from app.core.metrics import LLM_PARSE
+
+RISK_LEVELS = {"low": "Low", "medium": "Medium", "med": "Medium", "moderate": "Medium", "high": "High"}
+MAX_TAGS = 8
+MAX_CANDIDATES = 8
+
+
+class StructuredOutputError(ValueError):
+    pass
+
+
+def _extract_at(content: str, start: int) -> str:
+    """从 start 处的 { / [ 开始取出平衡的 JSON; 输出被截断时只丢掉末尾一个不完整的值 (连同它的键) 和悬空的逗号, 再闭合括号"""
+    stack, in_string, escaped = [], False, False
+    string_start = prev_string_start = start
+    for i in range(start, len(content)):
+        ch = content[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string, prev_string_start, string_start = True, string_start, i
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if stack and stack[-1] == ch:
+                stack.pop()
+            if not stack:
+                return content[start:i + 1]
+
+    # 截断的字符串和数字都不可信, 宁可缺字段; 前面已经完整的键值对原样保留
+    if in_string:
+        # 未闭合的字符串: 是值的话连同 "key": 一起去掉
+        text = content[start:string_start].rstrip()
+        if text.endswith(":"):
+            text = content[start:prev_string_start].rstrip()
+    else:
+        text = content[start:].rstrip()
+        bare = re.search(r"[-+\w.]+$", text)
+        if bare:
+            # 末尾的裸数字 / 字面量
+            text = text[:bare.start()].rstrip()
+        if text.endswith(":"):
+            text = content[start:string_start].rstrip()
+        elif not bare and text.endswith('"') and stack[-1] == "}" and content[start:string_start].rstrip()[-1:] in ("{", ","):
+            # 对象里只有键没有冒号
+            text = content[start:string_start].rstrip()
+    if text.endswith(","):
+        text = text[:-1].rstrip()
+    return text + "".join(reversed(stack))
+
+
+def json_candidates(content: str):
+    """依次从每个 { / [ 开始提取候选 JSON (前面的说明文字里可能有 "[1]" 这类括号), 最多 MAX_CANDIDATES 个"""
+    starts = [i for i, ch in enumerate(content) if ch in "{["]
+    for start in starts[:MAX_CANDIDATES]:
+        yield _extract_at(content, start)
+
+
+def extract_json(content: str) -> str:
+    """取出文本中第一个 JSON 对象 / 数组 (忽略 markdown 代码块和前后的说明文字), 截断时补全"""
+    for candidate in json_candidates(content):
+        return candidate
+    raise StructuredOutputError("no JSON object found")
+
+
+def repair_json(text: str) -> str:
+    """修复常见格式问题: 弯引号、末尾多余逗号、// 注释、"7/10" 这类未加引号的分数"""
+    text = text.replace("\u201c", '"').replace("\u201d", '"').replace("\u2018", "'").replace("\u2019", "'")
+    text = re.sub(r"^\s*//.*$", "", text, flags=re.MULTILINE)
+    text = re.sub(r":\s*(\d+(?:\.\d+)?\s*/\s*\d+)\s*([,}\]])", r': "\1"\2', text)
+    return re.sub(r",\s*([}\]])", r"\1", text)
+
+
+# 字符串字面量整体匹配后原样保留, 只替换字符串外的 true / false / null
+_JSON_CONSTANTS = {"true": "True", "false": "False", "null": "None"}
+_CONSTANT_TOKENS = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|\b(true|false|null)\b""")
+
+
+def _python_literal(text: str):
+    """单引号 / True / None 等 Python 风格输出"""
+    text = _CONSTANT_TOKENS.sub(lambda m: m.group(1) or _JSON_CONSTANTS[m.group(2)], text)
+    return ast.literal_eval(text)
+
+
+_MISSING = object()
+
+
+def _parse_candidate(text: str):
+    for parse in (json.loads, lambda text: json.loads(repair_json(text)), lambda text: _python_literal(repair_json(text))):
+        try:
+            return parse(text)
+        except (ValueError, SyntaxError):
+            continue
+    raise StructuredOutputError(f"unparseable JSON: {text[:80]!r}")
+
+
+def parse_json_output(content: str, model: str = "unknown"):
+    """容错解析 LLM 输出的 JSON, 按 model 统计 ok / repaired / failed"""
+    content = (content or "").strip()
+    try:
+        data = json.loads(content)
+        LLM_PARSE.inc(model=model, outcome="ok")
+        return data
+    except ValueError:
+        pass
+
+    found, fallback = False, _MISSING
+    for candidate in json_candidates(content):
+        found = True
+        try:
+            data = _parse_candidate(candidate)
+        except StructuredOutputError:
+            continue
+        # 优先取对象 / 对象数组, 说明文字里的 "[1]" 只在没有更好的结果时使用
+        if isinstance(data, dict) or (isinstance(data, list) and data and all(isinstance(item, dict) for item in data)):
+            LLM_PARSE.inc(model=model, outcome="repaired")
+            return data
+        if fallback is _MISSING:
+            fallback = data
+    if fallback is not _MISSING:
+        LLM_PARSE.inc(model=model, outcome="repaired")
+        return fallback
+
+    LLM_PARSE.inc(model=model, outcome="failed")
+    if not found:
+        raise StructuredOutputError("no JSON object found")
+    raise StructuredOutputError(f"unparseable JSON: {content[:80]!r}")
+
+
+def _score(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return max(0, min(100, int(round(value))))
+    match = re.search(r"-?\d+(?:\.\d+)?", str(value or ""))
+    if not match:
+        return None
+    # "8/10" 这类按比例换算
+    number = float(match.group())
+    scale = re.search(r"/\s*(\d+)", str(value))
+    if scale and float(scale.group(1)) not in (0, 100):
+        number = number * 100 / float(scale.group(1))
+    return max(0, min(100, int(round(number))))
+
+
+def coerce_slm_item(item) -> dict:
+    """按 L2 打标的 schema 校验并转换类型: tags / vibe_score 必须存在, 其余字段给默认值"""
+    if not isinstance(item, dict):
+        raise StructuredOutputError(f"expected object, got {type(item).__name__}")
+    item = {str(key).strip().lower(): value for key, value in item.items()}
+
+    tags = item.get("tags")
+    if isinstance(tags, str):
+        tags = re.split(r"[,;|]", tags)
+    if not isinstance(tags, list):
+        raise StructuredOutputError("missing tags")
+    tags = [str(tag).strip() for tag in tags if str(tag or "").strip()][:MAX_TAGS]
+
+    vibe_score = _score(item.get("vibe_score", item.get("score")))
+    if vibe_score is None:
+        raise StructuredOutputError("missing vibe_score")
+
+    risk = str(item.get("risk_level") or item.get("scam_probability") or "").strip().lower()
+    return {
+        "tags": tags,
+        "vibe_score": vibe_score,
+        "risk_level": RISK_LEVELS.get(risk.split()[0] if risk else "", "Medium"),
+        "short_comment": str(item.get("short_comment") or "").strip(),
+    }
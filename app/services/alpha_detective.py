@@ -1,71 +1,224 @@
 import os
+import time
 import requests
 import json
-from typing import List, Dict, Optional
+import heapq
+from concurrent.futures import ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+from typing import Iterator, List, Dict, Optional
 from app.core.config import config
+from app.core.cache import TTLCache, PgCacheTier
+from app.core.ratelimit import RateLimitTimeout, get_limiter
+
+HOLDER_PAGE_SIZE = 100 # Helius 最小分页通常是 100
+
+
+def _pooled_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.ALPHA_MAX_WORKERS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class WalletPnlCache:
+    """钱包 PnL 缓存: 进程内 LRU+TTL, 可选 Postgres 共享层
+
+    查询失败 / 未知钱包缓存为 None, 使用更短的 negative TTL.
+    """
+
+    def __init__(self):
+        self.local = TTLCache(config.WALLET_PNL_CACHE_SIZE, config.WALLET_PNL_TTL)
+        self.shared = PgCacheTier(config.WALLET_PNL_CACHE_TABLE) if config.WALLET_PNL_CACHE_PG else None
+
+    def get_entry(self, wallet: str):
+        """返回 (pnl_data_or_None, age_seconds), 未缓存返回 None"""
+        entry = self.local.get_entry(wallet)
+        if entry is None and self.shared is not None:
+            entry = self.shared.get_entry(wallet)
+            if entry is not None:
+                value, age = entry
+                self.local.set(wallet, value, ttl=self._ttl(value), age=age)
+        return entry
+
+    def _ttl(self, value) -> float:
+        return config.WALLET_PNL_TTL if value is not None else config.WALLET_PNL_NEGATIVE_TTL
+
+    def set(self, wallet: str, value: Optional[Dict]):
+        ttl = self._ttl(value)
+        self.local.set(wallet, value, ttl=ttl)
+        if self.shared is not None:
+            self.shared.set(wallet, value, ttl)
+
+    def stats(self) -> dict:
+        stats = {"local": self.local.stats()}
+        if self.shared is not None:
+            stats["shared"] = self.shared.stats()
+        return stats
+
+
+wallet_pnl_cache = WalletPnlCache()
+
 
 class AlphaDetective:
     def __init__(self):
         self.helius_api_key = os.getenv("HELIUS_API_KEY", "")
         self.birdeye_api_key = os.getenv("BIRDEYE_API_KEY", "")
-        self.helius_rpc_url = f"https://mainnet.helius-rpc.com/?api-key={self.helius_api_key}"
-        self.birdeye_base_url = "https://public-api.birdeye.so"
+        # HELIUS_RPC_URL / BIRDEYE_BASE_URL 可指向本地替身 (bench/)
+        self.helius_rpc_url = f"{os.getenv('HELIUS_RPC_URL', 'https://mainnet.helius-rpc.com/')}?api-key={self.helius_api_key}"
+        self.birdeye_base_url = os.getenv("BIRDEYE_BASE_URL", "https://public-api.birdeye.so")
+        self._pid = None
+
+    def _ensure_resources(self):
+        # 线程池与 HTTP 连接不能跨 fork 复用, 按 pid 懒加载
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self.helius_session = _pooled_session()
+            self.birdeye_session = _pooled_session()
+            self.executor = ThreadPoolExecutor(max_workers=config.ALPHA_MAX_WORKERS, thread_name_prefix="alpha")
+
+    def _helius_rpc(self, method: str, params, request_id: str, deadline_at: float = None) -> Dict:
+        """deadline_at (time.time()) 之前必须返回: 限流排队和 HTTP 超时都按剩余时间截断"""
+        self._ensure_resources()
+        payload = {"jsonrpc": "2.0", "id": request_id, "method": method, "params": params}
+        timeout, wait = 10, None
+        if deadline_at is not None:
+            remaining = deadline_at - time.time()
+            if remaining <= 0:
+                raise TimeoutError(f"alpha deadline exceeded before {method}")
+            timeout, wait = min(timeout, remaining), remaining
+        with get_limiter("helius").slot(wait) as slot:
+            response = self.helius_session.post(self.helius_rpc_url, json=payload, timeout=timeout)
+            slot.record(response.status_code, response.headers.get("Retry-After"))
+        return response.json()
+
+    def iter_token_accounts(self, mint_address: str, page_size: int = HOLDER_PAGE_SIZE, max_pages: int = None,
+                            deadline_at: float = None) -> Iterator[Dict]:
+        """逐页拉取 Helius getTokenAccounts, 以生成器形式逐个产出账户 (内存只保留当前页); 超过 deadline_at 不再翻页"""
+        page = 1
+        while max_pages is None or page <= max_pages:
+            if page > 1 and deadline_at is not None and time.time() >= deadline_at:
+                print(f"[!] Holder scan deadline reached after {page - 1} pages")
+                return
+            data = self._helius_rpc(
+                "getTokenAccounts",
+                {
+                    "mint": mint_address,
+                    "page": page,
+                    "limit": page_size
+                },
+                "get-holders",
+                deadline_at,
+            )
+            if "result" not in data or "token_accounts" not in data["result"]:
+                print(f"[!] Helius Error: {data}")
+                return
+            accounts = data["result"]["token_accounts"]
+            yield from accounts
+            if len(accounts) < page_size:
+                return
+            page += 1
 
-    def get_top_holders(self, mint_address: str, limit: int = 20) -> List[Dict]:
-        """通过 Helius 获取前 N 名持仓者"""
+    def get_token_supply(self, mint_address: str, deadline_at: float = None) -> Optional[float]:
+        """总供应量 (原始单位, 与 token_accounts.amount 一致)"""
+        try:
+            data = self._helius_rpc("getTokenSupply", [mint_address], "get-supply", deadline_at)
+            return float(data["result"]["value"]["amount"])
+        except Exception as e:
+            print(f"[!] Helius getTokenSupply failed: {e}")
+            return None
+
+    def get_top_holders(self, mint_address: str, limit: int = 20, deadline_at: float = None) -> List[Dict]:
+        """通过 Helius 获取前 N 名持仓者
+
+        用大小为 limit 的最小堆做 top-k (Helius 结果可能未严格按金额排序).
+        HOLDERS_STREAMING 开启时逐页扫描, 当未扫描到的供应量已不足以挤进 top-k 时提前停止;
+        到达 deadline_at 时用已扫描到的账户.
+        """
         if not self.helius_api_key:
             print("[!] Missing HELIUS_API_KEY")
             return []
 
-        payload = {
-            "jsonrpc": "2.0",
-            "id": "get-holders",
-            "method": "getTokenAccounts",
-            "params": {
-                "mint": mint_address,
-                "page": 1,
-                "limit": 100 # Helius 最小分页通常是 100
-            }
-        }
-        
+        streaming = config.HOLDERS_STREAMING
+        supply = self.get_token_supply(mint_address, deadline_at) if streaming else None
+        max_pages = config.HOLDERS_MAX_PAGES if streaming else 1
+
+        heap = []  # (amount, seq, account)
+        seen_amount = 0.0
+        pages = 0
         try:
-            response = requests.post(self.helius_rpc_url, json=payload, timeout=10)
-            data = response.json()
-            if "result" in data and "token_accounts" in data["result"]:
-                accounts = data["result"]["token_accounts"]
-                # 排序并取前 N 名 (Helius 结果可能未严格按金额排序)
-                sorted_accounts = sorted(accounts, key=lambda x: float(x.get("amount", 0)), reverse=True)
-                return sorted_accounts[:limit]
-            else:
-                print(f"[!] Helius Error: {data}")
+            accounts = self.iter_token_accounts(
+                mint_address, page_size=HOLDER_PAGE_SIZE, max_pages=max_pages, deadline_at=deadline_at,
+            )
+            for seq, account in enumerate(accounts):
+                amount = float(account.get("amount", 0))
+                seen_amount += amount
+                if len(heap) < limit:
+                    heapq.heappush(heap, (amount, seq, account))
+                elif amount > heap[0][0]:
+                    heapq.heapreplace(heap, (amount, seq, account))
+
+                # 每页结束检查一次: 剩余供应量全部集中在一个账户也进不了 top-k 时停止
+                if (seq + 1) % HOLDER_PAGE_SIZE == 0:
+                    pages += 1
+                    if supply is not None and len(heap) >= limit and supply - seen_amount < heap[0][0]:
+                        print(f"[*] Holder scan stopped early after {pages} pages ({seen_amount / supply:.1%} of supply covered)")
+                        break
         except Exception as e:
             print(f"[!] Helius Request Exception: {e}")
-        
-        return []
+            if not heap:
+                return []
 
-    def get_wallet_pnl(self, wallet_address: str) -> Optional[Dict]:
-        """通过 Birdeye 获取钱包的整体盈利情况"""
+        return [account for _, _, account in sorted(heap, key=lambda x: (-x[0], x[1]))]
+
+    def get_wallet_pnl(self, wallet_address: str, max_age: float = None) -> Optional[Dict]:
+        """获取钱包整体盈利情况, 优先读缓存; 缓存年龄超过 max_age 秒时强制刷新
+
+        本地限流排队超时抛出 RateLimitTimeout, 不写缓存.
+        """
         if not self.birdeye_api_key:
             return None
 
+        entry = wallet_pnl_cache.get_entry(wallet_address)
+        if entry is not None and (max_age is None or entry[1] <= max_age):
+            return entry[0]
+
+        data = self._fetch_wallet_pnl(wallet_address)
+        wallet_pnl_cache.set(wallet_address, data)
+        return data
+
+    def _fetch_wallet_pnl(self, wallet_address: str) -> Optional[Dict]:
+        """通过 Birdeye 获取钱包的整体盈利情况"""
         url = f"{self.birdeye_base_url}/v1/wallet/pnl?address={wallet_address}"
         headers = {"X-API-KEY": self.birdeye_api_key}
         
+        self._ensure_resources()
         try:
-            response = requests.get(url, headers=headers, timeout=10)
+            with get_limiter("birdeye").slot() as slot:
+                response = self.birdeye_session.get(url, headers=headers, timeout=10)
+                slot.record(response.status_code, response.headers.get("Retry-After"))
             if response.status_code == 200:
                 data = response.json()
                 if data.get("success"):
                     return data.get("data")
+        except RateLimitTimeout:
+            # 请求根本没发出去, 不代表钱包无数据, 交给调用方跳过而不是负缓存
+            raise
         except Exception as e:
             print(f"[!] Birdeye Request Error for {wallet_address}: {e}")
             
         return None
 
-    def analyze_token(self, mint_address: str) -> Dict:
-        """综合分析代币 Alpha 数据"""
+    def analyze_token(self, mint_address: str, deadline: float = None) -> Dict:
+        """综合分析代币 Alpha 数据
+
+        deadline 秒从持仓查询开始计时, 覆盖 supply / 持仓翻页 / 前 10 名持仓者的 PnL 并发查询;
+        超时后用已返回的部分结果计算.
+        """
         print(f"[*] Analyzing Alpha for {mint_address}...")
-        holders = self.get_top_holders(mint_address)
+        deadline = config.ALPHA_DEADLINE if deadline is None else deadline
+        start = time.time()
+        holders = self.get_top_holders(mint_address, deadline_at=start + deadline)
         
         if not holders:
             return {"error": "No holders found or API error"}
@@ -75,16 +228,34 @@ class AlphaDetective:
         real_holders = 0
         
         # 分析前 10 名持仓者
-        for holder in holders[:10]:
-            wallet = holder.get("owner")
-            # 简单判断是否是合约地址 (通常持仓极大的可能是池子，但这里简单处理)
-            pnl_data = self.get_wallet_pnl(wallet)
+        self._ensure_resources()
+        # 简单判断是否是合约地址 (通常持仓极大的可能是池子，但这里简单处理)
+        wallets = [holder.get("owner") for holder in holders[:10] if holder.get("owner")]
+        futures = [
+            self.executor.submit(self.get_wallet_pnl, wallet, config.WALLET_PNL_REFRESH_AGE)
+            for wallet in wallets
+        ]
+        done, not_done = wait(futures, timeout=max(0.0, deadline - (time.time() - start)))
+        for future in not_done:
+            future.cancel()
+        if not_done:
+            print(f"[!] Alpha scan deadline {deadline}s exceeded: {len(done)}/{len(futures)} wallets returned")
+
+        throttled = 0
+        for future in done:
+            try:
+                pnl_data = future.result()
+            except RateLimitTimeout:
+                throttled += 1
+                continue
             if pnl_data:
                 real_holders += 1
                 roi = pnl_data.get("realized_pnl_percentage", 0)
                 if roi > 50: # 简单定义：盈利超过 50% 的算聪明钱
                     smart_money_count += 1
                 total_pnl += pnl_data.get("realized_pnl_usd", 0)
+        if throttled:
+            print(f"[!] Alpha scan: {throttled} wallets skipped (Birdeye rate limit), not cached")
 
         # 计算集中度
         # 注意：这里需要知道总供应量来算百分比，简化版先只记原始数据
@@ -93,6 +264,8 @@ class AlphaDetective:
             "smart_money_count": smart_money_count,
             "avg_top_pnl": total_pnl / real_holders if real_holders > 0 else 0,
             "holder_count_analyzed": len(holders),
+            "wallets_scanned": len(done) - throttled,
+            "partial": bool(not_done) or throttled > 0,
             "is_alpha": smart_money_count >= 2 # 超过 2 个聪明钱在里面就算 Alpha
         }
 
@@ -0,0 +1,167 @@
+import json
+from functools import wraps
+import psycopg2
+from psycopg2.extras import execute_values
+from app.core.db import get_db_connection, table_exists
+from app.core.config import config
+from app.core.metrics import CHECKPOINTS_TOTAL
+
+_table_ready = None
+
+
+def checkpoints_ready() -> bool:
+    """CHECKPOINTS 开启且 job_checkpoints 表存在; 表缺失时整个功能停用, 不影响任务落库 (每个进程只查一次)"""
+    global _table_ready
+    if not config.CHECKPOINTS:
+        return False
+    if _table_ready is None:
+        try:
+            _table_ready = table_exists("job_checkpoints")
+        except psycopg2.Error as e:
+            # 查询失败不缓存, 下次再查
+            print(f"[!] [Checkpoint] 检查 job_checkpoints 表失败: {e}")
+            return False
+        if not _table_ready:
+            print("[!] [Checkpoint] job_checkpoints 表不存在, 节点检查点已停用 (设置 CHECKPOINT_ENSURE_SCHEMA=true 或手动建表)")
+    return _table_ready
+
+
+def ensure_checkpoint_table():
+    """节点检查点表 (幂等): 每个任务每个节点一行, 只保存该节点产出的字段"""
+    global _table_ready
+    _table_ready = None
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS job_checkpoints (
+                    job_id INTEGER NOT NULL,
+                    node TEXT NOT NULL,
+                    output JSONB NOT NULL,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    PRIMARY KEY (job_id, node)
+                )
+            """)
+            cur.execute("CREATE INDEX IF NOT EXISTS job_checkpoints_created_idx ON job_checkpoints (created_at)")
+            conn.commit()
+    except psycopg2.Error as e:
+        print(f"[!] [Checkpoint] 创建检查点表失败: {e}")
+    finally:
+        conn.close()
+
+
+def load_checkpoints(job_id: int) -> dict:
+    """读取任务未过期的检查点 {node: output}, 只在重试时调用"""
+    if not checkpoints_ready():
+        return {}
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT node, output FROM job_checkpoints
+                WHERE job_id = %s AND created_at > NOW() - %s * INTERVAL '1 second'
+                """,
+                (job_id, config.CHECKPOINT_MAX_AGE),
+            )
+            return {row["node"]: row["output"] for row in cur.fetchall()}
+    except psycopg2.Error as e:
+        print(f"[!] [Checkpoint][Job:{job_id}] 读取检查点失败, 从头执行: {e}")
+        conn.rollback()
+        return {}
+    finally:
+        conn.close()
+
+
+def save_checkpoints(node: str, outputs) -> bool:
+    """批量写入 [(job_id, output)], 同一节点重跑时覆盖旧结果; 写入失败不影响任务本身, 返回是否已写入"""
+    outputs = list(outputs)
+    if not outputs or node not in config.CHECKPOINT_NODES or not checkpoints_ready():
+        return False
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                """
+                INSERT INTO job_checkpoints (job_id, node, output, created_at)
+                VALUES %s
+                ON CONFLICT (job_id, node) DO UPDATE
+                SET output = EXCLUDED.output, created_at = NOW()
+                """,
+                [(job_id, node, json.dumps(output, ensure_ascii=False, default=str)) for job_id, output in outputs],
+                template="(%s, %s, %s::jsonb, NOW())",
+                page_size=len(outputs),
+            )
+            conn.commit()
+        CHECKPOINTS_TOTAL.inc(len(outputs), node=node, outcome="saved")
+        return True
+    except psycopg2.Error as e:
+        print(f"[!] [Checkpoint] 写入 {node} 检查点失败: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+
+def prune_checkpoints(limit: int = 1000) -> int:
+    """删除超过 CHECKPOINT_MAX_AGE 的检查点 (任务完成时已随 persist 删除, 这里只清理放弃 / 卡死的任务)"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                DELETE FROM job_checkpoints
+                WHERE ctid IN (
+                    SELECT ctid FROM job_checkpoints
+                    WHERE created_at < NOW() - %s * INTERVAL '1 second'
+                    LIMIT %s
+                )
+                """,
+                (config.CHECKPOINT_MAX_AGE, limit),
+            )
+            deleted = cur.rowcount
+            conn.commit()
+    finally:
+        conn.close()
+    return deleted
+
+
+def resume_checkpoint(state: dict, node: str):
+    """state 中带有该节点的检查点时返回合并后的 state, 否则返回 None"""
+    saved = (state.get("checkpoints") or {}).get(node)
+    if saved is None:
+        return None
+    print(f"[*] [Checkpoint][Job:{state.get('job_id')}] 复用 {node} 的检查点, 跳过重新执行")
+    CHECKPOINTS_TOTAL.inc(node=node, outcome="hit")
+    return {**state, **saved}
+
+
+def checkpoint_output(result: dict, fields) -> dict:
+    return {field: result.get(field) for field in fields}
+
+
+def with_checkpoint(result: dict, node: str, output: dict) -> dict:
+    """把本次写入的检查点记进 state["checkpoints"], 任务完成时据此决定是否需要删除检查点"""
+    return {**result, "checkpoints": {**(result.get("checkpoints") or {}), node: output}}
+
+
+def checkpointed(node: str, fields, ok=None):
+    """装饰 graph 节点: 重试时有未过期的检查点则直接复用, 否则执行并保存成功的结果
+
+    fields 为该节点写入 state 的字段; ok(result) 可进一步判断结果是否值得保存.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(state, *args, **kwargs):
+            resumed = resume_checkpoint(state, node)
+            if resumed is not None:
+                return resumed
+            result = fn(state, *args, **kwargs)
+            if result.get("status") != "error" and (ok is None or ok(result)):
+                output = checkpoint_output(result, fields)
+                if save_checkpoints(node, [(state["job_id"], output)]):
+                    result = with_checkpoint(result, node, output)
+            return result
+        return wrapper
+    return decorator
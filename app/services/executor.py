@@ -0,0 +1,155 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+from app.core.config import config
+
+
+class AsyncJobExecutor:
+    """异步并发执行器: 按 stage 限流 + 全局 in-flight 上限
+
+    graph / node / psycopg2 都是阻塞调用, 这里统一丢进线程池执行,
+    事件循环只负责拉取任务和控制并发度.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[List[dict]], None],
+        plan: Callable[[List[dict]], List[List[dict]]] = None,
+        prefilter: Callable[[List[dict]], List[dict]] = None,
+        max_inflight: int = None,
+        stage_limits: Dict[int, int] = None,
+        budget=None,
+        unit_sizes: Dict[int, int] = None,
+    ):
+        # handler 以 "执行单元" (同 stage 的一组 job) 为粒度, 默认每个 job 单独一组
+        self.handler = handler
+        self.plan = plan or (lambda jobs: [[job] for job in jobs])
+        self.prefilter = prefilter
+        self.max_inflight = max(1, max_inflight or config.MAX_INFLIGHT)
+        self.stage_limits = stage_limits or config.STAGE_CONCURRENCY
+        # 每个执行单元包含的 job 数 (stage 2 批量打标时 > 1), 用于把单元并发换算成认领预算
+        self.unit_sizes = unit_sizes or {}
+        self._stage_jobs: Dict[int, int] = {}
+        self._stage_sems: Dict[int, asyncio.Semaphore] = {}
+        self.budget = budget  # 多进程共享的在途预算 (InflightBudget), 单进程时为 None
+        self._tasks = set()
+        self._inflight_jobs = 0
+        self._stop_waiter = None
+
+    def _stage_sem(self, stage: int) -> asyncio.Semaphore:
+        if stage not in self._stage_sems:
+            limit = self.stage_limits.get(stage) or self.max_inflight
+            self._stage_sems[stage] = asyncio.Semaphore(max(1, limit))
+        return self._stage_sems[stage]
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight_jobs
+
+    async def _run_unit(self, unit: List[dict]):
+        try:
+            async with self._stage_sem(unit[0]["stage"]):
+                await asyncio.to_thread(self.handler, unit)
+        except Exception as e:
+            print(f"[!] [Executor] Jobs:{[job['id'] for job in unit]} 未捕获异常: {e}")
+        finally:
+            self._inflight_jobs -= len(unit)
+            self._stage_jobs[unit[0]["stage"]] -= len(unit)
+            if self.budget is not None:
+                self.budget.give(len(unit))
+
+    def submit(self, jobs: List[dict]):
+        for unit in self.plan(jobs):
+            self._inflight_jobs += len(unit)
+            stage = unit[0]["stage"]
+            self._stage_jobs[stage] = self._stage_jobs.get(stage, 0) + len(unit)
+            task = asyncio.create_task(self._run_unit(unit))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def wait_for_slot(self, timeout: float = None):
+        """等待至少一个任务完成 (或超时)"""
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        elif timeout:
+            await asyncio.sleep(timeout)
+
+    async def drain(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def idle(self, waiter):
+        """队列为空: 等待 NOTIFY / 退避超时 / 任意在途任务完成, 以先到者为准"""
+        notified = asyncio.ensure_future(waiter.idle_async())
+        wakeups = {notified, *self._tasks}
+        if self._stop_waiter is not None:
+            wakeups.add(self._stop_waiter)
+        try:
+            await asyncio.wait(wakeups, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            notified.cancel()
+
+    def stage_budgets(self) -> Dict[int, int]:
+        """各 stage 还能认领的 job 数: 并发上限 x 单元大小 - 已认领未完成的 job 数"""
+        return {
+            stage: max(0, limit * max(1, self.unit_sizes.get(stage, 1)) - self._stage_jobs.get(stage, 0))
+            for stage, limit in self.stage_limits.items()
+        }
+
+    async def _claim(self, pull, want: int) -> List[dict]:
+        """认领最多 want 个任务; 有共享预算时先取名额, 没用上的立即归还 (取不到名额返回 None)"""
+        if self.budget is not None:
+            want = await asyncio.to_thread(self.budget.take, want)
+            if not want:
+                return None
+        try:
+            jobs = await asyncio.to_thread(pull, want, self.stage_budgets())
+        except Exception:
+            if self.budget is not None:
+                self.budget.give(want)
+            raise
+        if self.budget is not None:
+            self.budget.give(want - len(jobs))
+        return jobs
+
+    async def run(self, pull: Callable[[int], List[dict]], waiter, stop=None):
+        """stop (threading.Event) 置位后停止认领, 等在途任务全部完成后返回"""
+        loop = asyncio.get_running_loop()
+        # 默认线程池上限是 min(32, cpu+4), 需要与 in-flight 上限对齐 (另留一个线程等待 stop)
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.max_inflight + 2))
+        print(f"[*] [Executor] async 模式启动: max_inflight={self.max_inflight} stage_limits={self.stage_limits}")
+        if stop is not None:
+            self._stop_waiter = loop.run_in_executor(None, stop.wait)
+
+        while stop is None or not stop.is_set():
+            free = self.max_inflight - self.inflight
+            if free <= 0:
+                await self.wait_for_slot()
+                continue
+
+            batch_start = time.time()
+            jobs = await self._claim(pull, min(free, config.BATCH_SIZE))
+            if jobs is None:
+                # 其他进程占满了共享预算, take 内部已等待过
+                continue
+            if not jobs:
+                if self._tasks and not any(self.stage_budgets().values()):
+                    # 各 stage 预算都已占满, 等在途任务完成而不是空转
+                    await self.wait_for_slot()
+                else:
+                    await self.idle(waiter)
+                continue
+            waiter.backoff.reset()
+
+            print(f"[*] [Executor] Pulled {len(jobs)} jobs: {[j['id'] for j in jobs]} inflight={self.inflight}")
+            if self.prefilter is not None:
+                claimed = len(jobs)
+                jobs = await asyncio.to_thread(self.prefilter, jobs)
+                if self.budget is not None:
+                    self.budget.give(claimed - len(jobs))
+            self.submit(jobs)
+            print(f"[*] batch_size={len(jobs)} claim_cost={time.time() - batch_start:.3f}s inflight={self.inflight}")
+
+        print(f"[*] [Executor] 停止认领, 等待 {self.inflight} 个在途任务完成")
+        await self.drain()
@@ -0,0 +1,210 @@
+import os
+import time
+import socket
+import threading
+import psycopg2
+from app.core.db import execute_autocommit, get_db_connection, missing_columns
+from app.core.config import config
+from app.core.metrics import JOBS_TOTAL
+from app.services.checkpoints import checkpoints_ready, prune_checkpoints
+
+# 失败重试的状态/退避计算, mark_job_failed / 批量错误写入 / 租约回收共用
+RETRY_SET_SQL = """
+    retries = cleaning_jobs.retries + 1,
+    status = CASE WHEN cleaning_jobs.retries + 1 > {max_retries} THEN 3 ELSE 0 END,
+    next_run_at = CASE
+        WHEN cleaning_jobs.retries + 1 > {max_retries} THEN NOW()
+        ELSE NOW() + (cleaning_jobs.retries + 1) * ({base_seconds} * INTERVAL '1 second')
+    END,
+    lease_expires_at = NULL,
+    updated_at = NOW()
+"""
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+LEASE_COLUMNS = {
+    "lease_expires_at": "TIMESTAMPTZ",
+    "leased_by": "TEXT",
+}
+
+
+def ensure_lease_columns():
+    """旧库没有租约列时补上 (幂等), 老数据 lease_expires_at 为 NULL, 回收时按 updated_at 兜底
+
+    正式环境应执行 migrations/001_job_leases.sql; 这里只在列确实缺失时才 ALTER TABLE (ACCESS EXCLUSIVE 锁会阻塞认领),
+    索引用 CONCURRENTLY 建, 不阻塞写入.
+    """
+    try:
+        missing = missing_columns("cleaning_jobs", LEASE_COLUMNS)
+        if missing:
+            conn = get_db_connection()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "ALTER TABLE cleaning_jobs "
+                        + ", ".join(f"ADD COLUMN IF NOT EXISTS {column} {LEASE_COLUMNS[column]}" for column in missing)
+                    )
+                    conn.commit()
+            finally:
+                conn.close()
+            print(f"[*] [Lease] cleaning_jobs 已补充列: {missing}")
+        execute_autocommit("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS cleaning_jobs_lease_idx
+            ON cleaning_jobs (lease_expires_at) WHERE status = 1
+        """)
+    except psycopg2.Error as e:
+        # 多副本同时启动时 DDL 可能互相冲突, 只要有一个成功即可
+        print(f"[!] [Lease] 补充租约列失败: {e}")
+
+
+class LeaseKeeper:
+    """本进程在途任务的租约: 后台线程定期续约, 并顺带回收其他 worker 遗留的过期租约
+
+    - 认领时 lease_expires_at = NOW() + JOB_LEASE_SECONDS
+    - 每 JOB_LEASE_SECONDS / 3 秒为在途任务续约; 开始处理 (begin) 后超过 JOB_LEASE_MAX_SECONDS 的任务不再续约 (视为卡死),
+      认领后还在本地排队的任务一直续约
+    - 每 JOB_REAP_INTERVAL 秒把过期租约批量退回 status = 0, 按 mark_job_failed 的规则计入重试
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}  # job_id -> 开始处理的时间 (monotonic), 尚未开始为 None
+        self._thread = None
+        self._pid = None
+        self._last_reap = 0.0
+        self.stats = {"heartbeats": 0, "renewed": 0, "lost": 0, "abandoned": 0, "reaped": 0}
+
+    def track(self, job_ids, started: bool = False):
+        self.start()
+        now = time.monotonic() if started else None
+        with self._lock:
+            for job_id in job_ids:
+                self._jobs.setdefault(job_id, now)
+
+    def begin(self, job_ids):
+        """任务真正开始执行时调用, 卡死判定从这里开始计时"""
+        now = time.monotonic()
+        with self._lock:
+            for job_id in job_ids:
+                if job_id in self._jobs and self._jobs[job_id] is None:
+                    self._jobs[job_id] = now
+
+    def release(self, job_ids):
+        with self._lock:
+            for job_id in job_ids:
+                self._jobs.pop(job_id, None)
+
+    def start(self):
+        # 线程不会跨 fork 存活, 按 pid 重新启动
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._jobs = {}
+                    self._thread = threading.Thread(target=self._loop, name="job-lease", daemon=True)
+                    self._thread.start()
+
+    def _loop(self):
+        interval = max(1.0, config.JOB_LEASE_SECONDS / 3)
+        while True:
+            time.sleep(interval)
+            try:
+                self.heartbeat()
+                if time.monotonic() - self._last_reap >= config.JOB_REAP_INTERVAL:
+                    self._last_reap = time.monotonic()
+                    reap_expired_leases()
+                    if checkpoints_ready():
+                        prune_checkpoints()
+            except Exception as e:
+                print(f"[!] [Lease] 续约/回收失败: {e}")
+
+    def heartbeat(self):
+        now = time.monotonic()
+        with self._lock:
+            renew = [
+                job_id for job_id, started_at in self._jobs.items()
+                if started_at is None or now - started_at < config.JOB_LEASE_MAX_SECONDS
+            ]
+            stuck = [job_id for job_id in self._jobs if job_id not in renew]
+            for job_id in stuck:
+                self._jobs.pop(job_id)
+        for job_id in stuck:
+            print(f"[!] [Lease][Job:{job_id}] 在途超过 {config.JOB_LEASE_MAX_SECONDS}s, 停止续约等待回收")
+        if not renew:
+            return
+
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE cleaning_jobs
+                    SET lease_expires_at = NOW() + %s * INTERVAL '1 second'
+                    WHERE id = ANY(%s) AND status = 1 AND leased_by = %s
+                    RETURNING id
+                    """,
+                    (config.JOB_LEASE_SECONDS, renew, worker_id()),
+                )
+                renewed = {row["id"] for row in cur.fetchall()}
+                conn.commit()
+        finally:
+            conn.close()
+
+        lost = [job_id for job_id in renew if job_id not in renewed]
+        if lost:
+            # 租约已被回收 / 被其他 worker 重新认领 (或任务已完成): 结果写入时按租约 fencing, 不会覆盖对方
+            print(f"[!] [Lease] {len(lost)} 个在途任务的租约已失效: {lost}")
+            self.release(lost)
+        self.stats["heartbeats"] += 1
+        self.stats["renewed"] += len(renewed)
+        self.stats["lost"] += len(lost)
+        self.stats["abandoned"] += len(stuck)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "tracked": len(self._jobs)}
+
+
+def reap_expired_leases(limit: int = 500) -> int:
+    """把租约过期的 status = 1 任务批量退回队列 (SKIP LOCKED, 多个 worker 同时回收不冲突)"""
+    from app.services.persistence import MAX_RETRIES, RETRY_BASE_SECONDS
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                WITH expired AS (
+                    SELECT id FROM cleaning_jobs
+                    WHERE status = 1
+                      AND COALESCE(lease_expires_at, updated_at + %s * INTERVAL '1 second') < NOW()
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                UPDATE cleaning_jobs
+                SET {RETRY_SET_SQL.format(max_retries=MAX_RETRIES, base_seconds=RETRY_BASE_SECONDS)},
+                    last_error = 'lease expired (held by ' || COALESCE(cleaning_jobs.leased_by, 'unknown') || ')'
+                FROM expired
+                WHERE cleaning_jobs.id = expired.id
+                RETURNING cleaning_jobs.id, cleaning_jobs.stage, cleaning_jobs.status
+                """,
+                (config.JOB_LEASE_LEGACY_SECONDS, limit),
+            )
+            rows = cur.fetchall()
+            conn.commit()
+    finally:
+        conn.close()
+
+    for row in rows:
+        JOBS_TOTAL.inc(stage=row["stage"], outcome="lease_expired")
+    if rows:
+        dead = sum(1 for row in rows if row["status"] == 3)
+        print(f"[*] [Lease] 回收 {len(rows)} 个过期租约 ({dead} 个超过重试上限): {[row['id'] for row in rows]}")
+    lease_keeper.stats["reaped"] += len(rows)
+    return len(rows)
+
+
+lease_keeper = LeaseKeeper()
@@ -0,0 +1,195 @@
+import time
+import select
+import asyncio
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from app.core.db import get_db_connection
+from app.core.config import config
+
+TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION notify_cleaning_job() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{channel}', NEW.stage::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS cleaning_jobs_notify ON cleaning_jobs;
+CREATE TRIGGER cleaning_jobs_notify
+AFTER INSERT OR UPDATE OF status ON cleaning_jobs
+FOR EACH ROW WHEN (NEW.status = 0 AND NEW.next_run_at <= NOW())
+EXECUTE FUNCTION notify_cleaning_job();
+"""
+
+
+def install_notify_trigger():
+    """在 cleaning_jobs 上安装 INSERT/状态回退触发器, 新任务可立即唤醒 worker (幂等)"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(TRIGGER_SQL.format(channel=config.JOB_NOTIFY_CHANNEL))
+            conn.commit()
+        print(f"[*] [Notify] Trigger installed on cleaning_jobs -> {config.JOB_NOTIFY_CHANNEL}")
+    except psycopg2.Error as e:
+        # 多副本同时启动时可能互相冲突, 触发器只要有一个装上即可
+        print(f"[!] [Notify] 安装触发器失败: {e}")
+    finally:
+        conn.close()
+
+
+def next_due_in():
+    """距离最近一个未到期的待执行任务 (延迟重试) 还有几秒, 没有时返回 None
+
+    触发器只在 next_run_at 已到期时通知, 延迟重试到期时不会有 NOTIFY, 只能靠轮询发现.
+    """
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT EXTRACT(EPOCH FROM MIN(next_run_at) - NOW()) AS due
+                FROM cleaning_jobs WHERE status = 0 AND next_run_at > NOW()
+            """)
+            due = cur.fetchone()["due"]
+        conn.commit()
+        return None if due is None else max(0.0, float(due))
+    finally:
+        conn.close()
+
+
+class IdleBackoff:
+    """空闲轮询的指数退避: 拿到任务后重置为 base, 空转时翻倍直到 max"""
+
+    def __init__(self, base: float, maximum: float):
+        self.base = base
+        self.maximum = max(maximum, base)
+        self.current = base
+
+    def reset(self):
+        self.current = self.base
+
+    def next(self) -> float:
+        delay = self.current
+        self.current = min(self.current * 2, self.maximum)
+        return delay
+
+
+class JobWaiter:
+    """LISTEN 专用长连接 (不走连接池) + 退避轮询兜底
+
+    未开启 JOB_NOTIFY 或连接异常时退化为纯 sleep 轮询.
+    """
+
+    def __init__(self):
+        self.enabled = config.JOB_NOTIFY
+        self.channel = config.JOB_NOTIFY_CHANNEL
+        max_delay = config.POLL_INTERVAL_MAX if self.enabled else config.POLL_INTERVAL
+        self.backoff = IdleBackoff(config.POLL_INTERVAL_MIN, max_delay)
+        self.conn = None
+        self._event = None
+        self._reader_loop = None
+        # add_reader 回调每收到一批通知 +1; wait_async 记住已消费到的序号,
+        # 认领期间 (不在 wait 中) 到达的通知不会因 clear() 丢失
+        self._seq = 0
+        self._seen = 0
+
+    def _ensure_conn(self):
+        if self.conn is not None and not self.conn.closed:
+            return self.conn
+        self.conn = None
+        conn = psycopg2.connect(config.DATABASE_URL)
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {self.channel}")
+        self.conn = conn
+        print(f"[*] [Notify] LISTEN {self.channel}")
+        return conn
+
+    def _drain(self) -> bool:
+        self.conn.poll()
+        got = bool(self.conn.notifies)
+        self.conn.notifies.clear()
+        return got
+
+    def _reset_conn(self, e):
+        print(f"[!] [Notify] LISTEN 连接异常, 回退到轮询: {e}")
+        if self._reader_loop is not None and self.conn is not None:
+            self._reader_loop.remove_reader(self.conn.fileno())
+        self._reader_loop = None
+        try:
+            if self.conn is not None:
+                self.conn.close()
+        except Exception:
+            pass
+        self.conn = None
+
+    def wait(self, timeout: float) -> bool:
+        """阻塞等待通知, 返回是否收到通知"""
+        if not self.enabled:
+            time.sleep(timeout)
+            return False
+        try:
+            conn = self._ensure_conn()
+            if self._drain():
+                return True
+            ready, _, _ = select.select([conn], [], [], timeout)
+            return bool(ready) and self._drain()
+        except (psycopg2.Error, OSError) as e:
+            self._reset_conn(e)
+            time.sleep(timeout)
+            return False
+
+    def _on_readable(self):
+        try:
+            if self._drain():
+                self._seq += 1
+                self._event.set()
+        except psycopg2.Error as e:
+            self._reset_conn(e)
+
+    async def wait_async(self, timeout: float) -> bool:
+        """asyncio 版本: 通过 add_reader 监听 socket, 不占用线程"""
+        if not self.enabled:
+            await asyncio.sleep(timeout)
+            return False
+        loop = asyncio.get_running_loop()
+        try:
+            conn = self._ensure_conn()
+            if self._reader_loop is None:
+                self._event = asyncio.Event()
+                loop.add_reader(conn.fileno(), self._on_readable)
+                self._reader_loop = loop
+            if self._drain():
+                return True
+        except (psycopg2.Error, OSError) as e:
+            self._reset_conn(e)
+            await asyncio.sleep(timeout)
+            return False
+
+        if self._seq != self._seen:
+            self._seen = self._seq
+            return True
+        self._event.clear()
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._seen = self._seq
+        return True
+
+    def _cap(self, delay: float) -> float:
+        """退避超过 POLL_INTERVAL 时, 不睡过最近一个延迟重试任务的 next_run_at; 查询失败时退回 POLL_INTERVAL"""
+        if not self.enabled or delay <= config.POLL_INTERVAL:
+            return delay
+        try:
+            due = next_due_in()
+        except psycopg2.Error as e:
+            print(f"[!] [Notify] 查询下一个到期任务失败: {e}")
+            return config.POLL_INTERVAL
+        return delay if due is None else min(delay, max(due, config.POLL_INTERVAL_MIN))
+
+    def idle(self) -> bool:
+        return self.wait(self._cap(self.backoff.next()))
+
+    async def idle_async(self) -> bool:
+        delay = await asyncio.to_thread(self._cap, self.backoff.next())
+        return await self.wait_async(delay)
@@ -1,174 +1,555 @@
 ﻿import json
+import time
+import threading
+import psycopg2
+from psycopg2.extras import execute_values
 from app.core.db import get_db_connection
+from app.core.config import config
+from app.core.metrics import observe_node, DB_QUERY_LATENCY, JOBS_TOTAL
+from app.services.leases import RETRY_SET_SQL, lease_keeper, worker_id
+from app.services.checkpoints import checkpoints_ready
+from app.services.report_freshness import gating_ready
+from app.services.tag_cache import bypass_column_ready
 from app.agent.state import AgentState
 
 MAX_RETRIES = 5
+# 链式执行只进入这些 stage; stage 3 (深度研报) 走队列, 由 executor 按 STAGE3_CONCURRENCY 调度,
+# 不在上一阶段的执行名额里串行跑完
+CHAIN_TARGET_STAGES = (2,)
 RETRY_BASE_SECONDS = 5
+_RETRY_SET = RETRY_SET_SQL.format(max_retries=MAX_RETRIES, base_seconds=RETRY_BASE_SECONDS)
 
 
-def mark_job_failed(job_id: int, error_msg: str):
+def mark_job_failed(job_id: int, error_msg: str, stage=None) -> bool:
+    """计入重试; 租约已不属于本 worker (已被回收 / 其他 worker 重新认领) 时不动该行, 返回 False"""
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
             cur.execute(
-                """
+                f"""
                 UPDATE cleaning_jobs
-                SET
-                    retries = retries + 1,
-                    last_error = %s,
-                    status = CASE WHEN retries + 1 > %s THEN 3 ELSE 0 END,
-                    next_run_at = CASE
-                        WHEN retries + 1 > %s THEN NOW()
-                        ELSE NOW() + (retries + 1) * (%s * INTERVAL '1 second')
-                    END,
-                    updated_at = NOW()
-                WHERE id = %s
+                SET {_RETRY_SET}, last_error = %s
+                WHERE id = %s AND status = 1 AND leased_by = %s
+                RETURNING id
                 """,
-                (error_msg, MAX_RETRIES, MAX_RETRIES, RETRY_BASE_SECONDS, job_id),
+                (error_msg, job_id, worker_id()),
             )
+            marked = cur.fetchone() is not None
             conn.commit()
     finally:
         conn.close()
+    lease_keeper.release([job_id])
+    if marked:
+        JOBS_TOTAL.inc(stage=stage or "unknown", outcome="failed")
+    else:
+        print(f"[!] [Persist][Job:{job_id}] 租约已失效, 不计入重试: {error_msg}")
+    return marked
 
 
-def persist_result(state: AgentState):
-    print(f"[*] [Persist][Job:{state['job_id']}] Saving results for Stage:{state['stage']}")
+def _fail_jobs(failed):
+    """[(state, error_msg)] 逐个走 mark_job_failed; 标记也失败时停止续约, 租约过期后由 reaper 回收"""
+    for state, error_msg in failed:
+        print(f"[!] [Persist][Job:{state['job_id']}] 写入失败: {error_msg}")
+        try:
+            mark_job_failed(state["job_id"], error_msg, stage=state["stage"])
+        except Exception as e:
+            print(f"[!] [Persist][Job:{state['job_id']}] 标记失败也未成功, 等待租约过期: {e}")
+            lease_keeper.release([state["job_id"]])
+
+
+def _risk_hint(state: AgentState):
+    # 计算 risk_hint 用于同步到 Project 表
+    if state.get("risk_level") and state.get("short_comment"):
+        return f"[{state.get('risk_level')}] {state.get('short_comment')}"
+    if state["stage"] == 2:
+        # 如果当前刚好是 stage 2，直接构造
+        return f"[{state.get('risk_level', 'Medium')}] {state.get('short_comment', '')}"
+    return None
+
+
+def _next_stage(state: AgentState):
+    """阶段派发: 返回需要创建的下一阶段, 不需要时返回 None"""
+    if state.get("status") != "passed":
+        return None
+    next_stage = state["stage"] + 1
+    if next_stage > 3:
+        return None
+    if next_stage == 3 and (state.get("vibe_score") or 0) < 60:
+        return None
+    return next_stage
+
+
+def _count_outcomes(states):
+    """提交成功后按阶段统计结果: passed -> processed, filtered, error -> failed"""
+    for state in states:
+        outcome = {"passed": "processed", "error": "failed"}.get(state.get("status"), state.get("status") or "unknown")
+        JOBS_TOTAL.inc(stage=state["stage"], outcome=outcome)
+
+
+def _dedupe(rows, key_index=0):
+    """ON CONFLICT DO UPDATE 不允许同一语句命中同一行两次, 按主键保留最后一条"""
+    return list({row[key_index]: row for row in rows}.values())
+
+
+def _write_batch(cur, states, chain: bool = False):
+    """把一组结果用多行 INSERT / UPSERT 写入 (不负责提交)
+
+    chain=True 时下一阶段任务直接以 status = 1 + 本 worker 的租约写入, 返回认领到的 [{id, token_id, stage}],
+    由调用方在进程内继续执行 (行仍然落库, 崩溃后由租约回收重试).
+    """
+    chained = []
+    errors, tag_rows, report_rows, alpha_rows, project_rows, done_ids, next_rows = [], [], [], [], [], [], []
+    has_checkpoints = set()
+    report_updates, fingerprint_rows = [], []
+
+    for state in states:
+        print(f"[*] [Persist][Job:{state['job_id']}] Saving results for Stage:{state['stage']}")
+        if state.get("status") == "error":
+            errors.append((state["job_id"], state.get("error_msg") or "error"))
+            continue
+
+        # 记录分级分析结果
+        if state["stage"] == 2 and state.get("tags"):
+            # 将 risk_level 和 short_comment 组合存入 risk_hint
+            risk_hint = f"[{state.get('risk_level', 'Medium')}] {state.get('short_comment', '')}"
+            tag_rows.append((state["token_id"], json.dumps(state["tags"]), state.get("vibe_score"), risk_hint))
+
+        # 记录研报 (如果有内容的话); 流式生成时已提前插入, 这里只写最终内容
+        if state.get("report"):
+            if state.get("report_id"):
+                report_updates.append((state["report_id"], state["report"]))
+            else:
+                report_rows.append((state["token_id"], state["report"]))
+            if state.get("report_fingerprint") and state.get("status") == "passed":
+                fp = state["report_fingerprint"]
+                fingerprint_rows.append([
+                    state["token_id"], fp["fingerprint"], json.dumps(fp["inputs"]), state.get("report_id"), fp.get("reason"),
+                ])
+
+        # 记录链上 Alpha 数据
+        if state.get("alpha_data"):
+            alpha = state["alpha_data"]
+            alpha_rows.append((
+                state["token_id"],
+                alpha.get("smart_money_count"),  # 暂时用 count 代替 score
+                alpha.get("holder_concentration"),
+                alpha.get("is_cabal_confirmed"),
+                json.dumps(alpha) if alpha else None,
+                alpha.get("degen_score"),
+            ))
+
+        # 更新 Project 表用于前端展示
+        if state.get("status") == "passed":
+            project_rows.append((
+                str(state["contract"]),
+                state["symbol"],
+                state["name"],
+                state["data"].get("image_url"),
+                state["data"].get("chain") or "bsc",
+                state["contract"],
+                str(state["data"].get("market_cap") or "0"),
+                str(state["data"].get("liquidity") or "0"),
+                state["data"].get("price_change_24h"),
+                "New",
+                "SAFE",
+                state.get("tags") or [],
+                _risk_hint(state),
+                state["data"].get("description") or "",
+                state.get("report") or "",
+                state.get("vibe_score") or 0,
+            ))
+
+        done_ids.append(state["job_id"])
+        if state.get("checkpoints"):
+            has_checkpoints.add(state["job_id"])
+
+        # 阶段派发下一阶段任务
+        next_stage = _next_stage(state)
+        if next_stage:
+            print(f"[*] [Persist][Job:{state['job_id']}] Creating/Updating NEXT STAGE job: {next_stage}")
+            next_rows.append((state["job_id"], state["token_id"], next_stage, bool(state.get("bypass_cache"))))
+
+    owner = worker_id()
+    if errors:
+        # 与完成标记同样按租约 fencing, 不把其他 worker 在途的行退回队列
+        marked = execute_values(
+            cur,
+            f"""
+            UPDATE cleaning_jobs
+            SET {_RETRY_SET}, last_error = v.last_error
+            FROM (VALUES %s) AS v(id, last_error, owner)
+            WHERE cleaning_jobs.id = v.id AND cleaning_jobs.status = 1 AND cleaning_jobs.leased_by = v.owner
+            RETURNING cleaning_jobs.id
+            """,
+            [(job_id, error_msg, owner) for job_id, error_msg in errors],
+            page_size=len(errors),
+            fetch=True,
+        )
+        marked = {row["id"] for row in marked}
+        for job_id, _ in errors:
+            if job_id not in marked:
+                print(f"[!] [Persist][Job:{job_id}] 租约已失效, 错误结果不计入重试")
+
+    if tag_rows:
+        execute_values(
+            cur,
+            "INSERT INTO token_tags (token_id, tags, vibe_score, risk_hint) VALUES %s",
+            tag_rows,
+            page_size=len(tag_rows),
+        )
+
+    if report_rows:
+        inserted = execute_values(
+            cur,
+            "INSERT INTO analysis_reports (token_id, report_text) VALUES %s RETURNING id, token_id",
+            report_rows,
+            page_size=len(report_rows),
+            fetch=True,
+        )
+        # 新插入的研报 id 回填到指纹记录 (流式生成的已带 report_id)
+        report_ids = {row["token_id"]: row["id"] for row in inserted}
+        for row in fingerprint_rows:
+            if row[3] is None:
+                row[3] = report_ids.get(row[0])
+
+    if fingerprint_rows and gating_ready():
+        execute_values(
+            cur,
+            """
+            INSERT INTO report_fingerprints (token_id, fingerprint, inputs, report_id, reason, created_at)
+            VALUES %s
+            ON CONFLICT (token_id) DO UPDATE
+            SET fingerprint = EXCLUDED.fingerprint, inputs = EXCLUDED.inputs, report_id = EXCLUDED.report_id,
+                reason = EXCLUDED.reason, created_at = NOW()
+            """,
+            [tuple(row) for row in _dedupe(fingerprint_rows)],
+            template="(%s, %s, %s::jsonb, %s, %s, NOW())",
+            page_size=len(fingerprint_rows),
+        )
+
+    if report_updates:
+        execute_values(
+            cur,
+            """
+            UPDATE analysis_reports SET report_text = v.report_text
+            FROM (VALUES %s) AS v(id, report_text)
+            WHERE analysis_reports.id = v.id
+            """,
+            report_updates,
+            page_size=len(report_updates),
+        )
+
+    if alpha_rows:
+        alpha_rows = _dedupe(alpha_rows)
+        execute_values(
+            cur,
+            """
+            INSERT INTO token_alpha (
+                token_id, smart_money_score, holder_concentration,
+                is_cabal_confirmed, top_holders_pnl, degen_score
+            ) VALUES %s
+            ON CONFLICT (token_id) DO UPDATE SET
+                smart_money_score = EXCLUDED.smart_money_score,
+                holder_concentration = EXCLUDED.holder_concentration,
+                is_cabal_confirmed = EXCLUDED.is_cabal_confirmed,
+                top_holders_pnl = EXCLUDED.top_holders_pnl,
+                updated_at = NOW()
+            """,
+            alpha_rows,
+            page_size=len(alpha_rows),
+        )
+
+    if project_rows:
+        project_rows = _dedupe(project_rows)
+        execute_values(
+            cur,
+            """
+            INSERT INTO "Project" (
+                id, symbol, name, "imageUrl", "chainId", "contractAddress",
+                "marketCap", "liquidity", "priceChange24h", age, "safetyLevel", tags, "riskHint", description, "aiReport", "hypeScore", type
+            ) VALUES %s
+            ON CONFLICT (id) DO UPDATE SET
+                tags = EXCLUDED.tags,
+                "riskHint" = EXCLUDED."riskHint",
+                "hypeScore" = EXCLUDED."hypeScore",
+                description = EXCLUDED.description,
+                "aiReport" = EXCLUDED."aiReport",
+                "marketCap" = EXCLUDED."marketCap",
+                "liquidity" = EXCLUDED."liquidity",
+                "priceChange24h" = EXCLUDED."priceChange24h"
+            """,
+            project_rows,
+            template="(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 'MEME')",
+            page_size=len(project_rows),
+        )
+
+    completed = set()
+    if done_ids:
+        # 租约 fencing: 只有仍由本 worker 持有的任务才能标记完成 / 派发下一阶段,
+        # 租约已被回收 (任务可能已被其他 worker 重新认领) 时放弃, 避免重复派发
+        cur.execute(
+            """
+            UPDATE cleaning_jobs SET status = 2, lease_expires_at = NULL, updated_at = NOW()
+            WHERE id = ANY(%s) AND status = 1 AND leased_by = %s
+            RETURNING id
+            """,
+            (done_ids, owner),
+        )
+        completed = {row["id"] for row in cur.fetchall()}
+        # 任务已完成, 检查点不再需要; 只删本次写过 / 重试时加载过检查点的任务, 其余不多一条语句
+        checkpointed_ids = [job_id for job_id in completed if job_id in has_checkpoints]
+        if checkpointed_ids and checkpoints_ready():
+            cur.execute("DELETE FROM job_checkpoints WHERE job_id = ANY(%s)", (checkpointed_ids,))
+        for job_id in done_ids:
+            if job_id in completed:
+                print(f"[*] [Persist][Job:{job_id}] Job marked as COMPLETED")
+            else:
+                print(f"[!] [Persist][Job:{job_id}] 租约已失效, 不标记完成也不派发下一阶段")
+
+    bypass = {}
+    for job_id, token_id, stage, bypass_cache in next_rows:
+        if job_id in completed:
+            bypass[(token_id, stage)] = bypass.get((token_id, stage), False) or bypass_cache
+    next_rows = list(bypass)
+    if next_rows and chain:
+        # 已在其他 worker 手里 (status = 1) 或已完成的行不抢, 不返回即不链式执行
+        chained = execute_values(
+            cur,
+            """
+            INSERT INTO cleaning_jobs (token_id, stage, status, next_run_at, created_at, updated_at, lease_expires_at, leased_by)
+            VALUES %s
+            ON CONFLICT (token_id, stage) DO UPDATE
+            SET status = 1, updated_at = NOW(),
+                lease_expires_at = EXCLUDED.lease_expires_at, leased_by = EXCLUDED.leased_by
+            WHERE cleaning_jobs.status NOT IN (1, 2)
+            RETURNING id, token_id, stage
+            """,
+            [(token_id, stage, owner) for token_id, stage in next_rows],
+            template=f"(%s, %s, 1, NOW(), NOW(), NOW(), NOW() + {float(config.JOB_LEASE_SECONDS)} * INTERVAL '1 second', %s)",
+            page_size=len(next_rows),
+            fetch=True,
+        )
+    elif next_rows:
+        execute_values(
+            cur,
+            """
+            INSERT INTO cleaning_jobs (token_id, stage, status, next_run_at, created_at, updated_at)
+            VALUES %s
+            ON CONFLICT (token_id, stage) DO UPDATE
+            SET status = 0, updated_at = NOW()
+            WHERE cleaning_jobs.status != 2
+            """,
+            next_rows,
+            template="(%s, %s, 0, NOW(), NOW(), NOW())",
+            page_size=len(next_rows),
+        )
+        if config.JOB_NOTIFY:
+            # 提交后才会投递, 同一事务内相同 payload 会被合并
+            for stage in sorted({stage for _, stage in next_rows}):
+                cur.execute("SELECT pg_notify(%s, %s)", (config.JOB_NOTIFY_CHANNEL, str(stage)))
+
+    bypass_rows = [key for key, bypass_cache in bypass.items() if bypass_cache]
+    if bypass_rows and bypass_column_ready():
+        # 上一阶段要求跳过缓存时, 下一阶段沿用 (重试 / 其他 worker 认领时也生效)
+        execute_values(
+            cur,
+            """
+            UPDATE cleaning_jobs SET bypass_cache = TRUE
+            FROM (VALUES %s) AS v(token_id, stage)
+            WHERE cleaning_jobs.token_id = v.token_id AND cleaning_jobs.stage = v.stage AND cleaning_jobs.status != 2
+            """,
+            bypass_rows,
+            page_size=len(bypass_rows),
+        )
+    return chained
+
+
+def persist_result(state: AgentState, chain: bool = False):
+    """写入单个结果; chain=True 时返回本 worker 已认领的下一阶段任务 (可能为空)"""
     conn = get_db_connection()
     try:
-        with conn.cursor() as cur:
-            if state.get("status") == "error":
-                cur.execute(
-                    """
-                    UPDATE cleaning_jobs
-                    SET
-                        retries = retries + 1,
-                        last_error = %s,
-                        status = CASE WHEN retries + 1 > %s THEN 3 ELSE 0 END,
-                        next_run_at = CASE
-                            WHEN retries + 1 > %s THEN NOW()
-                            ELSE NOW() + (retries + 1) * (%s * INTERVAL '1 second')
-                        END,
-                        updated_at = NOW()
-                    WHERE id = %s
-                    """,
-                    (state.get("error_msg") or "error", MAX_RETRIES, MAX_RETRIES, RETRY_BASE_SECONDS, state["job_id"]),
-                )
+        with DB_QUERY_LATENCY.time(query="persist"), conn.cursor() as cur:
+            chained = _write_batch(cur, [state], chain=chain)
+            conn.commit()
+    finally:
+        conn.close()
+    lease_keeper.release([state["job_id"]])
+    lease_keeper.track([job["id"] for job in chained])
+    _count_outcomes([state])
+    return chained
+
+
+def persist_results(states):
+    """Group commit: 一个事务写完整批结果
+
+    先尝试整批多行写入; 整批失败时回滚到 savepoint, 再逐个 job 用独立 savepoint 写入,
+    单条坏数据只影响自己, 失败的 job 走 mark_job_failed 重试.
+    """
+    if not states:
+        return
+    failed = []
+    conn = get_db_connection()
+    try:
+        with DB_QUERY_LATENCY.time(query="persist_batch"), conn.cursor() as cur:
+            cur.execute("SAVEPOINT persist_batch")
+            try:
+                _write_batch(cur, states)
+                cur.execute("RELEASE SAVEPOINT persist_batch")
+            except Exception as e:
+                cur.execute("ROLLBACK TO SAVEPOINT persist_batch")
+                print(f"[!] [Persist] 批量写入失败, 逐条重试 ({len(states)} jobs): {e}")
+                for state in states:
+                    cur.execute("SAVEPOINT persist_job")
+                    try:
+                        _write_batch(cur, [state])
+                        cur.execute("RELEASE SAVEPOINT persist_job")
+                    except Exception as job_err:
+                        cur.execute("ROLLBACK TO SAVEPOINT persist_job")
+                        failed.append((state, job_err))
+            conn.commit()
+    finally:
+        conn.close()
+
+    print(f"[*] [Persist] Batch committed: {len(states) - len(failed)} ok, {len(failed)} failed")
+    failed_ids = {state["job_id"] for state, _ in failed}
+    # 失败的 job 在 mark_job_failed 之后才释放租约
+    lease_keeper.release([state["job_id"] for state in states if state["job_id"] not in failed_ids])
+    _count_outcomes([state for state in states if state["job_id"] not in failed_ids])
+    _fail_jobs([(state, f"persist error: {err}") for state, err in failed])
+
+
+class PartialReportWriter:
+    """流式研报增量落库: 首次 flush 插入 analysis_reports, 之后原地更新, 同步刷新 Project.aiReport"""
+
+    def __init__(self, state: AgentState):
+        self.token_id = state["token_id"]
+        self.contract = str(state["contract"])
+        self.report_id = None
+        self.previous = None  # 首次写入前的 Project.aiReport, discard 时恢复
+        self.written = None
+
+    def flush(self, text: str):
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                report_id, previous = self.report_id, self.previous
+                if report_id is None:
+                    cur.execute('SELECT "aiReport" FROM "Project" WHERE id = %s', (self.contract,))
+                    row = cur.fetchone()
+                    previous = row["aiReport"] if row else None
+                    cur.execute(
+                        "INSERT INTO analysis_reports (token_id, report_text) VALUES (%s, %s) RETURNING id",
+                        (self.token_id, text),
+                    )
+                    report_id = cur.fetchone()["id"]
+                else:
+                    cur.execute(
+                        "UPDATE analysis_reports SET report_text = %s WHERE id = %s",
+                        (text, report_id),
+                    )
+                # Project 行不存在时 (stage 1 首次研报) 等最终 persist 再写入
+                cur.execute('UPDATE "Project" SET "aiReport" = %s WHERE id = %s', (text, self.contract))
                 conn.commit()
-                return
+            # 提交成功后才记下 report_id, 避免指向已回滚的行
+            self.report_id, self.previous, self.written = report_id, previous, text
+        except psycopg2.Error as e:
+            # 中间结果写入失败不影响生成, 最终结果仍由 persist 写入
+            print(f"[!] [Persist] 研报增量写入失败: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
 
-            # 记录分级分析结果
-            if state["stage"] == 2 and state.get("tags"):
-                # 将 risk_level 和 short_comment 组合存入 risk_hint
-                risk_hint = f"[{state.get('risk_level', 'Medium')}] {state.get('short_comment', '')}"
+    def discard(self):
+        """生成失败且内容不足以保留时撤销增量写入: 删除 analysis_reports 行, aiReport 恢复为生成前的内容"""
+        if self.report_id is None:
+            return
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM analysis_reports WHERE id = %s", (self.report_id,))
+                # aiReport 已被其他写入覆盖时不动
                 cur.execute(
-                    "INSERT INTO token_tags (token_id, tags, vibe_score, risk_hint) VALUES (%s, %s, %s, %s)",
-                    (state["token_id"], json.dumps(state["tags"]), state.get("vibe_score"), risk_hint),
+                    'UPDATE "Project" SET "aiReport" = %s WHERE id = %s AND "aiReport" = %s',
+                    (self.previous, self.contract, self.written),
                 )
+                conn.commit()
+            self.report_id = None
+        except psycopg2.Error as e:
+            print(f"[!] [Persist] 撤销部分研报 {self.report_id} 失败: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
 
-            # 记录研报 (如果有内容的话)
-            if state.get("report"):
-                cur.execute(
-                    "INSERT INTO analysis_reports (token_id, report_text) VALUES (%s, %s)",
-                    (state["token_id"], state["report"]),
-                )
 
-            # 记录链上 Alpha 数据
-            if state.get("alpha_data"):
-                alpha = state["alpha_data"]
-                cur.execute(
-                    """
-                    INSERT INTO token_alpha (
-                        token_id, smart_money_score, holder_concentration, 
-                        is_cabal_confirmed, top_holders_pnl, degen_score
-                    ) VALUES (%s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (token_id) DO UPDATE SET
-                        smart_money_score = EXCLUDED.smart_money_score,
-                        holder_concentration = EXCLUDED.holder_concentration,
-                        is_cabal_confirmed = EXCLUDED.is_cabal_confirmed,
-                        top_holders_pnl = EXCLUDED.top_holders_pnl,
-                        updated_at = NOW()
-                    """,
-                    (
-                        state["token_id"],
-                        alpha.get("smart_money_count"), # 暂时用 count 代替 score
-                        alpha.get("holder_concentration"),
-                        alpha.get("is_cabal_confirmed"),
-                        json.dumps(alpha) if alpha else None,
-                        alpha.get("degen_score")
-                    )
-                )
+class PersistBuffer:
+    """收集结果, 攒够 max_size 条或最老的一条等待超过 max_wait 秒时批量提交"""
 
-            # 更新 Project 表用于前端展示
-            if state.get("status") == "passed":
-                # 计算 risk_hint 用于同步到 Project 表
-                risk_hint = None
-                if state.get("risk_level") and state.get("short_comment"):
-                    risk_hint = f"[{state.get('risk_level')}] {state.get('short_comment')}"
-                elif state["stage"] == 2:
-                    # 如果当前刚好是 stage 2，直接构造
-                    risk_hint = f"[{state.get('risk_level', 'Medium')}] {state.get('short_comment', '')}"
+    def __init__(self, max_size: int, max_wait: float):
+        self.max_size = max(1, max_size)
+        self.max_wait = max_wait
+        self._items = []
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
 
-                cur.execute(
-                    """
-                    INSERT INTO "Project" (
-                        id, symbol, name, "imageUrl", "chainId", "contractAddress", 
-                        "marketCap", "liquidity", "priceChange24h", age, "safetyLevel", tags, "riskHint", description, "aiReport", "hypeScore", type
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 'MEME')
-                    ON CONFLICT (id) DO UPDATE SET 
-                        tags = EXCLUDED.tags,
-                        "riskHint" = EXCLUDED."riskHint",
-                        "hypeScore" = EXCLUDED."hypeScore",
-                        description = EXCLUDED.description,
-                        "aiReport" = EXCLUDED."aiReport",
-                        "marketCap" = EXCLUDED."marketCap",
-                        "liquidity" = EXCLUDED."liquidity",
-                        "priceChange24h" = EXCLUDED."priceChange24h"
-                    """,
-                    (
-                        str(state["contract"]),
-                        state["symbol"],
-                        state["name"],
-                        state["data"].get("image_url"),
-                        state["data"].get("chain") or "bsc",
-                        state["contract"],
-                        str(state["data"].get("market_cap") or "0"),
-                        str(state["data"].get("liquidity") or "0"),
-                        state["data"].get("price_change_24h"),
-                        "New",
-                        "SAFE",
-                        state.get("tags") or [],
-                        risk_hint,
-                        state["data"].get("description") or "",
-                        state.get("report") or "",
-                        state.get("vibe_score") or 0,
-                    ),
-                )
+    def _start_timer(self):
+        if self._timer is None and self.max_wait > 0:
+            self._timer = threading.Thread(target=self._timer_loop, name="persist-flusher", daemon=True)
+            self._timer.start()
 
-            cur.execute(
-                "UPDATE cleaning_jobs SET status = 2, updated_at = NOW() WHERE id = %s",
-                (state["job_id"],),
-            )
-            print(f"[*] [Persist][Job:{state['job_id']}] Job marked as COMPLETED")
-
-            # 阶段派发下一阶段任务
-            if state.get("status") == "passed":
-                next_stage = state["stage"] + 1
-                if next_stage <= 3:
-                    if next_stage == 3 and (state.get("vibe_score") or 0) < 60:
-                        pass
-                    else:
-                        print(f"[*] [Persist][Job:{state['job_id']}] Creating/Updating NEXT STAGE job: {next_stage}")
-                        cur.execute(
-                            """
-                            INSERT INTO cleaning_jobs (token_id, stage, status, next_run_at, created_at, updated_at)
-                            VALUES (%s, %s, 0, NOW(), NOW(), NOW())
-                            ON CONFLICT (token_id, stage) DO UPDATE 
-                            SET status = 0, updated_at = NOW()
-                            WHERE cleaning_jobs.status != 2
-                            """,
-                            (state["token_id"], next_stage),
-                        )
+    def _timer_loop(self):
+        while True:
+            time.sleep(self.max_wait / 2)
+            with self._lock:
+                due = self._oldest is not None and time.time() - self._oldest >= self.max_wait
+            if due:
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"[!] [Persist] 定时 flush 失败: {e}")
 
-            conn.commit()
-    finally:
-        conn.close()
+    def add(self, state: AgentState):
+        with self._lock:
+            self._start_timer()
+            self._items.append(state)
+            if self._oldest is None:
+                self._oldest = time.time()
+            full = len(self._items) >= self.max_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                items, self._items, self._oldest = self._items, [], None
+            try:
+                persist_results(items)
+            except Exception as e:
+                # 整批都没有提交 (连接断开等): 不能丢掉, 逐个转入重试
+                print(f"[!] [Persist] 批量提交失败, {len(items)} jobs 转入重试: {e}")
+                _fail_jobs([(state, f"persist error: {e}") for state in items])
+
+    def __len__(self):
+        return len(self._items)
+
+
+persist_buffer = PersistBuffer(config.PERSIST_BATCH_SIZE, config.PERSIST_MAX_WAIT)
+
+
+@observe_node("persist")
+def persist_node(state: AgentState):
+    """graph 的 persist 节点: 开启 group commit 时先入缓冲区, 否则立即写入
+
+    CHAIN_STAGES 开启且下一阶段在 CHAIN_TARGET_STAGES 中时同步写入 (需要拿到新任务 id), 返回 {"next_job": ...} 供 worker 继续执行.
+    """
+    if config.CHAIN_STAGES and _next_stage(state) in CHAIN_TARGET_STAGES:
+        chained = persist_result(state, chain=True)
+        if chained:
+            print(f"[*] [Persist][Job:{state['job_id']}] Chaining into Job:{chained[0]['id']} Stage:{chained[0]['stage']}")
+            return {"next_job": dict(chained[0])}
+        return None
+    if config.PERSIST_BATCH_SIZE > 1:
+        persist_buffer.add(state)
+    else:
+        persist_result(state)
@@ -0,0 +1,167 @@
+import json
+import hashlib
+import psycopg2
+from app.core.db import get_db_connection, table_exists
+from app.core.config import config
+from app.core.metrics import DEEP_DIVE_REPORTS
+
+# 研报 prompt 有实质修改时递增, 旧指纹全部失效
+FINGERPRINT_VERSION = "v1"
+
+_table_ready = None
+
+
+def gating_ready() -> bool:
+    """REPORT_GATING 开启且 report_fingerprints 表存在; 表缺失时停用复用, 照常生成研报 (每个进程只查一次)"""
+    global _table_ready
+    if not config.REPORT_GATING:
+        return False
+    if _table_ready is None:
+        try:
+            _table_ready = table_exists("report_fingerprints")
+        except psycopg2.Error as e:
+            print(f"[!] [L3] 检查 report_fingerprints 表失败: {e}")
+            return False
+        if not _table_ready:
+            print("[!] [L3] report_fingerprints 表不存在, 研报复用已停用 (设置 REPORT_ENSURE_SCHEMA=true 或执行 migrations/003_report_fingerprints.sql)")
+    return _table_ready
+
+
+def ensure_fingerprint_table():
+    """每个 token 一行: 最近一次生成研报时的输入快照, 以及重新生成的原因"""
+    global _table_ready
+    _table_ready = None
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS report_fingerprints (
+                    token_id INTEGER PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    inputs JSONB NOT NULL,
+                    report_id INTEGER,
+                    reason TEXT,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                )
+            """)
+            conn.commit()
+    except psycopg2.Error as e:
+        print(f"[!] [L3] 创建研报指纹表失败: {e}")
+    finally:
+        conn.close()
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def report_inputs(state: dict) -> dict:
+    """研报 context 中用到的字段 (与 deep_dive_node 组装的内容一致)"""
+    token_info = state.get("data") or {}
+    alpha_info = state.get("alpha_data") or {}
+    return {
+        "symbol": state.get("symbol"),
+        "description": token_info.get("description"),
+        "honeypot": bool(token_info.get("honeypot")),
+        "liquidity": _number(token_info.get("liquidity")),
+        "market_cap": _number(token_info.get("market_cap")),
+        "buy_tax": _number(token_info.get("buy_tax")),
+        "sell_tax": _number(token_info.get("sell_tax")),
+        "smart_money_count": _number(alpha_info.get("smart_money_count")),
+        "avg_top_pnl": _number(alpha_info.get("avg_top_pnl")),
+        "is_alpha": bool(alpha_info.get("is_alpha")),
+    }
+
+
+def fingerprint(context: str) -> str:
+    raw = json.dumps([FINGERPRINT_VERSION, config.LLM_MODEL, context], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def relative_change(old, new) -> float:
+    """相对变化 |new - old| / max(|old|, |new|), 取值 0..2; 一侧缺失视为完全变化"""
+    if old is None and new is None:
+        return 0.0
+    if old is None or new is None:
+        return 1.0
+    scale = max(abs(old), abs(new))
+    return abs(new - old) / scale if scale else 0.0
+
+
+def material_changes(old: dict, new: dict) -> list:
+    """返回超过阈值的变化描述; 配置了阈值的数值字段按相对变化比较, 其余字段要求完全一致"""
+    changes = []
+    for field, value in new.items():
+        before = old.get(field)
+        threshold = config.REPORT_CHANGE_THRESHOLDS.get(field)
+        if threshold is None:
+            if before != value:
+                changes.append(f"{field} changed")
+            continue
+        change = relative_change(before, value)
+        if change >= threshold:
+            changes.append(f"{field} {before} -> {value} ({change:.0%} >= {threshold:.0%})")
+    return changes
+
+
+def _load_previous(token_id: int):
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT f.fingerprint, f.inputs, f.report_id, r.report_text,
+                       EXTRACT(EPOCH FROM NOW() - f.created_at)::float8 AS age
+                FROM report_fingerprints f
+                LEFT JOIN analysis_reports r ON r.id = f.report_id
+                WHERE f.token_id = %s
+                """,
+                (token_id,),
+            )
+            return cur.fetchone()
+    finally:
+        conn.close()
+
+
+def check_report_freshness(state: dict, context: str):
+    """判断能否复用上一份研报, 返回 (reuse, record)
+
+    reuse: {"report_id", "report"} 或 None (需要重新生成)
+    record: 新的指纹记录 {"fingerprint", "inputs", "reason"}, 重新生成的研报落库时一并写入 (功能停用时为 None).
+    复用时不更新指纹, 始终与生成上一份研报时的输入比较, 避免小幅变化累积后仍一直复用.
+    """
+    if not gating_ready():
+        return None, None
+    inputs = report_inputs(state)
+    record = {"fingerprint": fingerprint(context), "inputs": inputs, "reason": None}
+
+    def regenerate(kind: str, reason: str):
+        record["reason"] = reason
+        DEEP_DIVE_REPORTS.inc(decision="regenerated", reason=kind)
+        print(f"[*] [L3][Job:{state.get('job_id')}] 重新生成研报: {reason}")
+        return None, record
+
+    if state.get("bypass_cache"):
+        return regenerate("bypass", "bypass_cache requested")
+    try:
+        previous = _load_previous(state["token_id"])
+    except psycopg2.Error as e:
+        return regenerate("error", f"fingerprint lookup failed: {e}")
+
+    if previous is None:
+        return regenerate("first", "no previous report")
+    if not previous["report_text"]:
+        return regenerate("missing", f"previous report {previous['report_id']} not found")
+    if previous["age"] >= config.REPORT_MAX_AGE:
+        return regenerate("stale", f"previous report is {previous['age']:.0f}s old (max {config.REPORT_MAX_AGE:.0f}s)")
+    if previous["fingerprint"] != record["fingerprint"]:
+        changes = material_changes(previous["inputs"] or {}, inputs)
+        if changes:
+            return regenerate("changed", "; ".join(changes))
+
+    DEEP_DIVE_REPORTS.inc(decision="reused", reason="unchanged")
+    print(f"[*] [L3][Job:{state.get('job_id')}] 输入无实质变化, 复用研报 {previous['report_id']}")
+    return {"report_id": previous["report_id"], "report": previous["report_text"]}, record
@@ -1,29 +1,203 @@
+import time
+import threading
 from app.core.db import get_db_connection
 from app.core.config import config
+from app.core.metrics import DB_QUERY_LATENCY
+from app.services.leases import lease_keeper, worker_id
 
-def pull_jobs():
-    """使用 SKIP LOCKED 实现高并发安全的任务拉取"""
+# 同一 stage 内的排序分数 (越大越先认领), 等待时间折算成加分防止饿死
+_PRIORITY_SQL = {
+    "liquidity": "LN(1 + GREATEST(COALESCE(t.liquidity, 0), 0))",
+    "vibe_score": "COALESCE(tt.vibe_score, 50) / 10.0",
+}
+_PRIORITY_JOINS = {
+    "liquidity": "LEFT JOIN tokens t ON t.id = cj.token_id",
+    "vibe_score": """LEFT JOIN LATERAL (
+                            SELECT vibe_score FROM token_tags
+                            WHERE token_tags.token_id = cj.token_id
+                            ORDER BY token_tags.id DESC LIMIT 1
+                        ) tt ON TRUE""",
+}
+
+
+_carry = {}
+
+
+def plan_quotas(limit: int, weights: dict, budgets: dict = None, carry: dict = None) -> dict:
+    """按权重把 limit 分给各 stage (最大余数法), 不超过各 stage 的剩余并发预算; 被预算截掉的名额让给其他 stage
+
+    carry 在多次调用间累计各 stage 分到的小数部分, 批很小 (甚至为 1) 时也能按权重轮流认领;
+    只有还能拿名额的 stage 才累计, 且限制在 [-1, 1], 预算解除后不会一次性补偿积欠.
+    """
+    carry = {} if carry is None else carry
+    quotas = {stage: 0 for stage in weights}
+    caps = {stage: max(0, (budgets or {}).get(stage, limit)) for stage in weights}
+    remaining = limit
+    while remaining > 0:
+        open_stages = {stage: w for stage, w in weights.items() if w > 0 and quotas[stage] < caps[stage]}
+        total = sum(open_stages.values())
+        if not total:
+            break
+        shares = {stage: remaining * w / total for stage, w in open_stages.items()}
+        given = 0
+        for stage, share in shares.items():
+            add = min(int(share), caps[stage] - quotas[stage])
+            quotas[stage] += add
+            given += add
+        # 余数按 (小数部分 + 历史累计) 从大到小逐个分配
+        for stage in sorted(shares, key=lambda st: shares[st] - int(shares[st]) + carry.get(st, 0.0), reverse=True):
+            if quotas[stage] >= caps[stage]:
+                continue
+            frac = shares[stage] - int(shares[stage])
+            if given < remaining:
+                quotas[stage] += 1
+                given += 1
+                frac -= 1
+            carry[stage] = min(1.0, max(-1.0, carry.get(stage, 0.0) + frac))
+        if not given:
+            break
+        remaining -= given
+    return {stage: n for stage, n in quotas.items() if n > 0}
+
+
+def _claim(cur, quotas: dict):
+    """一条语句按 stage 分别认领 (每个 stage 各自 LIMIT + SKIP LOCKED)"""
+    priority = config.SCHEDULER_PRIORITY
+    if priority in _PRIORITY_SQL:
+        order = (
+            f"{_PRIORITY_SQL[priority]} + EXTRACT(EPOCH FROM NOW() - cj.next_run_at) / {config.SCHEDULER_AGING_SECONDS} DESC, "
+            "cj.next_run_at ASC, cj.id ASC"
+        )
+        joins = _PRIORITY_JOINS[priority]
+    else:
+        order, joins = "cj.next_run_at ASC, cj.id ASC", ""
+
+    stages = list(quotas)
+    cur.execute(f"""
+        WITH cte AS (
+            SELECT picked.id
+            FROM unnest(%s::int[], %s::int[]) AS q(stage, quota)
+            CROSS JOIN LATERAL (
+                SELECT cj.id FROM cleaning_jobs cj
+                {joins}
+                WHERE cj.status = 0 AND cj.next_run_at <= NOW() AND cj.stage = q.stage
+                ORDER BY {order}
+                LIMIT q.quota
+                FOR UPDATE OF cj SKIP LOCKED
+            ) picked
+        ), claimed AS (
+            UPDATE cleaning_jobs
+            SET status = 1, updated_at = NOW(),
+                lease_expires_at = NOW() + %s * INTERVAL '1 second', leased_by = %s
+            WHERE id IN (SELECT id FROM cte)
+            RETURNING *
+        )
+        SELECT * FROM claimed
+        ORDER BY stage DESC, next_run_at ASC, id ASC;
+    """, (stages, [quotas[stage] for stage in stages], config.JOB_LEASE_SECONDS, worker_id()))
+    return cur.fetchall()
+
+
+def _fetch_tokens(cur, token_ids) -> dict:
+    """{token_id: row}, 原样 SELECT * (NUMERIC 仍为 Decimal, 时间仍为 datetime; 可选列缺失也不影响)"""
+    ids = list({tid for tid in token_ids if tid is not None})
+    if not ids:
+        return {}
+    cur.execute("SELECT * FROM tokens WHERE id = ANY(%s)", (ids,))
+    return {row["id"]: row for row in cur.fetchall()}
+
+
+def _claim_fifo(cur, limit: int):
+    cur.execute("""
+        WITH cte AS (
+            SELECT id FROM cleaning_jobs
+            WHERE status = 0 AND next_run_at <= NOW()
+            ORDER BY stage ASC, next_run_at ASC, id ASC
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ), claimed AS (
+            UPDATE cleaning_jobs
+            SET status = 1, updated_at = NOW(),
+                lease_expires_at = NOW() + %s * INTERVAL '1 second', leased_by = %s
+            WHERE id IN (SELECT id FROM cte)
+            RETURNING *
+        )
+        SELECT * FROM claimed
+        ORDER BY stage ASC, next_run_at ASC, id ASC;
+    """, (limit, config.JOB_LEASE_SECONDS, worker_id()))
+    return cur.fetchall()
+
+
+def pull_jobs(limit=None, budgets=None):
+    """使用 SKIP LOCKED 实现高并发安全的任务拉取
+
+    认领后在同一事务里一次批量查出 token 数据, 放在 job["token"] 中 (token 不存在时为 None);
+    认领同时写入租约, 由 lease_keeper 续约直到结果落库.
+
+    weighted 模式下按 STAGE_WEIGHTS 给每个 stage 分配名额, budgets ({stage: 剩余并发}) 限制单个 stage 的认领数;
+    某些 stage 积压不足时, 空出的名额在第二轮分给除取不满的 stage 以外、还有预算的所有 stage (work-conserving),
+    包括第一轮因 limit 太小没分到名额的 stage.
+    """
+    limit = limit or config.BATCH_SIZE
     conn = get_db_connection()
     try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                WITH cte AS (
-                    SELECT id FROM cleaning_jobs
-                    WHERE status = 0 AND next_run_at <= NOW()
-                    ORDER BY stage ASC, next_run_at ASC, id ASC
-                    LIMIT %s
-                    FOR UPDATE SKIP LOCKED
-                )
-                UPDATE cleaning_jobs
-                SET status = 1, updated_at = NOW()
-                WHERE id IN (SELECT id FROM cte)
-                RETURNING *;
-            """, (config.BATCH_SIZE,))
-            jobs = cur.fetchall()
+        with DB_QUERY_LATENCY.time(query="claim"), conn.cursor() as cur:
+            if config.SCHEDULER_MODE == "fifo":
+                jobs = _claim_fifo(cur, limit)
+            else:
+                quotas = plan_quotas(limit, config.STAGE_WEIGHTS, budgets, _carry)
+                jobs = _claim(cur, quotas) if quotas else []
+                if len(jobs) < limit:
+                    got = {stage: 0 for stage in config.STAGE_WEIGHTS}
+                    for job in jobs:
+                        got[job["stage"]] = got.get(job["stage"], 0) + 1
+                    # 取不满的 stage 说明已经空了; 其余 stage (取满的 / 没分到名额的) 都可能还有积压
+                    short = {stage for stage, n in quotas.items() if got[stage] < n}
+                    left = {stage: (budgets or {}).get(stage, limit) - got[stage] for stage in config.STAGE_WEIGHTS}
+                    rest = {
+                        stage: w for stage, w in config.STAGE_WEIGHTS.items()
+                        if w > 0 and stage not in short and left[stage] > 0
+                    }
+                    extra = plan_quotas(limit - len(jobs), rest, left) if rest else {}
+                    if extra:
+                        jobs += _claim(cur, extra)
+            tokens = _fetch_tokens(cur, [job["token_id"] for job in jobs])
+            for job in jobs:
+                job["token"] = tokens.get(job["token_id"])
             conn.commit()
-            return jobs
     finally:
         conn.close()
+    lease_keeper.track([job["id"] for job in jobs])
+    return jobs
+
+_backlog = (0.0, [])
+_backlog_lock = threading.Lock()
+
+
+def job_backlog():
+    """按 stage / status 统计待处理 / 处理中的积压, 供 metrics 抓取
+
+    已完成 / 失败的行只增不删, 不参与统计; 结果缓存 METRICS_BACKLOG_TTL 秒, 避免每次抓取都扫表.
+    """
+    global _backlog
+    with _backlog_lock:
+        fetched_at, rows = _backlog
+        if time.monotonic() - fetched_at < config.METRICS_BACKLOG_TTL:
+            return rows
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT stage, status, COUNT(*) AS jobs FROM cleaning_jobs
+                    WHERE status IN (0, 1)
+                    GROUP BY stage, status
+                """)
+                rows = cur.fetchall()
+                conn.commit()
+        finally:
+            conn.close()
+        _backlog = (time.monotonic(), rows)
+        return rows
 
 def get_token_details(token_id):
     conn = get_db_connection()
@@ -33,3 +207,12 @@ def get_token_details(token_id):
             return cur.fetchone()
     finally:
         conn.close()
+
+def get_token_details_many(token_ids):
+    """批量获取 token 数据, 返回 {token_id: row}"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            return _fetch_tokens(cur, token_ids)
+    finally:
+        conn.close()
@@ -0,0 +1,176 @@
+import os
+import time
+import signal
+import threading
+import multiprocessing
+from multiprocessing.connection import wait as wait_sentinels
+from app.core.config import config
+
+# 收到 SIGTERM 后置位: worker 停止认领新任务, 处理完在途任务后退出
+shutdown_event = threading.Event()
+
+_budget = None
+_slot = None
+
+
+class InflightBudget:
+    """跨进程共享的在途任务预算 (multiprocessing.Semaphore)
+
+    每个子进程在 held[slot] 中登记自己持有的名额, 子进程崩溃时由 supervisor 代为归还.
+    """
+
+    def __init__(self, sem, held, slot: int):
+        self.sem = sem
+        self.held = held
+        self.slot = slot
+
+    def take(self, n: int, timeout: float = 1.0) -> int:
+        """最多取 n 个名额, 至少等待一个 (超时返回 0)"""
+        if n <= 0 or not self.sem.acquire(timeout=timeout):
+            return 0
+        taken = 1
+        while taken < n and self.sem.acquire(block=False):
+            taken += 1
+        with self.held.get_lock():
+            self.held[self.slot] += taken
+        return taken
+
+    def give(self, n: int):
+        if n <= 0:
+            return
+        with self.held.get_lock():
+            self.held[self.slot] -= n
+        for _ in range(n):
+            self.sem.release()
+
+
+def current_budget():
+    """当前进程的在途预算, 单进程模式下为 None (只受 MAX_INFLIGHT 约束)"""
+    return _budget
+
+
+def worker_slot():
+    """prefork 子进程的编号 (0..N-1), 单进程模式下为 None"""
+    return _slot
+
+
+def install_shutdown_handlers():
+    def _stop(signum, frame):
+        if not shutdown_event.is_set():
+            print(f"[*] [Worker:{os.getpid()}] 收到信号 {signum}, 停止认领并等待在途任务完成")
+        shutdown_event.set()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+
+def _child_main(target, sem, held, slot):
+    global _budget, _slot
+    _slot = slot
+    # Ctrl-C 会发给整个进程组, 子进程只响应 supervisor 转发的 SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: shutdown_event.set())
+    if sem is not None:
+        _budget = InflightBudget(sem, held, slot)
+    target()
+
+
+class Supervisor:
+    """Prefork supervisor: fork N 个 worker 子进程, 崩溃自动重启, SIGTERM 时等待子进程排空后退出
+
+    子进程各自懒加载 DB 连接池 / LLM 客户端 (均按 pid 重建), 父进程不持有任何连接.
+    """
+
+    def __init__(self, target, processes: int, inflight_total: int = 0,
+                 shutdown_timeout: float = 60.0, restart_backoff_max: float = 30.0):
+        self.target = target
+        self.processes = max(1, processes)
+        self.shutdown_timeout = shutdown_timeout
+        self.restart_backoff_max = restart_backoff_max
+        self._ctx = multiprocessing.get_context("fork")
+        self.inflight_total = inflight_total
+        self._sem = self._ctx.Semaphore(inflight_total) if inflight_total > 0 else None
+        self._held = self._ctx.Array("i", self.processes)
+        self._children = {}  # slot -> (process, started_at)
+        self._crashes = [0] * self.processes
+        self._stopping = False
+
+    def _spawn(self, slot: int):
+        proc = self._ctx.Process(
+            target=_child_main,
+            args=(self.target, self._sem, self._held, slot),
+            name=f"zivv-worker-{slot}",
+            daemon=False,
+        )
+        proc.start()
+        self._children[slot] = (proc, time.monotonic())
+        print(f"[*] [Supervisor] worker {slot} started pid={proc.pid}")
+
+    def _reclaim_budget(self, slot: int):
+        """子进程异常退出时归还它持有的名额"""
+        if self._sem is None:
+            return
+        with self._held.get_lock():
+            held, self._held[slot] = self._held[slot], 0
+        for _ in range(max(0, held)):
+            self._sem.release()
+        if held:
+            print(f"[*] [Supervisor] worker {slot} 退出时持有 {held} 个在途名额, 已归还")
+
+    def _on_signal(self, signum, frame):
+        if not self._stopping:
+            print(f"[*] [Supervisor] 收到信号 {signum}, 通知 {len(self._children)} 个 worker 排空退出")
+        self._stopping = True
+        for proc, _ in self._children.values():
+            if proc.is_alive():
+                os.kill(proc.pid, signal.SIGTERM)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+        print(f"[*] [Supervisor] pid={os.getpid()} processes={self.processes} "
+              f"inflight_total={self.inflight_total or 'unlimited'}")
+        for slot in range(self.processes):
+            self._spawn(slot)
+
+        restart_at = {}
+        while not self._stopping:
+            sentinels = {proc.sentinel: slot for slot, (proc, _) in self._children.items()}
+            for sentinel in wait_sentinels(list(sentinels), timeout=1.0):
+                slot = sentinels[sentinel]
+                proc, started_at = self._children.pop(slot)
+                proc.join()
+                self._reclaim_budget(slot)
+                if self._stopping:
+                    print(f"[*] [Supervisor] worker {slot} pid={proc.pid} stopped code={proc.exitcode}")
+                    continue
+                # 运行超过一分钟视为健康, 重置退避
+                self._crashes[slot] = 0 if time.monotonic() - started_at > 60 else self._crashes[slot] + 1
+                delay = min(self.restart_backoff_max, 2 ** self._crashes[slot] - 1)
+                print(f"[!] [Supervisor] worker {slot} pid={proc.pid} exited code={proc.exitcode}, restart in {delay}s")
+                restart_at[slot] = time.monotonic() + delay
+            for slot, when in list(restart_at.items()):
+                if not self._stopping and time.monotonic() >= when:
+                    del restart_at[slot]
+                    self._spawn(slot)
+
+        self._shutdown()
+
+    def _shutdown(self):
+        deadline = time.monotonic() + self.shutdown_timeout
+        for slot, (proc, _) in self._children.items():
+            proc.join(max(0.0, deadline - time.monotonic()))
+            if proc.is_alive():
+                print(f"[!] [Supervisor] worker {slot} pid={proc.pid} 未在 {self.shutdown_timeout}s 内退出, 强制终止")
+                proc.kill()
+                proc.join()
+        print("[*] [Supervisor] all workers stopped")
+
+
+def run_supervisor(target):
+    Supervisor(
+        target,
+        processes=config.WORKER_PROCESSES,
+        inflight_total=config.MAX_INFLIGHT_TOTAL,
+        shutdown_timeout=config.SHUTDOWN_TIMEOUT,
+    ).run()
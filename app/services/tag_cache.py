@@ -0,0 +1,102 @@
+import re
+import json
+import hashlib
+from typing import Optional
+import psycopg2
+from app.core.cache import TTLCache, PgCacheTier
+from app.core.db import get_db_connection, missing_columns
+from app.core.config import config
+
+# 决定 L2 标签的字段; 流动性 / 创建时间不影响叙事判断, 不参与缓存键
+KEY_FIELDS = ("name", "symbol", "description", "chain")
+KEY_VERSION = "v1"
+
+_bypass_column = None
+
+
+def _normalize(value) -> str:
+    text = str(value or "").casefold()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def cache_key(input_data: dict) -> str:
+    """对 input_data 归一化后取哈希, 同名同简介的复制盘共享同一个键"""
+    payload = {field: _normalize(input_data.get(field)) for field in KEY_FIELDS}
+    raw = json.dumps([KEY_VERSION, config.SLM_MODEL, payload], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TagCache:
+    """L2 打标结果缓存: 进程内 LRU+TTL, 可选 Postgres 共享层"""
+
+    def __init__(self):
+        self.enabled = config.TAG_CACHE_ENABLED
+        self.ttl = config.TAG_CACHE_TTL
+        self.local = TTLCache(config.TAG_CACHE_SIZE, self.ttl)
+        self.shared = PgCacheTier(config.TAG_CACHE_TABLE) if config.TAG_CACHE_PG else None
+
+    def get(self, input_data: dict) -> Optional[dict]:
+        if not self.enabled:
+            return None
+        key = cache_key(input_data)
+        entry = self.local.get_entry(key)
+        if entry is not None:
+            return entry[0]
+        if self.shared is not None:
+            entry = self.shared.get_entry(key)
+            if entry is not None:
+                value, age = entry
+                self.local.set(key, value, age=age)
+                return value
+        return None
+
+    def set(self, input_data: dict, result: dict):
+        if not self.enabled:
+            return
+        key = cache_key(input_data)
+        self.local.set(key, result)
+        if self.shared is not None:
+            self.shared.set(key, result, self.ttl)
+
+    def stats(self) -> dict:
+        stats = {"local": self.local.stats()}
+        if self.shared is not None:
+            stats["shared"] = self.shared.stats()
+        return stats
+
+
+def bypass_column_ready() -> bool:
+    """cleaning_jobs.bypass_cache 列是否存在 (每个进程只查一次); 旧库没有该列时不传递 bypass"""
+    global _bypass_column
+    if _bypass_column is None:
+        try:
+            _bypass_column = not missing_columns("cleaning_jobs", ["bypass_cache"])
+        except psycopg2.Error as e:
+            print(f"[!] [TagCache] 检查 cleaning_jobs.bypass_cache 列失败: {e}")
+            return False
+    return _bypass_column
+
+
+def ensure_bypass_column():
+    """补上 cleaning_jobs.bypass_cache (跳过 L2 标签缓存 / L3 研报复用), 正式环境执行 migrations/002_bypass_cache.sql
+
+    列已存在时不做 ALTER TABLE (ACCESS EXCLUSIVE 锁会阻塞认领).
+    """
+    global _bypass_column
+    _bypass_column = None
+    try:
+        if not missing_columns("cleaning_jobs", ["bypass_cache"]):
+            return
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("ALTER TABLE cleaning_jobs ADD COLUMN IF NOT EXISTS bypass_cache BOOLEAN NOT NULL DEFAULT FALSE")
+                conn.commit()
+        finally:
+            conn.close()
+        print("[*] [TagCache] cleaning_jobs 已补充 bypass_cache 列")
+    except psycopg2.Error as e:
+        print(f"[!] [TagCache] 补充 bypass_cache 列失败: {e}")
+
+
+tag_cache = TagCache()
@@ -0,0 +1,245 @@
+"""本地上游替身: OpenAI 兼容的 LLM、Helius JSON-RPC、Birdeye 钱包 PnL
+
+单个 HTTP/1.1 (keep-alive) 服务按路径分发:
+    /v1/chat/completions        LLM (支持 stream + stream_options.include_usage)
+    /helius                     getTokenAccounts / getTokenSupply
+    /birdeye/v1/wallet/pnl      钱包 PnL
+
+延迟按对数正态分布采样 (中位数 + sigma), 错误按比例返回 500 或 429 + Retry-After.
+"""
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Profile:
+    """单个上游的延迟 / 错误分布"""
+
+    def __init__(self, median: float = 0.2, sigma: float = 0.5, error_rate: float = 0.0, throttle_rate: float = 0.0):
+        self.median = median
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+
+    def latency(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return random.lognormvariate(math.log(self.median), self.sigma)
+
+    def failure(self):
+        """返回 (status, headers) 或 None"""
+        roll = random.random()
+        if roll < self.throttle_rate:
+            return 429, {"Retry-After": "1"}
+        if roll < self.throttle_rate + self.error_rate:
+            return 500, {}
+        return None
+
+
+class FakeUpstreams:
+    def __init__(self, llm=None, stream_chunk_delay=0.02, helius=None, birdeye=None, holders=300, report_chars=1200):
+        self.profiles = {
+            "llm": llm or Profile(0.4, 0.6),
+            "helius": helius or Profile(0.08, 0.4),
+            "birdeye": birdeye or Profile(0.12, 0.5),
+        }
+        self.stream_chunk_delay = stream_chunk_delay
+        self.holders = holders
+        self.report_chars = report_chars
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.requests = {name: 0 for name in self.profiles}
+        self.errors = {name: 0 for name in self.profiles}
+        self.server = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, field: str, name: str = None):
+        with self._lock:
+            if name is None:
+                self.connections += 1
+            else:
+                getattr(self, field)[name] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"connections": self.connections, "requests": dict(self.requests), "errors": dict(self.errors)}
+
+    def start(self, host: str = "127.0.0.1", port: int = 0):
+        upstreams = self
+
+        class Handler(_Handler):
+            owner = upstreams
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="fake-upstreams", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _slm_item(seed: str) -> dict:
+    rng = random.Random(seed)
+    return {
+        "tags": rng.sample(["AI", "Dog", "Cat", "Frog", "Politics", "Degen", "Community/Imitation"], 2),
+        "vibe_score": rng.randint(0, 100),
+        "risk_level": rng.choice(["Low", "Medium", "High"]),
+        "short_comment": "bench stand-in result",
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, 才能看出客户端连接池是否复用
+    owner: FakeUpstreams = None
+
+    def setup(self):
+        super().setup()
+        self.owner.count("connections")
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status: int, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _simulate(self, name: str) -> bool:
+        """按分布睡眠, 需要失败时直接写出错误响应并返回 False"""
+        profile = self.owner.profiles[name]
+        self.owner.count("requests", name)
+        time.sleep(profile.latency())
+        failure = profile.failure()
+        if failure is None:
+            return True
+        self.owner.count("errors", name)
+        status, headers = failure
+        self._json(status, {"error": {"message": "injected failure", "code": status}}, headers)
+        return False
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        payload = self._read_json()
+        if path.endswith("/chat/completions"):
+            if self._simulate("llm"):
+                self._chat(payload)
+        elif path.startswith("/helius"):
+            if self._simulate("helius"):
+                self._helius(payload)
+        else:
+            self._json(404, {"error": "not found"})
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        if path == "/birdeye/v1/wallet/pnl":
+            if self._simulate("birdeye"):
+                rng = random.Random(query)
+                self._json(200, {"success": True, "data": {
+                    "realized_pnl_percentage": rng.uniform(-80, 400),
+                    "realized_pnl_usd": rng.uniform(-5000, 50000),
+                }})
+        else:
+            self._json(404, {"error": "not found"})
+
+    def _chat_content(self, payload) -> str:
+        messages = payload.get("messages") or []
+        system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+        prompt = messages[-1].get("content", "") if messages else ""
+        if "Classifier" not in system:
+            # 深度研报: 生成固定长度的 markdown 文本
+            line = "- Narrative strength, holder structure and liquidity look consistent with the bench profile.\n"
+            return ("## Bench Report\n" + line * (self.owner.report_chars // len(line) + 1))[: self.owner.report_chars]
+        batch = re.search(r"following \d+ tokens independently:\n(.*)\n", prompt)
+        if batch:
+            items = json.loads(batch.group(1))
+            return json.dumps([{"job_id": item["job_id"], **_slm_item(item["job_id"] + item.get("symbol", ""))} for item in items])
+        return json.dumps(_slm_item(prompt))
+
+    def _chat(self, payload):
+        model = payload.get("model", "bench")
+        content = self._chat_content(payload)
+        usage = {
+            "prompt_tokens": _tokens(json.dumps(payload.get("messages"))),
+            "completion_tokens": _tokens(content),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        base = {"id": f"chatcmpl-bench-{random.getrandbits(32):x}", "created": int(time.time()), "model": model}
+
+        if not payload.get("stream"):
+            self._json(200, {
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(data: str):
+            raw = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(raw):x}\r\n".encode() + raw + b"\r\n")
+            self.wfile.flush()
+
+        step = 40
+        for i in range(0, len(content), step):
+            chunk = {**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {"content": content[i:i + step]}, "finish_reason": None}]}
+            send(json.dumps(chunk))
+            time.sleep(self.owner.stream_chunk_delay)
+        send(json.dumps({**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            send(json.dumps({**base, "object": "chat.completion.chunk", "choices": [], "usage": usage}))
+        send("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _helius(self, payload):
+        method = payload.get("method")
+        params = payload.get("params")
+        if method == "getTokenSupply":
+            mint = params[0]
+            total = sum(_holder_amount(mint, i) for i in range(self.owner.holders))
+            self._json(200, {"jsonrpc": "2.0", "id": payload.get("id"), "result": {"value": {"amount": str(int(total))}}})
+        elif method == "getTokenAccounts":
+            mint, page, limit = params["mint"], params.get("page", 1), params.get("limit", 100)
+            start = (page - 1) * limit
+            accounts = [
+                {"owner": f"wallet-{mint}-{i}", "amount": _holder_amount(mint, i)}
+                for i in range(start, min(start + limit, self.owner.holders))
+            ]
+            self._json(200, {"jsonrpc": "2.0", "id": payload.get("id"), "result": {"token_accounts": accounts}})
+        else:
+            self._json(200, {"jsonrpc": "2.0", "id": payload.get("id"), "error": {"code": -32601, "message": "method not found"}})
+
+
+def _holder_amount(mint: str, index: int) -> int:
+    # 长尾分布: 排名靠前的账户持有大部分供应量
+    return int(1e12 / (index + 1) ** 1.3 * random.Random(f"{mint}:{index}").uniform(0.8, 1.2))
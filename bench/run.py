@@ -0,0 +1,304 @@
+"""离线基准测试: 本地 Postgres + 上游替身, 测量 worker 吞吐与各阶段延迟
+
+用法 (数据库必须是一次性的, 运行前会清空 bench/schema.sql 中的表):
+
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/zivv_bench python -m bench.run --tokens 500
+    python -m bench.run --database-url ... --scenario worker --mode async --llm-latency 0.8 --llm-error-rate 0.02
+
+场景:
+    worker   在后台线程运行 run_worker, 直到任务队列清空
+    graph    逐个 graph.invoke (含 persist)
+    persist  逐条 persist_result
+    alpha    AlphaDetective.analyze_token
+
+其余配置 (SLM_BATCH_SIZE / PERSIST_BATCH_SIZE / MAX_INFLIGHT / ALPHA_ENABLED ...) 直接用环境变量调节.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+from bench.fake_upstreams import FakeUpstreams, Profile
+
+SCHEMA = Path(__file__).with_name("schema.sql")
+TABLES = ("cleaning_jobs", "job_checkpoints", "report_fingerprints", "token_tags", "analysis_reports", "token_alpha", '"Project"', "tokens")
+SCENARIOS = ("worker", "graph", "persist", "alpha")
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def fmt_ms(value):
+    return "-" if value is None else f"{value * 1000:.1f}ms"
+
+
+def latency_row(name, samples):
+    return (
+        f"  {name:<20} n={len(samples):<6} p50={fmt_ms(percentile(samples, 0.5)):>9} "
+        f"p95={fmt_ms(percentile(samples, 0.95)):>9} p99={fmt_ms(percentile(samples, 0.99)):>9}"
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Zivv worker offline benchmark")
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"),
+                        help="一次性 Postgres (默认读 BENCH_DATABASE_URL, 不会使用 DATABASE_URL)")
+    parser.add_argument("--scenario", choices=SCENARIOS + ("all",), default="all")
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--mode", choices=("sync", "async"), default=os.getenv("WORKER_MODE", "sync"))
+    parser.add_argument("--timeout", type=float, default=600, help="worker 场景的最长运行时间 (秒)")
+    parser.add_argument("--filtered-ratio", type=float, default=0.3, help="会被 L1 规则过滤的 token 比例")
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="LLM 延迟中位数 (秒)")
+    parser.add_argument("--llm-sigma", type=float, default=0.6)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-throttle-rate", type=float, default=0.0, help="返回 429 + Retry-After 的比例")
+    parser.add_argument("--helius-latency", type=float, default=0.08)
+    parser.add_argument("--birdeye-latency", type=float, default=0.12)
+    parser.add_argument("--upstream-error-rate", type=float, default=0.0, help="Helius / Birdeye 错误比例")
+    parser.add_argument("--holders", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args(argv)
+
+
+def configure_env(args, upstreams):
+    """app 在 import 时读取配置, 因此必须在导入 app 之前设置"""
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ["LLM_BASE_URL"] = f"{upstreams.base_url}/v1"
+    os.environ["LLM_API_KEY"] = "bench"
+    os.environ["HELIUS_API_KEY"] = "bench"
+    os.environ["BIRDEYE_API_KEY"] = "bench"
+    os.environ["HELIUS_RPC_URL"] = f"{upstreams.base_url}/helius"
+    os.environ["BIRDEYE_BASE_URL"] = f"{upstreams.base_url}/birdeye"
+    os.environ["WORKER_MODE"] = args.mode
+    # 避免 .env 中的生产配置混入
+    for key in ("SLM_ENDPOINTS", "LLM_ENDPOINTS", "SLM_HEDGE_BASE_URL", "HTTP_PROXY", "HTTPS_PROXY"):
+        os.environ.pop(key, None)
+    os.environ.setdefault("TAG_CACHE_ENABLED", "false")
+    os.environ.setdefault("REPORT_GATING", "false")
+    os.environ.setdefault("POLL_INTERVAL_MAX", "0.5")
+
+
+def reset_database(rng, args):
+    from app.core.db import get_db_connection
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(SCHEMA.read_text(encoding="utf-8"))
+            cur.execute(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY CASCADE")
+            rows = []
+            for i in range(args.tokens):
+                filtered = rng.random() < args.filtered_ratio
+                rows.append((
+                    f"Bench{i:06d}",
+                    f"B{i}",
+                    f"Bench Token {i}",
+                    "solana",
+                    rng.uniform(100, 1500) if filtered else rng.uniform(5000, 500000),
+                    rng.uniform(1e4, 1e7),
+                    False,
+                    rng.uniform(0, 0.1),
+                    rng.uniform(0, 0.1),
+                    rng.choice(["AI agent meme", "Dog coin, fan token", "Frog with a hat", "Not affiliated with anyone"]),
+                    rng.uniform(-50, 300),
+                ))
+            from psycopg2.extras import execute_values
+            execute_values(
+                cur,
+                """
+                INSERT INTO tokens (contract, symbol, name, chain, liquidity, market_cap, honeypot,
+                                    buy_tax, sell_tax, description, price_change_24h, pair_created_at)
+                VALUES %s
+                """,
+                rows,
+                template="(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())",
+            )
+            cur.execute("INSERT INTO cleaning_jobs (token_id, stage) SELECT id, 1 FROM tokens")
+            conn.commit()
+    finally:
+        conn.close()
+
+
+def job_counts():
+    from app.core.db import get_db_connection
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT
+                    COUNT(*) FILTER (WHERE status = 2) AS done,
+                    COUNT(*) FILTER (WHERE status = 3) AS failed,
+                    COUNT(*) FILTER (WHERE status = 1 OR (status = 0 AND next_run_at <= NOW())) AS pending,
+                    COUNT(*) FILTER (WHERE status = 0 AND next_run_at > NOW()) AS retrying
+                FROM cleaning_jobs
+            """)
+            row = cur.fetchone()
+            cur.execute("SELECT COUNT(*) AS n FROM pg_stat_activity WHERE datname = current_database()")
+            row["db_backends"] = cur.fetchone()["n"]
+            conn.commit()
+            return row
+    finally:
+        conn.close()
+
+
+def run_worker_scenario(args):
+    import main
+
+    samples = {1: [], 2: [], 3: []}
+    lock = threading.Lock()
+    process_unit = main.process_unit
+
+    def timed_unit(unit):
+        start = time.monotonic()
+        try:
+            process_unit(unit)
+        finally:
+            elapsed = time.monotonic() - start
+            with lock:
+                for job in unit:
+                    samples[job["stage"]].append(elapsed)
+
+    main.process_unit = timed_unit
+    start = time.monotonic()
+    threading.Thread(target=main.run_worker, name="bench-worker", daemon=True).start()
+
+    counts = job_counts()
+    while time.monotonic() - start < args.timeout:
+        time.sleep(0.5)
+        counts = job_counts()
+        if counts["pending"] == 0 and counts["retrying"] == 0:
+            break
+    # group commit 缓冲区可能还有最后一批
+    main.persist_buffer.flush()
+    elapsed = time.monotonic() - start
+    counts = job_counts()
+
+    finished = counts["done"] + counts["failed"]
+    print(f"\n[worker] mode={args.mode} elapsed={elapsed:.2f}s jobs_finished={finished} "
+          f"jobs/sec={finished / elapsed:.2f} done={counts['done']} failed={counts['failed']} "
+          f"left={counts['pending'] + counts['retrying']} db_backends={counts['db_backends']}")
+    for stage, values in samples.items():
+        print(latency_row(f"stage {stage}", values))
+
+
+def claim_states(limit):
+    import main
+    from app.services.scheduler import pull_jobs
+
+    states = []
+    while len(states) < limit:
+        jobs = pull_jobs(limit=min(100, limit - len(states)))
+        if not jobs:
+            break
+        states += [state for state in map(main.load_state, jobs) if state is not None]
+    return states
+
+
+def run_graph_scenario(args):
+    from app.agent.graph import graph
+
+    states = claim_states(args.tokens)
+    samples = []
+    start = time.monotonic()
+    for state in states:
+        t0 = time.monotonic()
+        graph.invoke(state)
+        samples.append(time.monotonic() - t0)
+    elapsed = time.monotonic() - start
+    print(f"\n[graph] invocations={len(samples)} elapsed={elapsed:.2f}s jobs/sec={len(samples) / elapsed if elapsed else 0:.2f}")
+    print(latency_row("graph.invoke", samples))
+
+
+def run_persist_scenario(args):
+    from app.services.persistence import persist_result
+
+    states = claim_states(args.tokens)
+    samples = []
+    start = time.monotonic()
+    for state in states:
+        state = {**state, "stage": 2, "status": "passed", "tags": ["Bench"], "vibe_score": 40,
+                 "risk_level": "Low", "short_comment": "bench"}
+        t0 = time.monotonic()
+        persist_result(state)
+        samples.append(time.monotonic() - t0)
+    elapsed = time.monotonic() - start
+    print(f"\n[persist] writes={len(samples)} elapsed={elapsed:.2f}s writes/sec={len(samples) / elapsed if elapsed else 0:.2f}")
+    print(latency_row("persist_result", samples))
+
+
+def run_alpha_scenario(args):
+    from app.services.alpha_detective import AlphaDetective
+    from app.core.config import config
+
+    detective = AlphaDetective()
+    mints = [f"BenchMint{i:04d}" for i in range(max(1, args.tokens // 10))]
+    samples = []
+    start = time.monotonic()
+    for mint in mints:
+        t0 = time.monotonic()
+        detective.analyze_token(mint, deadline=config.ALPHA_DEADLINE)
+        samples.append(time.monotonic() - t0)
+    elapsed = time.monotonic() - start
+    print(f"\n[alpha] tokens={len(samples)} elapsed={elapsed:.2f}s tokens/sec={len(samples) / elapsed if elapsed else 0:.2f}")
+    print(latency_row("analyze_token", samples))
+
+
+def report(upstreams):
+    from app.core.db import pool_stats
+    from app.core.metrics import NODE_LATENCY, DB_QUERY_LATENCY, LLM_TOKENS
+    from app.core.ratelimit import limiter_snapshots
+
+    print("\n[nodes] (histogram estimates)")
+    for histogram in (NODE_LATENCY, DB_QUERY_LATENCY):
+        for labels in histogram.label_sets():
+            name = next(iter(labels.values()))
+            print(
+                f"  {name:<20} p50={fmt_ms(histogram.quantile(0.5, **labels)):>9} "
+                f"p95={fmt_ms(histogram.quantile(0.95, **labels)):>9} p99={fmt_ms(histogram.quantile(0.99, **labels)):>9}"
+            )
+    print(f"\n[connections] upstream={upstreams.stats()}")
+    print(f"[connections] db_pool={pool_stats()}")
+    print(f"[limiters] {limiter_snapshots()}")
+    print(f"[tokens] {LLM_TOKENS.render()}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.database_url:
+        sys.exit("需要 --database-url 或 BENCH_DATABASE_URL (会清空表, 请勿指向生产库)")
+    random.seed(args.seed)
+
+    upstreams = FakeUpstreams(
+        llm=Profile(args.llm_latency, args.llm_sigma, args.llm_error_rate, args.llm_throttle_rate),
+        helius=Profile(args.helius_latency, 0.4, args.upstream_error_rate),
+        birdeye=Profile(args.birdeye_latency, 0.5, args.upstream_error_rate),
+        holders=args.holders,
+    ).start()
+    configure_env(args, upstreams)
+    print(f"[*] fake upstreams at {upstreams.base_url}")
+
+    # worker 线程启动后不会退出, all 时放在最后
+    scenarios = ("persist", "graph", "alpha", "worker") if args.scenario == "all" else (args.scenario,)
+    runners = {
+        "worker": run_worker_scenario,
+        "graph": run_graph_scenario,
+        "persist": run_persist_scenario,
+        "alpha": run_alpha_scenario,
+    }
+    for scenario in scenarios:
+        reset_database(random.Random(args.seed), args)
+        runners[scenario](args)
+    report(upstreams)
+    upstreams.stop()
+
+
+if __name__ == "__main__":
+    main()
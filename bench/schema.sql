@@ -0,0 +1,101 @@
+-- 基准测试用的最小表结构 (只包含 worker 实际读写的列)
+-- 仅用于本地 / 一次性数据库, bench/run.py 每次运行前会清空这些表
+
+CREATE TABLE IF NOT EXISTS tokens (
+    id SERIAL PRIMARY KEY,
+    contract TEXT NOT NULL,
+    symbol TEXT,
+    name TEXT,
+    chain TEXT,
+    liquidity NUMERIC,
+    market_cap NUMERIC,
+    honeypot BOOLEAN,
+    buy_tax NUMERIC,
+    sell_tax NUMERIC,
+    description TEXT,
+    pair_created_at TIMESTAMPTZ,
+    image_url TEXT,
+    price_change_24h DOUBLE PRECISION
+);
+
+CREATE TABLE IF NOT EXISTS cleaning_jobs (
+    id SERIAL PRIMARY KEY,
+    token_id INTEGER NOT NULL REFERENCES tokens(id),
+    stage INTEGER NOT NULL,
+    status INTEGER NOT NULL DEFAULT 0,  -- 0 待处理 / 1 处理中 / 2 完成 / 3 失败
+    retries INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    bypass_cache BOOLEAN NOT NULL DEFAULT FALSE,
+    lease_expires_at TIMESTAMPTZ,
+    leased_by TEXT,
+    next_run_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    UNIQUE (token_id, stage)
+);
+
+CREATE INDEX IF NOT EXISTS cleaning_jobs_claim_idx ON cleaning_jobs (stage, next_run_at, id) WHERE status = 0;
+CREATE INDEX IF NOT EXISTS cleaning_jobs_lease_idx ON cleaning_jobs (lease_expires_at) WHERE status = 1;
+
+CREATE TABLE IF NOT EXISTS token_tags (
+    id SERIAL PRIMARY KEY,
+    token_id INTEGER NOT NULL,
+    tags JSONB,
+    vibe_score INTEGER,
+    risk_hint TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS analysis_reports (
+    id SERIAL PRIMARY KEY,
+    token_id INTEGER NOT NULL,
+    report_text TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS token_alpha (
+    token_id INTEGER PRIMARY KEY,
+    smart_money_score DOUBLE PRECISION,
+    holder_concentration DOUBLE PRECISION,
+    is_cabal_confirmed BOOLEAN,
+    top_holders_pnl JSONB,
+    degen_score DOUBLE PRECISION,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS "Project" (
+    id TEXT PRIMARY KEY,
+    symbol TEXT,
+    name TEXT,
+    "imageUrl" TEXT,
+    "chainId" TEXT,
+    "contractAddress" TEXT,
+    "marketCap" TEXT,
+    "liquidity" TEXT,
+    "priceChange24h" DOUBLE PRECISION,
+    age TEXT,
+    "safetyLevel" TEXT,
+    tags TEXT[],
+    "riskHint" TEXT,
+    description TEXT,
+    "aiReport" TEXT,
+    "hypeScore" INTEGER,
+    type TEXT
+);
+
+CREATE TABLE IF NOT EXISTS job_checkpoints (
+    job_id INTEGER NOT NULL,
+    node TEXT NOT NULL,
+    output JSONB NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (job_id, node)
+);
+
+CREATE TABLE IF NOT EXISTS report_fingerprints (
+    token_id INTEGER PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    inputs JSONB NOT NULL,
+    report_id INTEGER,
+    reason TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
@@ -1,63 +1,289 @@
 ﻿import time
-from app.services.scheduler import pull_jobs, get_token_details
-from app.agent.graph import graph
-from app.agent.nodes import slm_tagger_node, deep_dive_node
-from app.services.persistence import persist_result, mark_job_failed
+import asyncio
+from app.services.scheduler import pull_jobs, get_token_details, job_backlog
+from app.agent.graph import graph, filtered_graph
+from app.agent.nodes import rule_filter_batch, slm_tagger_node, slm_tagger_batch, deep_dive_node
+from app.services.persistence import persist_node, persist_results, persist_buffer, mark_job_failed, _fail_jobs
+from app.services.executor import AsyncJobExecutor
+from app.services.tag_cache import tag_cache, ensure_bypass_column
+from app.services.notifier import JobWaiter, install_notify_trigger
+from app.services.leases import ensure_lease_columns, lease_keeper
+from app.services.checkpoints import ensure_checkpoint_table, load_checkpoints
+from app.services.report_freshness import ensure_fingerprint_table
+from app.services.supervisor import shutdown_event, current_budget, worker_slot, install_shutdown_handlers, run_supervisor
 from app.core.config import config
+from app.core.db import pool_stats
+from app.core.hedging import slm_hedger
+from app.core.llm_router import slm_router, llm_router
+from app.core.ratelimit import limiter_snapshots
+from app.core.metrics import registry, flatten_stats, start_metrics_server
+from app.services.alpha_detective import wallet_pnl_cache
+
+
+def build_state(job, token):
+    return {
+        "job_id": job["id"],
+        "token_id": job["token_id"],
+        "contract": token["contract"],
+        "symbol": token["symbol"] or "Unknown",
+        "name": token["name"] or "Unknown",
+        "stage": job["stage"],
+        "data": token,
+        "tags": [],
+        "vibe_score": None,
+        "report": None,
+        "status": "pending",
+        "error_msg": None,
+        "bypass_cache": bool(job.get("bypass_cache")),
+    }
+
+
+def load_state(job):
+    # pull_jobs 已在认领时 join 出 token, 缺失时才回退到单独查询
+    token = job["token"] if "token" in job else get_token_details(job["token_id"])
+    if not token:
+        mark_job_failed(job["id"], "token not found", stage=job["stage"])
+        return None
+    state = build_state(job, token)
+    # 只有重试的任务才可能有检查点, 首次执行不多查一次
+    if job.get("retries") and config.CHECKPOINTS:
+        state["checkpoints"] = load_checkpoints(job["id"])
+    return state
+
+
+def run_stage(state, prefiltered=False):
+    """执行一个阶段并落库, 返回最终 state (CHAIN_STAGES 时可能带 next_job)"""
+    # 根据任务阶段路由到对应的 Agent
+    if state["stage"] == 1:
+        print(f"[*] [Main] Job:{state['job_id']} Stage:1 -> Entering Graph")
+        return (filtered_graph if prefiltered else graph).invoke(state)
+    if state["stage"] == 2:
+        print(f"[*] [Main] Job:{state['job_id']} Stage:2 -> Manual Node Call")
+        res = slm_tagger_node(state)
+    elif state["stage"] == 3:
+        print(f"[*] [Main] Job:{state['job_id']} Stage:3 -> Manual Node Call")
+        res = deep_dive_node(state)
+    else:
+        return state
+    return {**res, **(persist_node(res) or {})}
+
+
+def chained_state(res):
+    """下一阶段已由本 worker 认领时, 沿用内存中的 token 数据与本阶段结果继续执行"""
+    next_job = res.get("next_job")
+    if not next_job:
+        return None
+    return {
+        **res,
+        "job_id": next_job["id"],
+        "stage": next_job["stage"],
+        "status": "pending",
+        "error_msg": None,
+        "report": None,
+        "report_id": None,
+        "report_fingerprint": None,
+        "checkpoints": None,
+        "next_job": None,
+    }
+
+
+def run_chain(state, prefiltered=False):
+    while state is not None:
+        lease_keeper.begin([state["job_id"]])
+        try:
+            res = run_stage(state, prefiltered)
+        except Exception as e:
+            print(f"[!] [Main] Job:{state['job_id']} 运行崩溃: {e}")
+            mark_job_failed(state["job_id"], str(e), stage=state["stage"])
+            return
+        state, prefiltered = chained_state(res), False
+
+
+def process_job(job):
+    """执行单个任务 (sync / async 两种模式共用)"""
+    # 预过滤时已构建过 state (含 L1 结果), 直接复用, 不再重复查 token / 检查点
+    state = job.get("state") or load_state(job)
+    if state is None:
+        return
+    run_chain(state, job.get("prefiltered"))
+
+
+def prefilter_jobs(jobs):
+    """stage 1 任务先整批跑 L1 规则, 被过滤的一次性批量落库, 只把通过的交给 graph"""
+    stage1 = [job for job in jobs if job["stage"] == 1]
+    if not config.PREFILTER_BATCH or not stage1:
+        return jobs
+
+    states = [state for state in map(load_state, stage1) if state is not None]
+    results = rule_filter_batch(states)
+    dropped = [res for res in results if res["status"] != "passed"]
+    try:
+        persist_results(dropped)
+    except Exception as e:
+        print(f"[!] [Main] L1 批量落库失败: {e}")
+        _fail_jobs([(res, str(e)) for res in dropped])
+
+    passed = {res["job_id"]: res for res in results if res["status"] == "passed"}
+    survivors = []
+    for job in jobs:
+        if job["stage"] != 1:
+            survivors.append(job)
+        elif job["id"] in passed:
+            job["prefiltered"] = True
+            job["state"] = passed[job["id"]]
+            survivors.append(job)
+    return survivors
+
+
+def process_slm_batch(jobs):
+    """stage 2 批量打标: 一次 LLM 请求处理一组任务, 结果一个事务写入"""
+    states = [state for state in map(load_state, jobs) if state is not None]
+    lease_keeper.begin([state["job_id"] for state in states])
+    print(f"[*] [Main] Jobs:{[s['job_id'] for s in states]} Stage:2 -> Batched Node Call")
+    try:
+        results = slm_tagger_batch(states)
+    except Exception as e:
+        print(f"[!] [Main] Stage:2 批量运行崩溃: {e}")
+        for state in states:
+            mark_job_failed(state["job_id"], str(e), stage=state["stage"])
+        return
+
+    # 批量单元不做链式执行 (stage 3 本来也不链): 下一阶段任务正常入队, 由 executor 按 STAGE3_CONCURRENCY 调度
+    try:
+        persist_results(results)
+    except Exception as e:
+        print(f"[!] [Main] Stage:2 批量写入崩溃: {e}")
+        for res in results:
+            mark_job_failed(res["job_id"], str(e), stage=res["stage"])
+
+
+def plan_units(jobs):
+    """stage 2 任务按 SLM_BATCH_SIZE 打包成一组, 其余任务各自独立执行"""
+    size = config.SLM_BATCH_SIZE
+    if size <= 1:
+        return [[job] for job in jobs]
+    units = [[job] for job in jobs if job["stage"] != 2]
+    tagging = [job for job in jobs if job["stage"] == 2]
+    units += [tagging[i:i + size] for i in range(0, len(tagging), size)]
+    return units
+
+
+def process_unit(unit):
+    if len(unit) == 1:
+        process_job(unit[0])
+    else:
+        process_slm_batch(unit)
+
+
+def collect_runtime_stats():
+    """抓取时把连接池 / 缓存 / 对冲 / 路由 / 限流器的现有统计转成 gauge"""
+    if not worker_slot():
+        # 积压是全局数据, prefork 时只由 slot 0 查询导出
+        for row in job_backlog():
+            yield "zivv_job_backlog", {"stage": row["stage"], "status": row["status"]}, row["jobs"]
+    yield from flatten_stats("zivv_db_pool", pool_stats())
+    yield from flatten_stats("zivv_tag_cache", tag_cache.stats())
+    yield from flatten_stats("zivv_wallet_pnl_cache", wallet_pnl_cache.stats())
+    yield from flatten_stats("zivv_slm_hedge", slm_hedger.snapshot())
+    yield from flatten_stats("zivv_lease", lease_keeper.snapshot())
+    for router in (slm_router, llm_router):
+        for endpoint, snap in router.snapshot().items():
+            labels = {"tier": router.tier, "endpoint": endpoint}
+            yield "zivv_router_circuit_open", labels, snap["state"] != "closed"
+            yield from flatten_stats("zivv_router", snap, **labels)
+    for name, snap in limiter_snapshots().items():
+        yield from flatten_stats("zivv_ratelimit", snap, upstream=name)
 
 
 def run_worker():
     print("[*] Zivv Distributed Agent Worker 启动成功...")
-    while True:
+    if config.METRICS_PORT:
+        registry.add_collector(collect_runtime_stats)
+        # prefork 时每个子进程各占一个端口: METRICS_PORT + slot
+        start_metrics_server(config.METRICS_PORT + (worker_slot() or 0), config.METRICS_HOST)
+    if config.JOB_NOTIFY and config.JOB_NOTIFY_INSTALL_TRIGGER and not worker_slot():
+        install_notify_trigger()
+    if config.JOB_LEASE_ENSURE_SCHEMA and not worker_slot():
+        ensure_lease_columns()
+    if config.BYPASS_CACHE_ENSURE_SCHEMA and not worker_slot():
+        ensure_bypass_column()
+    if config.CHECKPOINTS and config.CHECKPOINT_ENSURE_SCHEMA:
+        ensure_checkpoint_table()
+    if config.REPORT_GATING and config.REPORT_ENSURE_SCHEMA:
+        ensure_fingerprint_table()
+    # 空闲时也要回收其他 worker 遗留的过期租约
+    lease_keeper.start()
+    waiter = JobWaiter()
+    budget = current_budget()
+
+    try:
+        if config.WORKER_MODE == "async":
+            executor = AsyncJobExecutor(
+                process_unit,
+                plan=plan_units,
+                prefilter=prefilter_jobs,
+                budget=budget,
+                unit_sizes={2: config.SLM_BATCH_SIZE},
+            )
+            asyncio.run(executor.run(pull_jobs, waiter, stop=shutdown_event))
+        else:
+            run_sync_loop(waiter, budget)
+    finally:
+        # 退出前把 group commit 缓冲区里的结果落库
+        if len(persist_buffer):
+            persist_buffer.flush()
+        print("[*] Worker 已停止")
+
+
+def run_sync_loop(waiter, budget=None):
+    while not shutdown_event.is_set():
         batch_start = time.time()
-        jobs = pull_jobs()
+        limit = config.BATCH_SIZE
+        if budget is not None:
+            limit = budget.take(limit)
+            if not limit:
+                continue
+        try:
+            jobs = pull_jobs(limit)
+        except Exception:
+            if budget is not None:
+                budget.give(limit)
+            raise
+        if budget is not None:
+            # 同步模式整批串行处理, 名额在整批结束后归还
+            budget.give(limit - len(jobs))
         if jobs:
             print(f"[*] [Worker] Pulled {len(jobs)} jobs: {[j['id'] for j in jobs]}")
         if not jobs:
-            time.sleep(config.POLL_INTERVAL)
+            waiter.idle()
             continue
+        waiter.backoff.reset()
 
-        for job in jobs:
-            token = get_token_details(job["token_id"])
-            if not token:
-                mark_job_failed(job["id"], "token not found")
-                continue
-
-            state = {
-                "job_id": job["id"],
-                "token_id": job["token_id"],
-                "contract": token["contract"],
-                "symbol": token["symbol"] or "Unknown",
-                "name": token["name"] or "Unknown",
-                "stage": job["stage"],
-                "data": token,
-                "tags": [],
-                "vibe_score": None,
-                "report": None,
-                "status": "pending",
-                "error_msg": None,
-            }
-
-            try:
-                # 根据任务阶段路由到对应的 Agent
-                if job["stage"] == 1:
-                    print(f"[*] [Main] Job:{job['id']} Stage:1 -> Entering Graph")
-                    graph.invoke(state)
-                elif job["stage"] == 2:
-                    print(f"[*] [Main] Job:{job['id']} Stage:2 -> Manual Node Call")
-                    res = slm_tagger_node(state)
-                    persist_result(res)
-                elif job["stage"] == 3:
-                    print(f"[*] [Main] Job:{job['id']} Stage:3 -> Manual Node Call")
-                    res = deep_dive_node(state)
-                    persist_result(res)
-            except Exception as e:
-                print(f"[!] [Main] Job:{job['id']} 运行崩溃: {e}")
-                mark_job_failed(job["id"], str(e))
+        try:
+            for unit in plan_units(prefilter_jobs(jobs)):
+                process_unit(unit)
+        finally:
+            if budget is not None:
+                budget.give(len(jobs))
+        if len(persist_buffer):
+            persist_buffer.flush()
         batch_cost = time.time() - batch_start
         if jobs:
-            print(f"[*] batch_size={len(jobs)} cost={batch_cost:.3f}s")
+            stats = pool_stats()
+            print(
+                f"[*] batch_size={len(jobs)} cost={batch_cost:.3f}s "
+                f"db_pool(in_use={stats.get('in_use')} waits={stats.get('waits')} wait_max={stats.get('wait_time_max', 0):.3f}s) "
+                f"tag_cache={tag_cache.stats()}"
+            )
+            if config.SLM_HEDGE:
+                print(f"[*] slm_hedge={slm_hedger.snapshot()}")
+            if len(slm_router.endpoints) > 1 or len(llm_router.endpoints) > 1:
+                print(f"[*] router slm={slm_router.snapshot()} llm={llm_router.snapshot()}")
 
 
 if __name__ == "__main__":
-    run_worker()
+    if config.WORKER_PROCESSES > 1:
+        run_supervisor(run_worker)
+    else:
+        install_shutdown_handlers()
+        run_worker()
@@ -0,0 +1,10 @@
+-- 任务租约列与回收索引 (幂等), 部署新版本 worker 前执行一次:
+--   psql "$DATABASE_URL" -f migrations/001_job_leases.sql
+-- CREATE INDEX CONCURRENTLY 不能放在事务里, 不要用 psql -1 / --single-transaction
+
+ALTER TABLE cleaning_jobs
+    ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ,
+    ADD COLUMN IF NOT EXISTS leased_by TEXT;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS cleaning_jobs_lease_idx
+    ON cleaning_jobs (lease_expires_at) WHERE status = 1;
@@ -0,0 +1,5 @@
+-- 按任务跳过 L2 标签缓存 / L3 研报复用 (幂等); 下一阶段任务沿用上一阶段的值
+--   psql "$DATABASE_URL" -f migrations/002_bypass_cache.sql
+
+ALTER TABLE cleaning_jobs
+    ADD COLUMN IF NOT EXISTS bypass_cache BOOLEAN NOT NULL DEFAULT FALSE;
@@ -0,0 +1,11 @@
+-- 研报复用 (REPORT_GATING) 使用的输入指纹表 (幂等); 设置 REPORT_ENSURE_SCHEMA=false 时需手动执行
+--   psql "$DATABASE_URL" -f migrations/003_report_fingerprints.sql
+
+CREATE TABLE IF NOT EXISTS report_fingerprints (
+    token_id INTEGER PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    inputs JSONB NOT NULL,
+    report_id INTEGER,
+    reason TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
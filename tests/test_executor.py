@@ -0,0 +1,38 @@
+import asyncio
+import threading
+import time
+
+from app.services.executor import AsyncJobExecutor
+
+
+def test_stage_budgets_scale_by_unit_size_and_inflight():
+    executor = AsyncJobExecutor(lambda unit: None, max_inflight=20, stage_limits={1: 4, 2: 2}, unit_sizes={2: 5})
+    assert executor.stage_budgets() == {1: 4, 2: 10}
+    executor._stage_jobs = {1: 3, 2: 12}
+    assert executor.stage_budgets() == {1: 1, 2: 0}
+
+
+def test_stage_limit_bounds_concurrent_units():
+    lock = threading.Lock()
+    running, peak = {1: 0, 2: 0}, {1: 0, 2: 0}
+
+    def handler(unit):
+        stage = unit[0]["stage"]
+        with lock:
+            running[stage] += 1
+            peak[stage] = max(peak[stage], running[stage])
+        time.sleep(0.02)
+        with lock:
+            running[stage] -= 1
+
+    async def run():
+        executor = AsyncJobExecutor(handler, max_inflight=10, stage_limits={1: 3, 2: 1})
+        executor.submit([{"id": i, "stage": 1 + i % 2} for i in range(10)])
+        assert executor.inflight == 10
+        await executor.drain()
+        return executor
+
+    executor = asyncio.run(run())
+    assert peak == {1: 3, 2: 1}
+    assert executor.inflight == 0
+    assert executor.stage_budgets() == {1: 3, 2: 1}
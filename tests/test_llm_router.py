@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+from app.core import llm_router as router_module
+from app.core.config import config
+from app.core.llm_router import CLOSED, HALF_OPEN, OPEN, Endpoint, LLMRouter
+
+
+class FakeUpstream:
+    def __init__(self):
+        self.fail = False
+        self.calls = []
+
+    def __call__(self, client, messages, upstream=None):
+        self.calls.append(upstream)
+        if self.fail:
+            raise ConnectionError("upstream down")
+        return "ok"
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    fake = FakeUpstream()
+    monkeypatch.setattr(router_module, "invoke_chat", fake)
+    monkeypatch.setattr(LLMRouter, "client", lambda self, ep, timeout=None: None)
+    monkeypatch.setattr(config, "ROUTER_FAILURE_THRESHOLD", 2)
+    monkeypatch.setattr(config, "ROUTER_OPEN_SECONDS", 30)
+    monkeypatch.setattr(config, "ROUTER_MAX_ATTEMPTS", 3)
+    return fake
+
+
+def _open(router, ep, upstream):
+    upstream.fail = True
+    for _ in range(config.ROUTER_FAILURE_THRESHOLD):
+        with pytest.raises(ConnectionError):
+            router.invoke([])
+    upstream.fail = False
+    assert ep.state == OPEN
+
+
+def test_single_endpoint_open_still_serves(upstream):
+    ep = Endpoint("m", "http://a")
+    router = LLMRouter("slm", [ep], timeout=1)
+    _open(router, ep, upstream)
+
+    assert router.route() == ([ep], True)
+    assert router.invoke([]) == "ok"
+    assert ep.state == CLOSED
+
+
+def test_single_endpoint_half_open_with_probe_in_flight(upstream):
+    ep = Endpoint("m", "http://a")
+    router = LLMRouter("slm", [ep], timeout=1)
+    _open(router, ep, upstream)
+    ep.opened_at = time.time() - config.ROUTER_OPEN_SECONDS - 1
+
+    # 第一个请求拿到探测名额
+    ordered, fallback = router.route()
+    assert (ordered, fallback) == ([ep], False)
+    assert ep.state == HALF_OPEN
+    assert router.claim(ep, fallback)
+    assert ep.probing
+
+    # 探测在途时其他请求走兜底, 不因为拿不到探测名额直接失败
+    assert router.route() == ([ep], True)
+    assert router.invoke([]) == "ok"
+    assert upstream.calls[-1] == router.upstream(ep)
+
+
+def test_half_open_probe_skipped_when_healthy_endpoint_exists(upstream):
+    broken, healthy = Endpoint("m", "http://a"), Endpoint("m", "http://b")
+    router = LLMRouter("slm", [broken, healthy], timeout=1)
+    broken.state, broken.opened_at = OPEN, time.time() - config.ROUTER_OPEN_SECONDS - 1
+
+    ordered, fallback = router.route()
+    assert ordered == [broken, healthy] and not fallback
+    assert router.claim(broken)
+    # 探测在途: 其他请求只用健康的 endpoint
+    assert router.route() == ([healthy], False)
+    assert not router.claim(broken)
+    assert router.invoke([]) == "ok"
+    assert upstream.calls == [router.upstream(healthy)]
+
+
+def test_failed_probe_reopens(upstream):
+    ep = Endpoint("m", "http://a")
+    router = LLMRouter("slm", [ep], timeout=1)
+    ep.state, ep.opened_at = OPEN, time.time() - config.ROUTER_OPEN_SECONDS - 1
+    upstream.fail = True
+    with pytest.raises(ConnectionError):
+        router.invoke([])
+    assert ep.state == OPEN and not ep.probing
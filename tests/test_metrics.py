@@ -0,0 +1,57 @@
+import pytest
+
+from app.core.metrics import Histogram, Registry, flatten_stats
+
+
+@pytest.fixture
+def hist():
+    hist = Histogram("zivv_test_seconds", "test", ("node",), buckets=(5, 1, 2))
+    for value in (0.5, 1, 1.5, 3, 10):
+        hist.observe(value, node="a")
+    return hist
+
+
+def test_histogram_renders_cumulative_buckets(hist):
+    assert hist.render() == [
+        'zivv_test_seconds_bucket{node="a",le="1"} 2',
+        'zivv_test_seconds_bucket{node="a",le="2"} 3',
+        'zivv_test_seconds_bucket{node="a",le="5"} 4',
+        'zivv_test_seconds_bucket{node="a",le="+Inf"} 5',
+        'zivv_test_seconds_sum{node="a"} 16.0',
+        'zivv_test_seconds_count{node="a"} 5',
+    ]
+
+
+@pytest.mark.parametrize("q, expected", [(0.2, 0.5), (0.5, 1.5), (0.7, 3.5), (0.99, 5)])
+def test_histogram_quantile_interpolates_within_bucket(hist, q, expected):
+    assert hist.quantile(q, node="a") == pytest.approx(expected)
+
+
+def test_histogram_quantile_without_samples(hist):
+    assert hist.quantile(0.5, node="b") is None
+
+
+def test_histogram_time_observes_duration():
+    hist = Histogram("zivv_test_seconds", "test")
+    with hist.time():
+        pass
+    assert hist.render()[-1] == "zivv_test_seconds_count 1"
+    assert hist.quantile(0.5) <= 0.005
+
+
+def test_registry_renders_collectors_as_gauges():
+    registry = Registry()
+    registry.counter("zivv_test_total", "test", ("outcome",)).inc(2, outcome="ok")
+    registry.add_collector(lambda: flatten_stats("zivv_pool", {"open": True, "size": 3, "name": "x", "nested": {"hits": 1}}))
+    registry.add_collector(lambda: 1 / 0)
+    assert registry.render().splitlines() == [
+        "# HELP zivv_test_total test",
+        "# TYPE zivv_test_total counter",
+        'zivv_test_total{outcome="ok"} 2',
+        "# TYPE zivv_pool_open gauge",
+        "zivv_pool_open 1",
+        "# TYPE zivv_pool_size gauge",
+        "zivv_pool_size 3",
+        "# TYPE zivv_pool_nested_hits gauge",
+        "zivv_pool_nested_hits 1",
+    ]
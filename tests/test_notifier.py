@@ -0,0 +1,54 @@
+import psycopg2
+import pytest
+
+from app.core.config import config
+from app.services import notifier
+from app.services.notifier import IdleBackoff, JobWaiter
+
+
+def test_idle_backoff_doubles_up_to_max_and_resets():
+    backoff = IdleBackoff(0.5, 3)
+    assert [backoff.next() for _ in range(5)] == [0.5, 1, 2, 3, 3]
+    backoff.reset()
+    assert backoff.next() == 0.5
+
+
+def test_idle_backoff_max_never_below_base():
+    backoff = IdleBackoff(2, 1)
+    assert [backoff.next() for _ in range(3)] == [2, 2, 2]
+
+
+@pytest.fixture
+def waiter(monkeypatch):
+    monkeypatch.setattr(config, "JOB_NOTIFY", True)
+    monkeypatch.setattr(config, "POLL_INTERVAL", 2)
+    monkeypatch.setattr(config, "POLL_INTERVAL_MIN", 0.05)
+    return JobWaiter()
+
+
+def test_short_delay_skips_due_query(waiter, monkeypatch):
+    def fail():
+        raise AssertionError("should not query")
+
+    monkeypatch.setattr(notifier, "next_due_in", fail)
+    assert waiter._cap(1.5) == 1.5
+
+
+@pytest.mark.parametrize("due, expected", [(None, 30), (5.0, 5.0), (0.0, 0.05), (60.0, 30)])
+def test_long_delay_capped_at_next_retry(waiter, monkeypatch, due, expected):
+    monkeypatch.setattr(notifier, "next_due_in", lambda: due)
+    assert waiter._cap(30) == expected
+
+
+def test_due_query_error_falls_back_to_poll_interval(waiter, monkeypatch):
+    def broken():
+        raise psycopg2.OperationalError("db down")
+
+    monkeypatch.setattr(notifier, "next_due_in", broken)
+    assert waiter._cap(30) == 2
+
+
+def test_notify_disabled_never_caps(waiter, monkeypatch):
+    waiter.enabled = False
+    monkeypatch.setattr(notifier, "next_due_in", lambda: 0.0)
+    assert waiter._cap(30) == 30
@@ -0,0 +1,128 @@
+import time
+
+import pytest
+
+from app.core import ratelimit
+from app.core.ratelimit import AdaptiveLimiter, RateLimitTimeout, Slot, parse_retry_after
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", fake)
+    return fake
+
+
+def _limiter(**kwargs):
+    return AdaptiveLimiter("test", **{"rps": 100, "burst": 10, "max_concurrency": 8, **kwargs})
+
+
+def test_throttle_halves_once_per_second(clock):
+    limiter = _limiter()
+    limiter.inflight = 3
+    limiter.release(429)
+    limiter.release(429)
+    assert (limiter.concurrency, limiter.rps) == (4, 50)
+    assert limiter.stats["throttled"] == 2 and limiter.stats["decreases"] == 1
+
+    clock.now += 1
+    limiter.release(429)
+    assert (limiter.concurrency, limiter.rps) == (2, 25)
+
+
+def test_decrease_floors_at_min_concurrency_and_five_percent_rps(clock):
+    limiter = _limiter(min_concurrency=2)
+    for _ in range(10):
+        limiter.inflight += 1
+        limiter.release(429)
+        clock.now += 1
+    assert limiter.concurrency == 2
+    assert limiter.rps == pytest.approx(5)
+
+
+def test_success_increases_additively_up_to_max(clock):
+    limiter = _limiter()
+    limiter.inflight = 1
+    limiter.release(429)
+    assert limiter.concurrency == 4
+    for _ in range(4):
+        limiter.inflight += 1
+        limiter.release(200)
+    assert limiter.concurrency == pytest.approx(5, abs=0.1)
+    assert limiter.rps == pytest.approx(54)
+
+    for _ in range(500):
+        limiter.inflight += 1
+        limiter.release(200)
+    assert (limiter.concurrency, limiter.rps) == (8, 100)
+
+
+def test_slow_response_decreases_without_counting_as_throttled(clock):
+    limiter = _limiter(latency_target=2.0)
+    limiter.inflight = 2
+    limiter.release(200, latency=1.0)
+    assert limiter.concurrency == 8
+    limiter.release(200, latency=3.0)
+    assert limiter.concurrency == 4
+    assert limiter.stats["throttled"] == 0 and limiter.stats["decreases"] == 1
+
+
+def test_retry_after_blocks_acquire(clock):
+    limiter = _limiter()
+    limiter.inflight = 1
+    limiter.release(429, retry_after=5)
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire(timeout=1)
+    assert limiter.stats["timeouts"] == 1
+
+    clock.now += 5
+    limiter.acquire(timeout=1)
+    assert limiter.inflight == 1
+
+
+def test_retry_after_never_shortens_existing_block(clock):
+    limiter = _limiter()
+    limiter.inflight = 2
+    limiter.release(429, retry_after=10)
+    limiter.release(429, retry_after=1)
+    assert limiter._blocked_until == clock.now + 10
+
+
+def test_slot_records_status_and_retry_after_from_error(clock):
+    class Response:
+        status_code = 429
+        headers = {"retry-after": "3"}
+
+    class ThrottledError(Exception):
+        response = Response()
+
+    limiter = _limiter()
+    with pytest.raises(ThrottledError):
+        with limiter.slot(timeout=0):
+            raise ThrottledError()
+    assert limiter.inflight == 0
+    assert limiter.stats["throttled"] == 1
+    assert limiter._blocked_until == clock.now + 3
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("2.5") == 2.5
+    assert parse_retry_after("-1") == 0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    http_date = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 60))
+    assert 55 < parse_retry_after(http_date) <= 60
+
+
+def test_slot_record_without_response():
+    slot = Slot()
+    slot.record_error(ConnectionError("reset"))
+    assert (slot.status, slot.retry_after) == (0, None)
@@ -0,0 +1,47 @@
+import pytest
+
+from app.core.config import config
+from app.services.report_freshness import material_changes, relative_change
+
+
+@pytest.mark.parametrize("old, new, expected", [
+    (None, None, 0.0),
+    (None, 5, 1.0),
+    (5, None, 1.0),
+    (0, 0, 0.0),
+    (100, 120, 20 / 120),
+    (120, 100, 20 / 120),
+    (-50, 50, 2.0),
+])
+def test_relative_change(old, new, expected):
+    assert relative_change(old, new) == pytest.approx(expected)
+
+
+@pytest.fixture(autouse=True)
+def thresholds(monkeypatch):
+    monkeypatch.setattr(config, "REPORT_CHANGE_THRESHOLDS", {"liquidity": 0.2, "smart_money_count": 0.5})
+
+
+def test_numeric_fields_compare_against_threshold():
+    old = {"liquidity": 100000.0, "smart_money_count": 4.0}
+    assert material_changes(old, {"liquidity": 110000.0, "smart_money_count": 5.0}) == []
+    changes = material_changes(old, {"liquidity": 130000.0, "smart_money_count": 4.0})
+    assert len(changes) == 1 and changes[0].startswith("liquidity 100000.0 -> 130000.0")
+
+
+def test_threshold_is_inclusive():
+    assert material_changes({"smart_money_count": 2.0}, {"smart_money_count": 4.0}) != []
+
+
+def test_other_fields_require_exact_match():
+    old = {"symbol": "PEPE", "honeypot": False, "market_cap": 1000.0}
+    assert material_changes(old, dict(old)) == []
+    assert material_changes(old, {**old, "market_cap": 1000.5}) == ["market_cap changed"]
+    assert material_changes(old, {**old, "honeypot": True}) == ["honeypot changed"]
+
+
+def test_field_missing_from_old_inputs_counts_as_change():
+    assert material_changes({}, {"liquidity": 5.0, "is_alpha": False}) == [
+        "liquidity None -> 5.0 (100% >= 20%)",
+        "is_alpha changed",
+    ]
@@ -0,0 +1,49 @@
+import pytest
+
+from app.agent.nodes import rule_filter_batch, rule_filter_node
+from app.core.config import config
+
+CASES = [
+    {"liquidity": 50000},
+    {"liquidity": None},
+    {"liquidity": "100"},
+    {"liquidity": 50000, "honeypot": True},
+    {"liquidity": 50000, "honeypot": "true"},
+    {"liquidity": 50000, "buy_tax": "25"},
+    {"liquidity": 50000, "buy_tax": 1, "sell_tax": 30.5},
+    {"liquidity": 50000, "buy_tax": "abc"},
+    {"liquidity": 50000, "buy_tax": 1, "sell_tax": "n/a"},
+    {"liquidity": 50000, "buy_tax": 99, "sell_tax": "n/a"},
+    {"liquidity": 10, "honeypot": True, "buy_tax": "abc"},
+    {"liquidity": 50000, "honeypot": True, "buy_tax": 99},
+]
+
+
+@pytest.fixture(autouse=True)
+def thresholds(monkeypatch):
+    monkeypatch.setattr(config, "MIN_LIQUIDITY", 1000)
+    monkeypatch.setattr(config, "MAX_TAX", 10)
+    monkeypatch.setattr(config, "REQUIRE_NOT_HONEYPOT", True)
+
+
+def _state(i, data):
+    return {"job_id": i, "symbol": f"T{i}", "contract": f"0x{i}", "data": data, "status": "pending"}
+
+
+def _verdict(state):
+    return state["status"], state.get("report"), state.get("error_msg")
+
+
+@pytest.mark.parametrize("honeypot_check", [True, False])
+def test_batch_matches_node(monkeypatch, honeypot_check):
+    monkeypatch.setattr(config, "REQUIRE_NOT_HONEYPOT", honeypot_check)
+    states = [_state(i, data) for i, data in enumerate(CASES)]
+    batch = rule_filter_batch(states)
+    assert [_verdict(res) for res in batch] == [_verdict(rule_filter_node(state)) for state in states]
+    assert [res["job_id"] for res in batch] == [state["job_id"] for state in states]
+
+
+def test_batch_reports_unparseable_liquidity():
+    res, = rule_filter_batch([_state(0, {"liquidity": "abc"})])
+    assert res["status"] == "error"
+    assert res["error_msg"].startswith("liquidity parse error")
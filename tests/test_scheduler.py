@@ -0,0 +1,35 @@
+from app.services.scheduler import plan_quotas
+
+
+def test_plan_quotas_split_by_weight():
+    assert plan_quotas(10, {1: 1, 2: 1}) == {1: 5, 2: 5}
+    assert plan_quotas(10, {1: 3, 2: 1}) == {1: 8, 2: 2}
+
+
+def test_plan_quotas_budget_cut_goes_to_other_stages():
+    assert plan_quotas(10, {1: 1, 2: 1, 3: 1}, budgets={3: 1}) == {1: 5, 2: 4, 3: 1}
+    assert plan_quotas(10, {1: 1, 2: 1}, budgets={1: 0, 2: 4}) == {2: 4}
+
+
+def test_plan_quotas_skips_zero_weight():
+    assert plan_quotas(4, {1: 0, 2: 1}) == {2: 4}
+    assert plan_quotas(4, {1: 0}) == {}
+
+
+def test_plan_quotas_carry_rotates_single_slot():
+    carry = {}
+    picks = [plan_quotas(1, {1: 1, 2: 1, 3: 1}, carry=carry) for _ in range(6)]
+    counts = {stage: sum(p.get(stage, 0) for p in picks) for stage in (1, 2, 3)}
+    assert all(sum(p.values()) == 1 for p in picks)
+    assert counts == {1: 2, 2: 2, 3: 2}
+
+
+def test_plan_quotas_carry_stays_bounded_while_capped():
+    carry = {}
+    for _ in range(50):
+        plan_quotas(1, {1: 1, 2: 1}, budgets={1: 0}, carry=carry)
+    assert -1.0 <= carry.get(1, 0.0) <= 1.0
+    # 预算解除后按权重轮流, 不会一次性补偿积欠
+    picks = [plan_quotas(1, {1: 1, 2: 1}, carry=carry) for _ in range(4)]
+    assert sum(p.get(1, 0) for p in picks) == 2
+
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+from app.core.structured import StructuredOutputError, coerce_slm_item, extract_json, parse_json_output, repair_json
+
+
+def test_extract_json_ignores_markdown_and_prose():
+    content = 'Here you go:\n```json\n{"tags": ["Meme"], "vibe_score": 70}\n```\nHope it helps'
+    assert json.loads(extract_json(content)) == {"tags": ["Meme"], "vibe_score": 70}
+
+
+def test_extract_json_ignores_brackets_inside_strings():
+    content = '{"short_comment": "looks like {a} [b]", "vibe_score": 1} trailing }'
+    assert json.loads(extract_json(content)) == {"short_comment": "looks like {a} [b]", "vibe_score": 1}
+
+
+def test_truncated_string_keeps_complete_pairs():
+    content = '{"tags":["a"],"vibe_score":70,"short_comment":"cut off'
+    assert json.loads(extract_json(content)) == {"tags": ["a"], "vibe_score": 70}
+
+
+def test_truncated_number_drops_only_that_pair():
+    content = '{"tags":["a"],"vibe_score":70,"risk_level":"Low","score":4'
+    assert json.loads(extract_json(content)) == {"tags": ["a"], "vibe_score": 70, "risk_level": "Low"}
+
+
+@pytest.mark.parametrize("tail", ['"risk_level"', '"risk_level":', '"risk_level": ', '"risk_le', ""])
+def test_truncated_dangling_key(tail):
+    content = '{"tags":["a"],"vibe_score":70,' + tail
+    assert json.loads(extract_json(content)) == {"tags": ["a"], "vibe_score": 70}
+
+
+def test_truncated_array():
+    assert json.loads(extract_json('[{"vibe_score": 1}, {"vibe_score": 2}, {"vibe_sc')) == [
+        {"vibe_score": 1}, {"vibe_score": 2}, {},
+    ]
+    assert json.loads(extract_json('{"tags": ["a", "b", "c')) == {"tags": ["a", "b"]}
+
+
+def test_extract_json_without_json():
+    with pytest.raises(StructuredOutputError):
+        extract_json("no json here")
+
+
+def test_parse_skips_brackets_in_prose():
+    assert parse_json_output('see [1] then {"tags": ["a"], "vibe_score": 70}') == {"tags": ["a"], "vibe_score": 70}
+    assert parse_json_output('see [note] then [{"vibe_score": 1}]') == [{"vibe_score": 1}]
+
+
+def test_parse_falls_back_to_plain_array():
+    assert parse_json_output("answer: [1, 2]") == [1, 2]
+
+
+def test_parse_repairs_common_mistakes():
+    content = "{'tags': ['Meme',], 'vibe_score': 7/10, 'ok': true, 'note': null}"
+    assert parse_json_output(content) == {"tags": ["Meme"], "vibe_score": "7/10", "ok": True, "note": None}
+
+
+def test_parse_keeps_literals_inside_strings():
+    content = """{'short_comment': 'LP lock is true, mint null', "note": "it's false \\"null\\"", 'ok': false, 'x': null}"""
+    assert parse_json_output(content) == {
+        "short_comment": "LP lock is true, mint null", "note": 'it\'s false "null"', "ok": False, "x": None,
+    }
+
+
+def test_parse_unparseable():
+    with pytest.raises(StructuredOutputError):
+        parse_json_output("{not: json: at all}")
+    with pytest.raises(StructuredOutputError):
+        parse_json_output("plain text")
+
+
+def test_repair_json():
+    assert repair_json('{"a": 8/10, "b": [1,],}') == '{"a": "8/10", "b": [1]}'
+    assert repair_json('{\n// comment\n"a": “x”}') == '{\n\n"a": "x"}'
+
+
+def test_coerce_slm_item():
+    item = coerce_slm_item({"Tags": "Meme, AI", "vibe_score": "8/10", "risk_level": "high risk", "short_comment": " ok "})
+    assert item == {"tags": ["Meme", "AI"], "vibe_score": 80, "risk_level": "High", "short_comment": "ok"}
+    assert coerce_slm_item({"tags": [], "score": 120})["vibe_score"] == 100
+    assert coerce_slm_item({"tags": [], "vibe_score": 50})["risk_level"] == "Medium"
+
+
+@pytest.mark.parametrize("item", [[], {"vibe_score": 50}, {"tags": ["a"]}, {"tags": ["a"], "vibe_score": True}])
+def test_coerce_slm_item_rejects(item):
+    with pytest.raises(StructuredOutputError):
+        coerce_slm_item(item)